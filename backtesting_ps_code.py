@@ -1,13 +1,19 @@
+import copy
+import numpy as np
 import pandas as pd
 from easydict import EasyDict
 from datetime import datetime
-from utils import get_cfg, load_high_low, adjust, generate_csv, trade_log, tpsl, convert_to_open_timings, handle_date_time
+from typing import Callable
+from utils import get_cfg, load_high_low, adjust, generate_csv, trade_log, tpsl, tpsl_intrabar, tpsl_coarse, _scan_closes, convert_to_open_timings, handle_date_time, index_range, to_timestamps
 from strategy import BaseStrategy
+from engine import EngineState
+from metrics import MetricsAccumulator, early_stop_reason
+from range_index import tpsl_indexed, first_crossing
 
 
 def generate_signals(
     strategy: BaseStrategy,
-    glob: EasyDict,
+    glob: EngineState,
     high_csv: pd.DataFrame,
     low_csv: pd.DataFrame,
     trade_sheet: pd.DataFrame,
@@ -21,12 +27,23 @@ def generate_signals(
     capital: float = 1000,
     entry_date: datetime = None,
     exit_date: datetime = None,
-):
+    fills: str = "close",
+    tie_break: str = "sl",
+    metrics: MetricsAccumulator = None,
+    resume: EasyDict = None,
+    open_times: EasyDict = None,
+    coarse: EasyDict = None,
+    range_index: EasyDict = None,
+    event_driven: bool = False,
+    early_stop: EasyDict = None,
+    checkpoint: Callable[[EasyDict], None] = None,
+    checkpoint_every: int = 100,
+) -> EasyDict:
     """Signal Generation for the backtesting or live trading
 
     Args:
         strategy (BaseStrategy): Strategy to be used for generating the signals
-        glob (EasyDict): Global variables to store the status of the trade
+        glob (EngineState): State of the trade, updated in place
         high_csv (pd.DataFrame): High timeframe data
         low_csv (pd.DataFrame): Low timeframe data
         trade_sheet (pd.DataFrame): Trade Book to log the trades
@@ -38,34 +55,152 @@ def generate_signals(
         capital (float, optional): Initial Capital for the trade. Defaults to 1000.
         exit_date (datetime, optional): Exit date for the trade. Defaults to None.
         entry_date (datetime, optional): Entry date for the trade. Defaults to None.
-    """
+        fills (str, optional): Exits checked against the close, or the high and low with tpsl_intrabar, of every low timeframe bar. Defaults to "close".
+        tie_break (str, optional): Exit of an intrabar bar touching both the target and a stop, sl, tp or open. Defaults to "sl".
+        metrics (MetricsAccumulator, optional): Online metrics updated on every trade. Defaults to None.
+        resume (EasyDict, optional): State returned by a previous run, the run continues from its last bar. Defaults to None.
+        open_times (EasyDict, optional): Open times of every bar from open_time_table, looked up instead of searched. Defaults to None.
+        coarse (EasyDict, optional): Block extremes from coarse_levels, the close fills only scan the blocks able to reach a level. Defaults to None.
+        range_index (EasyDict, optional): Segment trees from range_index, the close fills of fixed levels find their exit in O(log n). Defaults to None.
+        event_driven (bool, optional): Jump from bar to bar where a hook fires or a TP/SL is hit, on the signal_arrays of the strategy. Defaults to False.
+        early_stop (EasyDict, optional): Rules ending the run early, see early_stop_reason. Defaults to None.
+        checkpoint (Callable[[EasyDict], None], optional): Called with the state every checkpoint_every bars, the run can be resumed from it. Defaults to None.
+        checkpoint_every (int, optional): Bars between two checkpoints. Defaults to 100.
 
-    entry_index = 0
-    exit_index = len(high_csv) - 1
-    if entry_date:
-        entry_index = high_csv[
-            pd.to_datetime(high_csv["datetime"]) >= entry_date
-        ].index[0]
-    if exit_date:
-        if pd.to_datetime(high_csv["datetime"].iloc[-1]) <= exit_date:
-            exit_index = len(high_csv) - 1
-        else:
-            exit_index = (
-                high_csv[pd.to_datetime(high_csv["datetime"]) > exit_date].index[0] - 1
-            )
+    Returns:
+        EasyDict: State at the last bar, before the position is squared off, with the early stop reason if any
+    """
 
+    entry_index, exit_index = index_range(high_csv, entry_date, exit_date)
 
     open_time_low_pointer = 0
     future_time_diff = 15
     low_pointer = 1
     pnl = 0
-    for i in range(entry_index, exit_index):
-        low_pointer = adjust(low_pointer, i, low_csv, high_csv)
+
+    if fills == "intrabar" or event_driven:
+        low_ns, high_ns = to_timestamps(low_csv["datetime"]), to_timestamps(high_csv["datetime"])
+
+    def open_time(i: int, open_time_low_pointer: int):
+        if open_times is not None:
+            return open_times.flag[i], open_times.time[i], open_times.pointer[i]
+        current_time = handle_date_time(high_csv["datetime"].iloc[i])
+        return convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+
+    def snapshot(index: int) -> EasyDict:
+        return EasyDict(
+            index=index,
+            low_pointer=low_pointer,
+            open_time_low_pointer=open_time_low_pointer,
+            capital=capital,
+            glob=copy.copy(glob),
+            metrics=copy.deepcopy(metrics),
+            trade_rows=len(trade_sheet),
+            signal_rows=len(signal_csv),
+            stopped=stopped,
+        )
+
+    if resume is not None:
+        entry_index = resume.index
+        low_pointer = resume.low_pointer
+        open_time_low_pointer = resume.open_time_low_pointer
+        capital = resume.capital
+    stopped = None
+    if early_stop is not None:
+        if metrics is None:
+            metrics = MetricsAccumulator(capital)
+        checkpoint_index = exit_index
+        if early_stop.get("checkpoint_date"):
+            checkpoint_time = pd.Timestamp(handle_date_time(early_stop.checkpoint_date)).value
+            checkpoint_index = int(np.searchsorted(to_timestamps(high_csv["datetime"]), checkpoint_time))
+    bars = range(entry_index, exit_index)
+    if event_driven:
+        events = signal_bars(strategy, entry_index, exit_index)
+        closes = low_csv["close"].to_numpy(dtype=np.float64)
+
+        def window_start(i: int) -> int:
+            """First low timeframe bar of high timeframe bar i, where adjust moves the low pointer"""
+            return int(np.searchsorted(low_ns, high_ns[i]))
+
+        def skip_exits(j: int, target: int) -> int:
+            """Trailing price moved over the windows of bars j to target - 1, the bar of their first TP/SL hit if any"""
+            start, end = max(low_pointer, window_start(j)), window_start(target)
+            if end <= start:
+                return target
+            status = glob.status
+            target_price = glob.entry_price + status * glob.entry_price * glob.tp
+            stop_loss = glob.entry_price - status * glob.entry_price * glob.sl
+            margin_price = glob.entry_price - status * margin / leverage * glob.entry_price
+            if range_index is not None and not trailing:
+                stop = status * max(status * stop_loss, status * margin_price)
+                hit = first_crossing(range_index, start, end, status, target_price, stop)
+            else:
+                offset = _scan_closes(closes[start:end], copy.copy(glob), target_price, stop_loss, margin_price, trailing)
+                hit = start + offset if offset >= 0 else -1
+            if hit >= 0:
+                # The bar of the hit runs its own tpsl, the trailing price stops at its window
+                target = int(np.searchsorted(high_ns, low_ns[hit], "right")) - 1
+                end = max(start, window_start(target))
+            if end > start:
+                skipped = closes[start:end]
+                glob.trailing_price = max(glob.trailing_price, skipped.max()) if status == 1 else min(glob.trailing_price, skipped.min())
+            return target
+
+        def next_bar(j: int) -> int:
+            """First bar from j on where the state can change"""
+            if j >= exit_index:
+                return j
+            if early_stop is not None and early_stop_reason(metrics, early_stop, j >= checkpoint_index):
+                return j
+            fired = {0: events.flat, 1: events.long, -1: events.short}[glob.status]
+            k = int(np.searchsorted(fired, j))
+            target = int(fired[k]) if k < len(fired) else exit_index
+            if checkpoint is not None:
+                target = min(target, entry_index + max(1, -(-(j - entry_index) // checkpoint_every)) * checkpoint_every)
+            if early_stop is not None and j < checkpoint_index:
+                target = min(target, checkpoint_index)
+            if glob.status != 0 and target > j:
+                if fills == "intrabar":
+                    return j
+                target = skip_exits(j, target)
+            return target
+
+        def event_bars():
+            i = entry_index
+            while i < exit_index:
+                yield i
+                i = next_bar(i + 1)
+
+        bars = event_bars()
+    for i in bars:
+        if checkpoint is not None and i > entry_index and (i - entry_index) % checkpoint_every == 0:
+            # State before bar i is processed, a resumed run starts at bar i
+            checkpoint(snapshot(i))
+        if early_stop is not None:
+            stopped = early_stop_reason(metrics, early_stop, i >= checkpoint_index)
+            if stopped:
+                print(f"Stopping early at {high_csv['datetime'].iloc[i]}: {stopped}")
+                exit_index = i
+                break
+        if event_driven:
+            low_pointer = max(low_pointer, window_start(i))
+        else:
+            low_pointer = adjust(low_pointer, i, low_csv, high_csv)
         # If you are currently in a position check for tpsl
         if glob.status != 0:
-            hit, ind = tpsl(low_pointer,i, low_csv,high_csv, margin, leverage, glob, trailing)
+            if fills == "intrabar":
+                hit, ind, exit_price = tpsl_intrabar(
+                    low_pointer, i, low_csv, low_ns, high_ns, margin, leverage, glob, trailing, tie_break
+                )
+            else:
+                if range_index is not None and not trailing:
+                    hit, ind = tpsl_indexed(low_pointer, i, range_index, margin, leverage, glob, trailing)
+                elif coarse is not None:
+                    hit, ind = tpsl_coarse(low_pointer, i, coarse, margin, leverage, glob, trailing)
+                else:
+                    hit, ind = tpsl(low_pointer,i, low_csv,high_csv, margin, leverage, glob, trailing)
+                exit_price = low_csv["close"].iloc[ind]
             date_time = low_csv["datetime"].iloc[ind]
-            exit_price = low_csv["close"].iloc[ind]
             if hit != 0:
                 pnl = (
                     capital
@@ -78,11 +213,14 @@ def generate_signals(
                     * glob.status
                     * leverage
                 )
-                glob.total_fee += capital * slippage
-                capital -= capital * slippage
+                fee = capital * slippage
+                glob.total_fee += fee
+                capital -= fee
                 capital += pnl
                 signal = -1 * glob.status
                 glob.status = 0
+                if metrics is not None:
+                    metrics.on_close(capital, pnl, p, fee, date_time)
                 if pnl > 0:
                     trade_log(
                         date_time,
@@ -119,9 +257,10 @@ def generate_signals(
                         0,
                         trade_sheet,
                     )
-                generate_csv(ind, 0, signal, low_csv, high_csv, signal_csv, "tpsl",(low_csv.loc[ind,"datetime"]))
+                generate_csv(ind, 0, signal, low_csv, high_csv, signal_csv, "tpsl",(low_csv.loc[ind,"datetime"]), exit_price)
                 glob.trades += 1
                 continue
+        bar = strategy.cursor.move(i)
         date_time = high_csv["datetime"].iloc[i]
         exit_price = high_csv["close"].iloc[i]
         pnl = (
@@ -136,15 +275,18 @@ def generate_signals(
             * leverage
         )
         if glob.status == 1:
-            if strategy.check_short_entry(i):
-                current_time = handle_date_time(high_csv["datetime"].iloc[i])
-                open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+            if strategy.check_short_entry(bar):
+                open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(i, open_time_low_pointer)
                 if open_time_flag == 0:
                     continue
-                glob.total_fee += capital * slippage
-                capital -= capital * slippage
+                fee = capital * slippage
+                glob.total_fee += fee
+                capital -= fee
                 capital += pnl
                 glob.status = -1
+                if metrics is not None:
+                    metrics.on_close(capital, pnl, p, fee, time_to_be_noted)
+                    metrics.on_entry(glob.status, time_to_be_noted)
                 signal = -2
                 stop_loss = glob.entry_price - glob.entry_price * glob.status * glob.sl
                 trade_log(
@@ -161,15 +303,17 @@ def generate_signals(
                 print("=>Short at ",date_time)
                 generate_csv(i, 1, signal, low_csv, high_csv, signal_csv,"market",time_to_be_noted)
                 glob.trades += 1
-            if strategy.check_long_exit(i):
-                current_time = handle_date_time(high_csv["datetime"].iloc[i])
-                open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+            if strategy.check_long_exit(bar):
+                open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(i, open_time_low_pointer)
                 if open_time_flag == 0:
                     continue
-                glob.total_fee += capital * slippage
-                capital -= capital * slippage
+                fee = capital * slippage
+                glob.total_fee += fee
+                capital -= fee
                 capital += pnl
                 glob.status = 0
+                if metrics is not None:
+                    metrics.on_close(capital, pnl, p, fee, time_to_be_noted)
                 signal = -1
                 trade_log(
                     time_to_be_noted,
@@ -186,15 +330,18 @@ def generate_signals(
                 glob.trades += 1
 
         elif glob.status == -1:
-            if strategy.check_long_entry(i):
-                current_time = handle_date_time(high_csv["datetime"].iloc[i])
-                open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+            if strategy.check_long_entry(bar):
+                open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(i, open_time_low_pointer)
                 if open_time_flag == 0:
                     continue
-                glob.total_fee += capital * slippage
-                capital -= capital * slippage
+                fee = capital * slippage
+                glob.total_fee += fee
+                capital -= fee
                 capital += pnl
                 glob.status = 1
+                if metrics is not None:
+                    metrics.on_close(capital, pnl, p, fee, time_to_be_noted)
+                    metrics.on_entry(glob.status, time_to_be_noted)
                 signal = 2
                 stop_loss = glob.entry_price - glob.entry_price * glob.status * glob.sl
                 trade_log(
@@ -211,15 +358,17 @@ def generate_signals(
                 # print("=>Long at ",date_time)
                 generate_csv(i, 1, signal, low_csv, high_csv, signal_csv,"market",time_to_be_noted)
                 glob.trades += 1
-            if strategy.check_short_exit(i):
-                current_time = handle_date_time(high_csv["datetime"].iloc[i])
-                open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+            if strategy.check_short_exit(bar):
+                open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(i, open_time_low_pointer)
                 if open_time_flag == 0:
                     continue
-                glob.total_fee += capital * slippage
-                capital -= capital * slippage
+                fee = capital * slippage
+                glob.total_fee += fee
+                capital -= fee
                 capital += pnl
                 glob.status = 0
+                if metrics is not None:
+                    metrics.on_close(capital, pnl, p, fee, time_to_be_noted)
                 signal = 1
                 trade_log(
                     time_to_be_noted,
@@ -236,13 +385,14 @@ def generate_signals(
                 glob.trades += 1
 
         elif glob.status == 0:
-            if strategy.check_long_entry(i):
-                current_time = handle_date_time(high_csv["datetime"].iloc[i])
-                open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+            if strategy.check_long_entry(bar):
+                open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(i, open_time_low_pointer)
                 if open_time_flag == 0:
                     continue
                 glob.status = 1
                 signal = 1
+                if metrics is not None:
+                    metrics.on_entry(glob.status, time_to_be_noted)
                 stop_loss = glob.entry_price - glob.entry_price * glob.status * glob.sl
                 trade_log(
                     time_to_be_noted,
@@ -258,13 +408,14 @@ def generate_signals(
                 print("=>Long at ",date_time)
                 generate_csv(i, 1, signal, low_csv, high_csv, signal_csv,"market",time_to_be_noted)
 
-            elif strategy.check_short_entry(i):
-                current_time = handle_date_time(high_csv["datetime"].iloc[i])
-                open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+            elif strategy.check_short_entry(bar):
+                open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(i, open_time_low_pointer)
                 if open_time_flag == 0:
                     continue
                 glob.status = -1
                 signal = -1
+                if metrics is not None:
+                    metrics.on_entry(glob.status, time_to_be_noted)
                 stop_loss = glob.entry_price - glob.entry_price * glob.status * glob.sl
                 trade_log(
                     time_to_be_noted,
@@ -280,9 +431,9 @@ def generate_signals(
                 print("=>Short at ",date_time)
                 generate_csv(i, 1, signal, low_csv, high_csv, signal_csv,"market",time_to_be_noted)
 
+    state = snapshot(exit_index)
     if glob.status != 0:
-        current_time = handle_date_time(high_csv["datetime"].iloc[i])
-        open_time_flag , time_to_be_noted, open_time_low_pointer = convert_to_open_timings(current_time, low_csv,open_time_low_pointer, low_time,high_time, future_time_diff)
+        open_time_flag , time_to_be_noted, open_time_low_pointer = open_time(exit_index - 1, open_time_low_pointer)
         if open_time_flag == 0:
             time_to_be_noted = high_csv["datetime"].iloc[exit_index]
 
@@ -296,14 +447,17 @@ def generate_signals(
             * glob.status
             * leverage
         )
-        glob.total_fee += capital * slippage
-        capital -= capital * slippage
+        fee = capital * slippage
+        glob.total_fee += fee
+        capital -= fee
         capital += pnl
         p = (
             ((high_csv["close"].iloc[exit_index] - glob.entry_price) / glob.entry_price)
             * glob.status
             * leverage
         )
+        if metrics is not None:
+            metrics.on_close(capital, pnl, p, fee, time_to_be_noted)
         signal = -1 * glob.status
         glob.status = 0
         trade_log(
@@ -319,6 +473,45 @@ def generate_signals(
         )
         generate_csv(exit_index, 1, signal, low_csv, high_csv, signal_csv,"market",time_to_be_noted)
         glob.trades += 1
+    return state
+
+
+def signal_bars(strategy: BaseStrategy, entry_index: int, exit_index: int) -> EasyDict:
+    """Bars on which the hooks read in each position fire, read by the event-driven loop
+
+    Strategies without signal_arrays have their hooks called once on every bar, their state
+    is restored afterwards.
+
+    Args:
+        strategy (BaseStrategy): Strategy of the run
+        entry_index (int): First bar of the run
+        exit_index (int): End of the bars of the run
+
+    Returns:
+        EasyDict: Sorted bars of an entry when flat (flat), of a short entry or a long exit when
+        long (long) and of a long entry or a short exit when short (short)
+    """
+    signals = strategy.signal_arrays()
+    if signals is None:
+        glob = strategy.glob
+        saved = copy.copy(glob)
+        hooks = [strategy.check_long_entry, strategy.check_short_entry, strategy.check_long_exit, strategy.check_short_exit]
+        fired = np.zeros((len(hooks), len(strategy.high_csv)), dtype=bool)
+        for i in range(entry_index, exit_index):
+            bar = strategy.cursor.move(i)
+            fired[:, i] = [bool(hook(bar)) for hook in hooks]
+        for name in glob.__slots__:
+            setattr(glob, name, getattr(saved, name))
+        signals = EasyDict(long_entry=fired[0], short_entry=fired[1], long_exit=fired[2], short_exit=fired[3])
+
+    def bars(mask: np.ndarray) -> np.ndarray:
+        return entry_index + np.flatnonzero(np.asarray(mask, dtype=bool)[entry_index:exit_index])
+
+    return EasyDict(
+        flat=bars(signals.long_entry | signals.short_entry),
+        long=bars(signals.short_entry | signals.long_exit),
+        short=bars(signals.long_entry | signals.short_exit),
+    )
 
 
 def check_signal_file(signal_csv: pd.DataFrame, config: EasyDict):
@@ -0,0 +1,108 @@
+import os
+import argparse
+from daemon import SOCKET, parse_overrides, request
+
+# Subcommands import the engine modules they need when they run, so the daemon client starts
+# without loading pandas, scipy or matplotlib
+
+
+def run(args):
+    """Full backtest of config.yaml, writes trade_sheet.csv and signal_csv.csv, or the trade book when pyramiding"""
+    from pprint import pprint
+    from utils import get_cfg
+    from metrics import MetricsAccumulator
+    import main
+
+    accumulator = MetricsAccumulator(get_cfg().backtester.capital)
+    signal_csv, equity = main.main(accumulator)
+    if get_cfg().backtester.print_metrics:
+        if get_cfg().backtester.streaming_metrics or signal_csv is None:
+            pprint(accumulator.result())
+        else:
+            main.metrics(signal_csv, equity)
+
+
+def backtest(args):
+    """Metrics of one backtest, run by the daemon when one is listening"""
+    overrides = parse_overrides(args.set)
+    reply = None if args.local else request({"command": "backtest", "overrides": overrides}, args.socket)
+    if reply is None:
+        from utils import get_cfg
+        from daemon import apply_overrides
+        from worker import backtest as run_backtest
+
+        config = apply_overrides(get_cfg(), overrides)
+        config.backtester.print_metrics = False
+        reply = {"result": run_backtest(config).to_dict()}
+    if "error" in reply:
+        raise SystemExit(f"Backtest failed: {reply['error']}")
+    width = max(map(len, reply["result"]))
+    for name, value in reply["result"].items():
+        print(f"{name:<{width}}  {value}")
+
+
+def grid(args):
+    """Metrics of every parameter set of backtester.grid"""
+    from utils import get_cfg
+    from grid import run_grid
+
+    metrics, _ = run_grid(get_cfg())
+    print(metrics.to_string())
+
+
+def sweep(args):
+    """Successive halving sweep of the sweep section"""
+    from utils import get_cfg
+    from orchestrator import successive_halving
+
+    print(successive_halving(get_cfg(), args.jobs).to_string(index=False))
+
+
+def quality(args):
+    """Data-quality report of the data files"""
+    from utils import get_cfg
+    from data_quality import check_quality
+
+    check_quality(get_cfg())
+
+
+def daemon(args):
+    """Start the daemon, or stop the running one"""
+    if args.stop:
+        print("Daemon stopped" if request({"command": "stop"}, args.socket) else "No daemon running")
+        return
+    from daemon import serve
+
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtesting engine")
+    subparsers = parser.add_subparsers(required=True)
+
+    subparser = subparsers.add_parser("run", help=run.__doc__)
+    subparser.set_defaults(handler=run)
+
+    subparser = subparsers.add_parser("backtest", help=backtest.__doc__)
+    subparser.add_argument("-s", "--set", action="append", default=[], help="Config override, e.g. backtester.tp=0.2")
+    subparser.add_argument("--local", action="store_true", help="Run in this process even if a daemon is listening")
+    subparser.add_argument("--socket", default=SOCKET, help="Unix socket of the daemon")
+    subparser.set_defaults(handler=backtest)
+
+    subparser = subparsers.add_parser("grid", help=grid.__doc__)
+    subparser.set_defaults(handler=grid)
+
+    subparser = subparsers.add_parser("sweep", help=sweep.__doc__)
+    subparser.add_argument("-j", "--jobs", type=int, default=max(1, os.cpu_count() // 2), help="Number of processes")
+    subparser.set_defaults(handler=sweep)
+
+    subparser = subparsers.add_parser("quality", help=quality.__doc__)
+    subparser.set_defaults(handler=quality)
+
+    subparser = subparsers.add_parser("daemon", help=daemon.__doc__)
+    subparser.add_argument("--stop", action="store_true", help="Stop the running daemon")
+    subparser.add_argument("--socket", default=SOCKET, help="Unix socket of the daemon")
+    subparser.set_defaults(handler=daemon)
+
+    args = parser.parse_args()
+    args.handler(args)
@@ -0,0 +1,92 @@
+import copy
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Tuple
+from easydict import EasyDict
+from utils import get_cfg, handle_date_time, index_range
+from strategy import get_strategy
+from engine import EngineConfig
+from worker import backtest
+
+SYMBOLS = ["BTCUSDT", "ETHUSDT"]
+STRATEGIES = ["buttercheby", "buttercheby_causal"]  # Reference first
+METRICS = ["final_balance", "max_dd", "sharpe_ratio", "win_rate", "num_of_trades"]
+
+
+def for_symbol(config: EasyDict, symbol: str) -> EasyDict:
+    """Copy of the config running on another symbol's data files"""
+    config = copy.deepcopy(config)
+    config.data.files = {
+        timeframe: file_name.replace(config.data.symbol, symbol) for timeframe, file_name in config.data.files.items()
+    }
+    config.data.symbol = symbol
+    config.backtester.print_metrics = False
+    return config
+
+
+def crossovers(config: EasyDict) -> Tuple[np.ndarray, np.ndarray]:
+    """High timeframe bars where the Chebyshev filter crosses above and below the Butterworth one
+
+    Args:
+        config (EasyDict): Configuration with the strategy and the dates
+
+    Returns:
+        Tuple (np.ndarray, np.ndarray): Bars of the long and short crossovers between the dates
+    """
+    high_csv = pd.read_csv(Path(config.data.path) / config.data.files[config.backtester.high_time])
+    strategy = get_strategy(config.backtester.strategy)(high_csv, None, config, EngineConfig.from_config(config).state())
+    entry_index, exit_index = index_range(
+        high_csv, handle_date_time(config.data.start_date), handle_date_time(config.data.end_date)
+    )
+    diff = (strategy.high_csv["cheby"] - strategy.high_csv["butter"]).to_numpy()
+    bars = np.arange(1, len(diff))
+    in_range = (bars >= entry_index) & (bars < exit_index)
+    long = bars[in_range & (diff[1:] > 0) & (diff[:-1] < 0)]
+    short = bars[in_range & (diff[1:] < 0) & (diff[:-1] > 0)]
+    return long, short
+
+
+def _lag(reference: np.ndarray, other: np.ndarray) -> float:
+    """Median bars from a reference crossover to the next crossover in the same direction"""
+    position = np.searchsorted(other, reference)
+    found = position < len(other)
+    return float(np.median(other[position[found]] - reference[found])) if found.any() else np.nan
+
+
+def compare(config: EasyDict, symbols: list = SYMBOLS) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Signals and metrics of the causal ButterCheby variant against the zero-phase one
+
+    Args:
+        config (EasyDict): Base configuration, its data files are switched to every symbol
+        symbols (list, optional): Symbols with data files in data.path. Defaults to SYMBOLS.
+
+    Returns:
+        Tuple (pd.DataFrame, pd.DataFrame): Crossovers per symbol and direction, and metrics per symbol and strategy
+    """
+    signal_rows, metric_rows = [], []
+    for symbol in symbols:
+        runs = {}
+        for name in STRATEGIES:
+            run_config = for_symbol(config, symbol)
+            run_config.backtester.strategy = name
+            runs[name] = (crossovers(run_config), backtest(run_config))
+            metric_rows.append({"symbol": symbol, "strategy": name, **runs[name][1][METRICS].to_dict()})
+        (reference, _), (causal, _) = runs[STRATEGIES[0]], runs[STRATEGIES[1]]
+        for direction, reference_bars, causal_bars in zip(["long", "short"], reference, causal):
+            signal_rows.append({
+                "symbol": symbol,
+                "direction": direction,
+                "zero_phase": len(reference_bars),
+                "causal": len(causal_bars),
+                "same_bar": len(np.intersect1d(reference_bars, causal_bars)),
+                "median_lag_bars": _lag(reference_bars, causal_bars),
+            })
+    return pd.DataFrame(signal_rows), pd.DataFrame(metric_rows)
+
+
+if __name__ == "__main__":
+    signals, metrics = compare(get_cfg())
+    print(signals.to_string(index=False))
+    print()
+    print(metrics.to_string(index=False))
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+
+class BarCursor:
+    """No-lookahead view of the high timeframe data at the bar being processed
+
+    The engine moves the cursor to every bar and passes it to the strategy hooks, which read
+    bar["cheby"] for the current value and bar["cheby", 1] for the one a bar before. Columns are
+    NumPy views taken on first access, so a column written to the data afterwards is not seen,
+    and a read past the current bar raises.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+        self.bar = -1  # Row of the current bar
+        self._columns = {}
+
+    def move(self, bar: int) -> "BarCursor":
+        """Make bar the current bar"""
+        self.bar = int(bar)
+        return self
+
+    def column(self, column: str) -> np.ndarray:
+        if column not in self._columns:
+            values = self.data[column].to_numpy().view()
+            values.flags.writeable = False
+            self._columns[column] = values
+        return self._columns[column]
+
+    def at(self, column: str, lag: int = 0):
+        """Value of a column lag bars before the current bar"""
+        if lag < 0:
+            raise IndexError(f"Bar {self.bar - lag} is read at bar {self.bar}, after the current bar")
+        row = self.bar - lag
+        if row < 0:
+            raise IndexError(f"No bar {lag} bars before bar {self.bar}")
+        return self.column(column)[row]
+
+    def history(self, column: str, length: int) -> np.ndarray:
+        """Read-only values of a column over the last length bars, the current one last"""
+        return self.column(column)[max(0, self.bar - length + 1) : self.bar + 1]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.at(*key)
+        return self.at(key)
+
+    def __index__(self) -> int:
+        # Lets the cursor index the arrays of the bar, e.g. self.timeframes["4h"].at(bar, "close")
+        return self.bar
+
+    def __int__(self) -> int:
+        return self.bar
@@ -0,0 +1,114 @@
+import os
+import copy
+from pathlib import Path
+from typing import Dict, List
+from multiprocessing.connection import Listener, Client
+
+SOCKET = "backtest.sock"  # Unix socket of the daemon, relative to the working directory
+CONFIG = "config.yaml"
+
+
+def parse_overrides(overrides: List[str]) -> Dict[str, str]:
+    """Parse key=value overrides, keys are dotted config paths like backtester.tp"""
+    parsed = {}
+    for override in overrides:
+        key, separator, value = override.partition("=")
+        if not separator:
+            raise ValueError(f"Override {override} is not in key=value format")
+        parsed[key] = value
+    return parsed
+
+
+def apply_overrides(config, overrides: Dict[str, str]):
+    """Copy of the config with the overrides applied, values are parsed as yaml
+
+    A value replacing a string is kept as given when yaml reads it as another type, e.g. the date
+    of data.end_date=2020-01-01.
+
+    Args:
+        config (EasyDict): Base configuration
+        overrides (Dict[str, str]): Raw values by dotted config path
+
+    Returns:
+        EasyDict: Configuration of the run
+    """
+    import yaml
+    from datetime import date
+
+    config = copy.deepcopy(config)
+    for key, value in overrides.items():
+        *parents, name = key.split(".")
+        section = config
+        for parent in parents:
+            section = section[parent]
+        if name not in section:
+            raise KeyError(f"Unknown config key {key}")
+        parsed = yaml.safe_load(value)
+        if isinstance(parsed, date) or (isinstance(section[name], str) and not isinstance(parsed, (str, type(None)))):
+            parsed = value
+        section[name] = parsed
+    return config
+
+
+def _plain_value(value):
+    # Results are sent as builtins so the client does not need pandas to read them
+    if hasattr(value, "item"):
+        value = value.item()
+    return value if isinstance(value, (bool, int, float, str, type(None))) else str(value)
+
+
+def serve(socket_path: str = SOCKET):
+    """Keep the engine, the data and the indicators loaded and run the backtests sent to the socket
+
+    Requests are handled one at a time. config.yaml is reparsed only when it changes.
+
+    Args:
+        socket_path (str, optional): Path of the Unix socket. Defaults to SOCKET.
+    """
+    import utils
+    from worker import backtest
+
+    Path(socket_path).unlink(missing_ok=True)
+    listener = Listener(socket_path, family="AF_UNIX")
+    os.chmod(socket_path, 0o600)
+    config_mtime = None
+    print(f"Backtest daemon listening on {socket_path}")
+    try:
+        while True:
+            with listener.accept() as conn:
+                request = conn.recv()
+                if request["command"] == "stop":
+                    conn.send({"stopped": True})
+                    break
+                if os.stat(CONFIG).st_mtime_ns != config_mtime:
+                    config_mtime = os.stat(CONFIG).st_mtime_ns
+                    utils.CACHE.pop(CONFIG, None)
+                try:
+                    config = apply_overrides(utils.get_cfg(CONFIG), request["overrides"])
+                    config.backtester.print_metrics = False
+                    result = backtest(config)
+                    conn.send({"result": {name: _plain_value(value) for name, value in result.items()}})
+                except Exception as e:
+                    conn.send({"error": repr(e)})
+    finally:
+        listener.close()
+        Path(socket_path).unlink(missing_ok=True)
+
+
+def request(message: dict, socket_path: str = SOCKET) -> dict | None:
+    """Send a request to the daemon
+
+    Args:
+        message (dict): 'command' backtest with the 'overrides', or stop
+        socket_path (str, optional): Path of the Unix socket. Defaults to SOCKET.
+
+    Returns:
+        dict | None: Reply of the daemon, None if no daemon is running
+    """
+    try:
+        conn = Client(socket_path, family="AF_UNIX")
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    with conn:
+        conn.send(message)
+        return conn.recv()
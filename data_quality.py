@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from easydict import EasyDict
+from utils import get_cfg, to_minutes, to_timestamps
+
+MINUTE = 60 * 10**9  # Nanoseconds in a minute
+
+
+def gap_index(date_times: pd.Series, interval: int) -> EasyDict:
+    """Index of the gaps and irregular rows of a timeframe
+
+    Args:
+        date_times (pd.Series): Datetime column of the timeframe
+        interval (int): Expected interval between the rows in minutes
+
+    Returns:
+        EasyDict:
+        - gap_start, gap_end, missing_bars: Timestamps around each gap and the number of bars missing
+        - duplicates: Rows with the same timestamp as the previous row
+        - out_of_order: Rows earlier than the previous row
+        - misaligned: Rows whose distance to the previous row is not a multiple of the interval
+    """
+    timestamps = to_timestamps(date_times)
+    step = interval * MINUTE
+    diff = np.diff(timestamps)
+    gaps = np.flatnonzero(diff > step)
+    return EasyDict(
+        interval=interval,
+        start=timestamps[0] if len(timestamps) else None,
+        end=timestamps[-1] if len(timestamps) else None,
+        rows=len(timestamps),
+        gap_start=timestamps[gaps],
+        gap_end=timestamps[gaps + 1],
+        missing_bars=diff[gaps] // step - 1 + (diff[gaps] % step > 0),
+        duplicates=np.flatnonzero(diff == 0) + 1,
+        out_of_order=np.flatnonzero(diff < 0) + 1,
+        misaligned=np.flatnonzero((diff > 0) & (diff % step != 0)) + 1,
+    )
+
+
+def open_time_table(
+    high_csv: pd.DataFrame,
+    low_csv: pd.DataFrame,
+    low_time: int = 3,
+    high_time: int = 1440,
+    future_time_diff: int = 15,
+) -> EasyDict:
+    """Resolve the open time of every high timeframe bar in the low timeframe data at once
+
+    Vectorised form of convert_to_open_timings: the close of a high bar is matched to the last
+    low bar at most low_time minutes before it, else to the first low bar at most
+    future_time_diff minutes after it, else the bar cannot be traded.
+
+    Args:
+        high_csv (pd.DataFrame): High timeframe data
+        low_csv (pd.DataFrame): Low timeframe data
+        low_time (int, optional): Low timeframe in minutes. Defaults to 3.
+        high_time (int, optional): High timeframe in minutes. Defaults to 1440.
+        future_time_diff (int, optional): Minutes a late low bar may be after the close. Defaults to 15.
+
+    Returns:
+        EasyDict: flag, time and pointer arrays indexed by the high timeframe bar, as returned by
+        convert_to_open_timings
+    """
+    low_ns = to_timestamps(low_csv["datetime"])
+    target = to_timestamps(high_csv["datetime"]) + high_time * MINUTE
+    lower_pointer = np.searchsorted(low_ns, target, side="left")
+    prev_pointer = lower_pointer - 1
+    before = (prev_pointer >= 0) & (target - low_ns[np.maximum(prev_pointer, 0)] <= low_time * MINUTE)
+    after = (
+        ~before
+        & (lower_pointer < len(low_ns))
+        & (low_ns[np.minimum(lower_pointer, len(low_ns) - 1)] - target <= future_time_diff * MINUTE)
+    )
+    flag = before | after
+    row = np.where(before, prev_pointer, lower_pointer)
+    low_datetime = low_csv["datetime"].to_numpy()
+    time = np.full(len(target), None, dtype=object)
+    time[flag] = low_datetime[row[flag]]
+    return EasyDict(flag=flag, time=time, pointer=np.where(flag, row + 1, lower_pointer))
+
+
+def quality_report(config: EasyDict) -> pd.DataFrame:
+    """Data-quality report of every data file in the config
+
+    Args:
+        config (EasyDict): Config object containing the data file paths
+
+    Returns:
+        pd.DataFrame: One row per data file with its gaps, duplicated, out-of-order and misaligned rows
+    """
+    DATA_DIR = Path(config.data.path)
+    rows = []
+    for timeframe, file_name in config.data.files.items():
+        file_path = DATA_DIR / file_name
+        if not file_path.exists():
+            continue
+        index = gap_index(pd.read_csv(file_path, usecols=["datetime"])["datetime"], to_minutes(timeframe))
+        gap_length = index.gap_end - index.gap_start
+        rows.append({
+            "file": file_name,
+            "rows": index.rows,
+            "start": pd.Timestamp(index.start),
+            "end": pd.Timestamp(index.end),
+            "gaps": len(index.gap_start),
+            "missing_bars": int(index.missing_bars.sum()),
+            "largest_gap": pd.Timedelta(int(gap_length.max())) if len(gap_length) else pd.Timedelta(0),
+            "duplicates": len(index.duplicates),
+            "out_of_order": len(index.out_of_order),
+            "misaligned": len(index.misaligned),
+        })
+    return pd.DataFrame(rows)
+
+
+def check_quality(config: EasyDict) -> pd.DataFrame:
+    """Print the data-quality report and raise on data the engine cannot handle
+
+    Args:
+        config (EasyDict): Config object containing the data file paths
+
+    Returns:
+        pd.DataFrame: The data-quality report
+    """
+    report = quality_report(config)
+    print(report.to_string(index=False))
+    bad = report[(report["duplicates"] > 0) | (report["out_of_order"] > 0)]
+    if config.data.quality.strict and len(bad):
+        raise ValueError(f"Duplicated or out-of-order rows in {', '.join(bad['file'])}")
+    return report
+
+
+if __name__ == "__main__":
+    check_quality(get_cfg())
@@ -0,0 +1,497 @@
+import io
+import copy
+import time
+import contextlib
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+from easydict import EasyDict
+from utils import get_cfg, load_high_low, handle_date_time, format_date_time, coarse_levels, index_range, adjust, tpsl, tpsl_intrabar, to_timestamps, FILLS
+from backtesting_ps_code import generate_signals
+from strategy import BaseStrategy, get_strategy
+from engine import EngineConfig, EngineState
+from metrics import compute_metrics, MetricsAccumulator
+from data_quality import open_time_table
+from grid import compute_entries, evaluate_grid, param_grid, _curve_metrics
+from positions import generate_positions, BOOK_COLUMNS
+from range_index import range_index
+
+TOLERANCE = 1e-9  # Relative and absolute tolerance of numeric values
+COARSE_BLOCK = 4  # Low timeframe bars per block of the coarse engine when backtester.coarse_time is not set
+# Pyramiding case, the entry signals of the ema strategy repeat on every bar of a trend
+PYRAMID = EasyDict(strategy="ema", max_open=3, size=0.25)
+TRADE_COLUMNS = ["date_time", "executed_price", "capital", "signal", "order_status", "order_type", "profit_loss%", "stop_loss"]
+SIGNAL_COLUMNS = ["datetime", "open", "high", "low", "close", "volume", "signals", "signal_type"]
+# Holding durations are measured per trade by compute_metrics and per position by the online metrics
+METRIC_KEYS = [
+    "final_balance", "gross_profit", "gross_loss", "net_profit", "total_long_trades", "total_short_trades",
+    "win_rate", "loss_rate", "avg_winning_trade", "avg_losing_trade", "largest_losing_trade",
+    "largest_winning_trade", "max_dd", "sharpe_ratio", "sortino_ratio", "min_portfolio_balance",
+    "max_portfolio_balance", "num_of_trades", "total_fee",
+]
+
+
+def _logs():
+    return pd.DataFrame(columns=TRADE_COLUMNS), pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+
+def reference_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """generate_signals searching every open time, with the metrics of compute_metrics"""
+    trade_sheet, signal_csv = _logs()
+    generate_signals(strategy, strategy.glob, high_csv, low_csv, trade_sheet, signal_csv, **settings.engine_kwargs())
+    signals = signal_csv.drop(columns=["signal_type"]).reset_index(drop=True)
+    metrics = compute_metrics(signals.copy(), False, settings.leverage, settings.slippage, settings.capital) if len(signals) else None
+    return EasyDict(trade_sheet=trade_sheet, signal_csv=signal_csv, metrics=metrics)
+
+
+def lookup_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """generate_signals with the open time table and the online metrics"""
+    trade_sheet, signal_csv = _logs()
+    accumulator = MetricsAccumulator(settings.capital)
+    generate_signals(
+        strategy,
+        strategy.glob,
+        high_csv,
+        low_csv,
+        trade_sheet,
+        signal_csv,
+        **settings.engine_kwargs(),
+        metrics=accumulator,
+        open_times=open_time_table(high_csv, low_csv, settings.low_time, settings.high_time),
+    )
+    return EasyDict(trade_sheet=trade_sheet, signal_csv=signal_csv, metrics=accumulator.result())
+
+
+def coarse_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """generate_signals with the open time table and the coarse-to-fine exit scan"""
+    trade_sheet, signal_csv = _logs()
+    generate_signals(
+        strategy,
+        strategy.glob,
+        high_csv,
+        low_csv,
+        trade_sheet,
+        signal_csv,
+        **settings.engine_kwargs(),
+        open_times=open_time_table(high_csv, low_csv, settings.low_time, settings.high_time),
+        coarse=coarse_levels(low_csv, high_csv, settings.coarse_block or COARSE_BLOCK),
+    )
+    signals = signal_csv.drop(columns=["signal_type"]).reset_index(drop=True)
+    metrics = compute_metrics(signals.copy(), False, settings.leverage, settings.slippage, settings.capital) if len(signals) else None
+    return EasyDict(trade_sheet=trade_sheet, signal_csv=signal_csv, metrics=metrics)
+
+
+def indexed_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """generate_signals with the open time table and the exits of fixed levels found on the segment trees"""
+    trade_sheet, signal_csv = _logs()
+    generate_signals(
+        strategy,
+        strategy.glob,
+        high_csv,
+        low_csv,
+        trade_sheet,
+        signal_csv,
+        **settings.engine_kwargs(),
+        open_times=open_time_table(high_csv, low_csv, settings.low_time, settings.high_time),
+        range_index=range_index(low_csv, high_csv),
+    )
+    signals = signal_csv.drop(columns=["signal_type"]).reset_index(drop=True)
+    metrics = compute_metrics(signals.copy(), False, settings.leverage, settings.slippage, settings.capital) if len(signals) else None
+    return EasyDict(trade_sheet=trade_sheet, signal_csv=signal_csv, metrics=metrics)
+
+
+def events_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """Event-driven generate_signals, jumping between the bars where the state can change"""
+    trade_sheet, signal_csv = _logs()
+    generate_signals(
+        strategy,
+        strategy.glob,
+        high_csv,
+        low_csv,
+        trade_sheet,
+        signal_csv,
+        **settings.engine_kwargs(),
+        open_times=open_time_table(high_csv, low_csv, settings.low_time, settings.high_time),
+        range_index=range_index(low_csv, high_csv),
+        event_driven=True,
+    )
+    signals = signal_csv.drop(columns=["signal_type"]).reset_index(drop=True)
+    metrics = compute_metrics(signals.copy(), False, settings.leverage, settings.slippage, settings.capital) if len(signals) else None
+    return EasyDict(trade_sheet=trade_sheet, signal_csv=signal_csv, metrics=metrics)
+
+
+def grid_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """Vectorised grid evaluation of the single parameter set, it logs no signal file"""
+    entries = compute_entries(
+        strategy, high_csv, low_csv, settings.low_time, settings.high_time, settings.entry_date, settings.exit_date
+    )
+    grid = param_grid([settings.tp], [settings.sl], [settings.trailing], [settings.leverage])
+    _, curves = evaluate_grid(
+        entries, grid, settings.margin, settings.slippage, settings.capital, settings.fills, settings.tie_break
+    )
+    return EasyDict(trade_sheet=curves[0], signal_csv=None, metrics=pd.Series(_curve_metrics(curves[0], settings.capital)))
+
+
+def book_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """Position book with a single position, its trade book has one row per open and close"""
+    accumulator = MetricsAccumulator(settings.capital)
+    generate_positions(strategy, strategy.glob, high_csv, low_csv, **settings.engine_kwargs(), metrics=accumulator)
+    return EasyDict(trade_sheet=None, signal_csv=None, metrics=accumulator.result())
+
+
+def pyramid_engine(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """Position book with several positions open at once"""
+    accumulator = MetricsAccumulator(settings.capital)
+    book = generate_positions(
+        strategy, strategy.glob, high_csv, low_csv, **settings.engine_kwargs(), **settings.position_kwargs(), metrics=accumulator
+    )
+    return EasyDict(trade_sheet=book.trade_book, signal_csv=None, metrics=accumulator.result())
+
+
+def pyramid_reference(strategy: BaseStrategy, high_csv: pd.DataFrame, low_csv: pd.DataFrame, settings: EngineConfig) -> EasyDict:
+    """generate_positions position by position, every position exiting through tpsl or tpsl_intrabar on its own state"""
+    entry_index, exit_index = index_range(high_csv, settings.entry_date, settings.exit_date)
+    open_times = open_time_table(high_csv, low_csv, settings.low_time, settings.high_time)
+    low_ns, high_ns = to_timestamps(low_csv["datetime"]), to_timestamps(high_csv["datetime"])
+    glob = strategy.glob
+    accumulator = MetricsAccumulator(settings.capital)
+    capital = settings.capital
+    positions, rows = [], []
+    next_id = 0
+
+    def close(position, price, date_time, order_type=None):
+        nonlocal capital
+        state = position.state
+        p = ((price - state.entry_price) / state.entry_price) * state.status * settings.leverage
+        pnl, fee = position.size * p, position.size * settings.slippage
+        capital = capital - fee + pnl
+        kind = order_type or ("TP" if pnl > 0 else "SL" if settings.margin / settings.leverage > state.sl else "Margin")
+        accumulator.on_close(capital, pnl, p, fee, date_time, position.entry_time)
+        rows.append((date_time, position.id, state.status, "close", kind, price, position.size, capital, p, pnl))
+        positions.remove(position)
+
+    def entry(check, bar):
+        if not check(bar):
+            return None
+        return EasyDict(price=glob.entry_price, trailing_price=glob.trailing_price, tp=glob.tp, sl=glob.sl)
+
+    low_pointer = 1
+    for i in range(entry_index, exit_index):
+        low_pointer = adjust(low_pointer, i, low_csv, high_csv)
+        hits = []
+        for position in positions:
+            if settings.fills == "intrabar":
+                hit, index, price = tpsl_intrabar(
+                    low_pointer, i, low_csv, low_ns, high_ns, settings.margin, settings.leverage, position.state, settings.trailing, settings.tie_break
+                )
+            else:
+                hit, index = tpsl(low_pointer, i, low_csv, high_csv, settings.margin, settings.leverage, position.state, settings.trailing)
+                price = low_csv["close"].iloc[index]
+            if hit:
+                hits.append((index, position.id, position, price))
+        if hits:
+            for index, _, position, price in sorted(hits, key=lambda hit: hit[:2]):
+                close(position, price, low_csv["datetime"].iloc[index])
+            continue
+
+        side = positions[0].state.status if positions else 0
+        bar = strategy.cursor.move(i)
+        long_entry, short_entry = entry(strategy.check_long_entry, bar), entry(strategy.check_short_entry, bar)
+        long_exit, short_exit = strategy.check_long_exit(bar), strategy.check_short_exit(bar)
+        if side == 0:
+            closing, new, new_side = False, long_entry or short_entry, 1 if long_entry else -1
+        else:
+            reverse, add = (short_entry, long_entry) if side == 1 else (long_entry, short_entry)
+            leave = long_exit if side == 1 else short_exit
+            closing = bool(reverse or leave)
+            new = reverse or (add if not leave and len(positions) < settings.max_open else None)
+            new_side = -side if reverse else side
+        if not (closing or new) or not open_times.flag[i]:
+            continue
+        date_time = open_times.time[i]
+        if closing:
+            for position in list(positions):
+                close(position, high_csv["close"].iloc[i], date_time, "Market")
+        if new:
+            state = EngineState(tp=new.tp, sl=new.sl, entry_price=new.price, trailing_price=new.trailing_price, status=new_side)
+            position = EasyDict(id=next_id, state=state, size=settings.position_size * capital, entry_time=date_time)
+            positions.append(position)
+            next_id += 1
+            accumulator.on_entry(new_side, date_time)
+            rows.append((date_time, position.id, new_side, "open", "Market", new.price, position.size, capital, 0.0, np.nan))
+
+    if positions:
+        date_time = open_times.time[exit_index - 1] if open_times.flag[exit_index - 1] else high_csv["datetime"].iloc[exit_index]
+        for position in list(positions):
+            close(position, high_csv["close"].iloc[exit_index], date_time, "Market")
+    return EasyDict(trade_sheet=pd.DataFrame(rows, columns=BOOK_COLUMNS), signal_csv=None, metrics=accumulator.result())
+
+
+def pyramid_config(config: EasyDict) -> EasyDict:
+    """Copy of the config running the PYRAMID case"""
+    config = copy.deepcopy(config)
+    config.backtester.strategy = PYRAMID.strategy
+    config.backtester.positions = EasyDict(config.backtester.get("positions", {}), max_open=PYRAMID.max_open, size=PYRAMID.size)
+    return config
+
+
+ENGINES: Dict[str, Callable[..., EasyDict]] = {
+    "lookup": lookup_engine,
+    "coarse": coarse_engine,
+    "indexed": indexed_engine,
+    "events": events_engine,
+    "grid": grid_engine,
+    "book": book_engine,
+    "pyramid": pyramid_engine,
+}
+# Engines diffed against their own reference on their own config, the others against reference_engine
+CASES: Dict[str, Tuple[Callable[..., EasyDict], Callable[[EasyDict], EasyDict]]] = {
+    "pyramid": (pyramid_reference, pyramid_config),
+}
+
+
+def diff_frames(reference: pd.DataFrame, other: pd.DataFrame, tolerance: float = TOLERANCE) -> EasyDict:
+    """Compare the columns two logs have in common, datetimes in their printed form
+
+    Returns:
+        EasyDict: equal, the row counts, the first row that differs and the largest numeric error
+    """
+    columns = [column for column in reference.columns if column in other.columns]
+    rows = min(len(reference), len(other))
+    mismatched = np.zeros(rows, dtype=bool)
+    max_error = 0.0
+    for column in columns:
+        left, right = reference[column].iloc[:rows], other[column].iloc[:rows]
+        if column in ("date_time", "datetime"):
+            left, right = left.map(format_date_time), right.map(format_date_time)
+        numbers = pd.to_numeric(left, errors="coerce")
+        if numbers.notna().sum() == left.notna().sum():  # Logs built row by row keep numbers in object columns
+            left = numbers.to_numpy(dtype=np.float64)
+            right = pd.to_numeric(right, errors="coerce").to_numpy(dtype=np.float64)
+            close = np.isclose(left, right, rtol=tolerance, atol=tolerance, equal_nan=True)
+            with np.errstate(invalid="ignore"):
+                errors = np.abs(left - right)
+            max_error = max(max_error, np.nanmax(errors, initial=0.0))
+        else:
+            close = left.astype(str).to_numpy() == right.astype(str).to_numpy()
+        mismatched |= ~close
+    first = int(np.argmax(mismatched)) if mismatched.any() else None
+    return EasyDict(
+        equal=len(reference) == len(other) and first is None,
+        rows=(len(reference), len(other)),
+        first_mismatch=first if first is not None or len(reference) == len(other) else rows,
+        max_error=max_error,
+    )
+
+
+def diff_metrics(reference: pd.Series, other: pd.Series, tolerance: float = TOLERANCE) -> EasyDict:
+    """Compare the METRIC_KEYS both engines compute"""
+    if reference is None or other is None:
+        return EasyDict(equal=reference is None and other is None, mismatched=[])
+    keys = [key for key in METRIC_KEYS if key in reference and key in other]
+    left = reference[keys].to_numpy(dtype=np.float64)
+    right = other[keys].to_numpy(dtype=np.float64)
+    close = np.isclose(left, right, rtol=tolerance, atol=tolerance, equal_nan=True)
+    return EasyDict(equal=bool(close.all()), mismatched=[key for key, ok in zip(keys, close) if not ok])
+
+
+def synthetic_data(seed: int, days: int = 400, low_minutes: int = 240, volatility: float = 0.04) -> EasyDict:
+    """Random walk OHLCV data in the shipped file formats, the high timeframe resampled from the low one
+
+    Args:
+        seed (int): Seed of the random walk
+        days (int, optional): Length in days. Defaults to 400.
+        low_minutes (int, optional): Low timeframe in minutes. Defaults to 240.
+        volatility (float, optional): Daily volatility of the log price. Defaults to 0.04.
+
+    Returns:
+        EasyDict: high_csv, low_csv, start_date and end_date
+    """
+    rng = np.random.default_rng(seed)
+    bars_per_day = 24 * 60 // low_minutes
+    index = pd.date_range("2020-01-01", periods=days * bars_per_day, freq=f"{low_minutes}min")
+    steps = rng.normal(0, volatility / np.sqrt(bars_per_day), (len(index), 4))
+    close = 10000 * np.exp(np.cumsum(steps[:, 0]))
+    open_ = np.concatenate(([10000.0], close[:-1]))
+    high = np.maximum(open_, close) * np.exp(np.abs(steps[:, 1]))
+    low = np.minimum(open_, close) * np.exp(-np.abs(steps[:, 2]))
+    volume = rng.gamma(2.0, 500.0, len(index))
+    low_csv = pd.DataFrame({"open": open_, "high": high, "low": low, "close": close, "volume": volume}, index=index)
+    high_csv = low_csv.resample("1D").agg({"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+    low_csv.insert(0, "datetime", low_csv.index.strftime("%Y-%m-%d %H:%M:%S"))
+    high_csv.insert(0, "datetime", high_csv.index.strftime("%Y-%m-%d"))
+    return EasyDict(
+        high_csv=high_csv.reset_index(drop=True),
+        low_csv=low_csv.reset_index(drop=True),
+        start_date=str(index[0].date()),
+        end_date=str(index[-1].date()),
+    )
+
+
+def random_configs(config: EasyDict, count: int, seed: int = 0) -> List[EasyDict]:
+    """Copies of the config with random exit parameters, the first one unchanged"""
+    rng = np.random.default_rng(seed)
+    configs = [copy.deepcopy(config)]
+    for _ in range(count - 1):
+        variant = copy.deepcopy(config)
+        variant.backtester.tp = round(float(rng.uniform(0.02, 0.4)), 3)
+        variant.backtester.sl = round(float(rng.uniform(0.02, 0.2)), 3)
+        variant.backtester.leverage = int(rng.choice([1, 2, 3, 5]))
+        variant.backtester.trailing = bool(rng.integers(2))
+        variant.backtester.margin = float(rng.choice([0.1, 0.2, 0.5]))
+        configs.append(variant)
+    return configs
+
+
+def compare(
+    config: EasyDict,
+    high_csv: pd.DataFrame,
+    low_csv: pd.DataFrame,
+    engines: List[str],
+    tolerance: float = TOLERANCE,
+) -> List[dict]:
+    """Run the reference and every engine on the same data and config and diff their outputs, the engines of CASES on their own
+
+    Returns:
+        List[dict]: One row per engine with the parity of its trade sheet, signal file and metrics and its speedup
+    """
+    settings = EngineConfig.from_config(config)
+    low_csv = low_csv[
+        (low_csv["datetime"].apply(handle_date_time) >= settings.entry_date)
+        & (low_csv["datetime"].apply(handle_date_time) <= settings.exit_date)
+    ].reset_index(drop=True)
+
+    def run(engine, run_config: EasyDict = config):
+        # A fresh strategy and state per engine, the indicators are memoised
+        run_settings = EngineConfig.from_config(run_config)
+        Strategy = get_strategy(run_config.backtester.strategy)
+        strategy = Strategy(high_csv.copy(), low_csv, run_config, run_settings.state(high_csv.loc[0, "datetime"]))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # The trade log of the engines
+            outputs = engine(strategy, strategy.high_csv, low_csv, run_settings)
+        return outputs, time.perf_counter() - start
+
+    reference, reference_time = run(reference_engine)
+    rows = []
+    for name in engines:
+        if name in CASES:
+            case_engine, case_config = CASES[name]
+            case_config = case_config(config)
+            case_reference, case_time = run(case_engine, case_config)
+            outputs, engine_time = run(ENGINES[name], case_config)
+        else:
+            case_reference, case_time = reference, reference_time
+            outputs, engine_time = run(ENGINES[name])
+        trades = diff_frames(case_reference.trade_sheet, outputs.trade_sheet, tolerance) if outputs.trade_sheet is not None else None
+        signals = diff_frames(case_reference.signal_csv, outputs.signal_csv, tolerance) if outputs.signal_csv is not None else None
+        metrics = diff_metrics(case_reference.metrics, outputs.metrics, tolerance)
+        rows.append({
+            "engine": name,
+            "tp": settings.tp,
+            "sl": settings.sl,
+            "leverage": settings.leverage,
+            "trailing": settings.trailing,
+            "margin": settings.margin,
+            "fills": settings.fills,
+            "trades": len(case_reference.trade_sheet),
+            "trade_sheet": "-" if trades is None else "ok" if trades.equal else f"row {trades.first_mismatch}",
+            "signal_file": "-" if signals is None else "ok" if signals.equal else f"row {signals.first_mismatch}",
+            "metrics": "ok" if metrics.equal else ",".join(metrics.mismatched),
+            "max_error": np.nan if trades is None else trades.max_error,
+            "reference_s": case_time,
+            "engine_s": engine_time,
+            "speedup": case_time / engine_time,
+        })
+    return rows
+
+
+def check_reference_outputs(config: EasyDict, tolerance: float = TOLERANCE) -> EasyDict | None:
+    """Diff the reference engine against the checked-in trade_sheet.csv and signal_csv.csv
+
+    Returns:
+        EasyDict | None: Diffs of both files, None if the data of the config is not available
+    """
+    try:
+        high_csv, low_csv = load_high_low(config)
+    except FileNotFoundError as e:
+        print(f"Skipping the checked-in outputs: {e}")
+        return None
+    settings = EngineConfig.from_config(config)
+    low_csv = low_csv[
+        (low_csv["datetime"].apply(handle_date_time) >= settings.entry_date)
+        & (low_csv["datetime"].apply(handle_date_time) <= settings.exit_date)
+    ].reset_index(drop=True)
+    strategy = get_strategy(config.backtester.strategy)(high_csv, low_csv, config, settings.state(high_csv.loc[0, "datetime"]))
+    outputs = reference_engine(strategy, high_csv, low_csv, settings)
+    return EasyDict(
+        trade_sheet=diff_frames(pd.read_csv("trade_sheet.csv"), outputs.trade_sheet, tolerance),
+        signal_csv=diff_frames(pd.read_csv("signal_csv.csv"), outputs.signal_csv, tolerance),
+    )
+
+
+def run_harness(
+    config: EasyDict,
+    engines: List[str],
+    configs: int = 4,
+    synthetic: int = 2,
+    symbols: List[str] = ("BTCUSDT", "ETHUSDT"),
+    tolerance: float = TOLERANCE,
+) -> pd.DataFrame:
+    """Differential report of the engines on the shipped symbols and synthetic data over random configs
+
+    Args:
+        config (EasyDict): Base configuration
+        engines (List[str]): Names of the engines in ENGINES
+        configs (int, optional): Configs per dataset, the base one and random exit parameters. Defaults to 4.
+        synthetic (int, optional): Number of synthetic datasets. Defaults to 2.
+        symbols (List[str], optional): Shipped symbols, skipped when their data files are missing. Defaults to ("BTCUSDT", "ETHUSDT").
+        tolerance (float, optional): Tolerance of numeric values. Defaults to TOLERANCE.
+
+    Returns:
+        pd.DataFrame: One row per dataset, config and engine
+    """
+    from compare_filters import for_symbol
+
+    datasets = []
+    for symbol in symbols:
+        symbol_config = for_symbol(config, symbol)
+        try:
+            datasets.append((symbol, symbol_config, *load_high_low(symbol_config)))
+        except FileNotFoundError as e:
+            print(f"Skipping {symbol}: {e}")
+    for seed in range(synthetic):
+        data = synthetic_data(seed, low_minutes=int(pd.Timedelta(config.backtester.low_time).total_seconds() // 60))
+        synthetic_config = copy.deepcopy(config)
+        synthetic_config.data.start_date, synthetic_config.data.end_date = data.start_date, data.end_date
+        datasets.append((f"synthetic-{seed}", synthetic_config, data.high_csv, data.low_csv))
+
+    rows = []
+    for name, dataset_config, high_csv, low_csv in datasets:
+        for run_config in random_configs(dataset_config, configs):
+            for row in compare(run_config, high_csv, low_csv, engines, tolerance):
+                rows.append({"dataset": name, **row})
+                print(f"{name:12} {row['engine']:8} trades={row['trade_sheet']} signals={row['signal_file']} metrics={row['metrics']} x{row['speedup']:.1f}")
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("-e", "--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    args.add_argument("-c", "--configs", type=int, default=4, help="Configs per dataset")
+    args.add_argument("-s", "--synthetic", type=int, default=2, help="Synthetic datasets")
+    args.add_argument("-t", "--tolerance", type=float, default=TOLERANCE)
+    args.add_argument("-f", "--fills", choices=FILLS, help="Fill model, defaults to backtester.fills")
+    args.add_argument("--checked-in", action="store_true", help="Also diff the reference engine against the checked-in outputs")
+    args.add_argument("-o", "--output", default="differential_report.csv")
+    args = args.parse_args()
+
+    config = get_cfg()
+    if args.fills:
+        config.backtester.fills = args.fills
+    if args.checked_in:
+        print(check_reference_outputs(config, args.tolerance))
+    report = run_harness(config, args.engines, args.configs, args.synthetic, tolerance=args.tolerance)
+    report.to_csv(args.output, index=False)
+    print(report.to_string(index=False))
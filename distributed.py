@@ -0,0 +1,270 @@
+import os
+import time
+import socket
+import hashlib
+import secrets
+import argparse
+import threading
+import multiprocessing
+import pandas as pd
+from pathlib import Path
+from collections import deque
+from typing import Dict, List, Tuple
+from multiprocessing.connection import Listener, Client, Connection
+from easydict import EasyDict
+from utils import get_cfg
+from worker import backtest
+from orchestrator import sweep_configs
+
+# multiprocessing.connection unpickles every message, so anyone holding the key can run code on the
+# coordinator and the agents: only run them on a trusted network, the key only keeps others out
+AUTHKEY_VARIABLE = "BACKTEST_AUTHKEY"
+BATCH_SIZE = 4  # Jobs handed to an agent per request
+JOB_TIMEOUT = 3600  # Seconds before a job held by an agent is handed to another one
+DRAIN_TIMEOUT = 30  # Seconds the coordinator keeps serving once every job has a result
+
+
+def get_authkey(generate: bool = False) -> bytes:
+    """Shared key of the coordinator and its agents, read from BACKTEST_AUTHKEY
+
+    Args:
+        generate (bool, optional): Generate and print a key when the variable is not set, for the coordinator. Defaults to False.
+
+    Returns:
+        bytes: The key
+    """
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if authkey:
+        return authkey.encode()
+    if not generate:
+        raise ValueError(f"Set {AUTHKEY_VARIABLE} to the key printed by the coordinator")
+    authkey = secrets.token_bytes(32).hex()
+    print(f"Generated a key, start the agents with {AUTHKEY_VARIABLE}={authkey}")
+    return authkey.encode()
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def file_hash(file_path: Path) -> str:
+    """sha256 of a file"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_files(config: EasyDict) -> List[Path]:
+    """Data files read by a backtest with this config"""
+    DATA_DIR = Path(config.data.path)
+    timeframes = {config.backtester.high_time, config.backtester.low_time}
+    return sorted(DATA_DIR / config.data.files[timeframe] for timeframe in timeframes)
+
+
+class Coordinator:
+    """Serve backtest jobs to agents over TCP and collect their results.
+
+    Agents pull batches of jobs and stream back one result per job. A job is handed to another
+    agent when its agent disconnects or has held it for longer than job_timeout; the first result
+    received for a job is kept. Once every job has a result, the connected agents are told the
+    sweep is done for up to drain_timeout seconds before the listener closes.
+
+    Messages are pickled, so the coordinator must only listen on a trusted network.
+    """
+
+    def __init__(
+        self,
+        configs: List[EasyDict],
+        address: Tuple[str, int],
+        authkey: bytes,
+        batch_size: int = BATCH_SIZE,
+        job_timeout: float = JOB_TIMEOUT,
+        drain_timeout: float = DRAIN_TIMEOUT,
+    ):
+        self.configs = configs
+        self.address = address
+        self.authkey = authkey
+        self.batch_size = batch_size
+        self.job_timeout = job_timeout
+        self.drain_timeout = drain_timeout
+        self.hashes = {
+            str(file_path): file_hash(file_path)
+            for file_path in {file_path for config in configs for file_path in data_files(config)}
+        }
+        self.pending = deque(range(len(configs)))
+        self.in_flight = {}  # job id -> (agent, deadline)
+        self.results = {}
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.closed = threading.Event()
+        self.agents = set()  # Connections not yet told the sweep is done
+
+    def _next_batch(self, agent: str) -> List[Tuple[int, EasyDict]]:
+        with self.lock:
+            now = time.monotonic()
+            for job_id, (holder, deadline) in list(self.in_flight.items()):
+                if deadline < now:
+                    print(f"Job {job_id} timed out on {holder}, reassigning")
+                    del self.in_flight[job_id]
+                    self.pending.append(job_id)
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                job_id = self.pending.popleft()
+                if job_id in self.results:
+                    continue
+                self.in_flight[job_id] = (agent, now + self.job_timeout)
+                batch.append((job_id, self.configs[job_id]))
+            return batch
+
+    def _requeue(self, agent: str):
+        with self.lock:
+            for job_id, (holder, _) in list(self.in_flight.items()):
+                if holder == agent:
+                    del self.in_flight[job_id]
+                    self.pending.appendleft(job_id)
+
+    def _serve(self, conn: Connection):
+        agent = None
+        with self.lock:
+            self.agents.add(conn)
+        try:
+            hello = conn.recv()
+            agent = hello["agent"]
+            print(f"Agent {agent} connected")
+            while True:
+                message = conn.recv()
+                if message["type"] == "result":
+                    with self.lock:
+                        self.in_flight.pop(message["job_id"], None)
+                        self.results.setdefault(message["job_id"], message["result"])
+                        if len(self.results) == len(self.configs):
+                            self.finished.set()
+                elif message["type"] == "hash_mismatch":
+                    print(f"Agent {agent} has different data: {message['files']}")
+                    break
+                elif message["type"] == "ready":
+                    batch = self._next_batch(agent)
+                    if batch:
+                        conn.send({"type": "batch", "jobs": batch, "hashes": self.hashes})
+                    elif self.finished.is_set():
+                        conn.send({"type": "done"})
+                        break
+                    else:
+                        conn.send({"type": "wait"})
+        except (EOFError, OSError):
+            print(f"Agent {agent} disconnected")
+        finally:
+            if agent is not None:
+                self._requeue(agent)
+            with self.lock:
+                self.agents.discard(conn)
+            conn.close()
+
+    def run(self) -> pd.DataFrame:
+        """Serve the jobs until every one of them has a result and the agents are told so
+
+        Returns:
+            pd.DataFrame: Metrics of every job, indexed by the job id
+        """
+        listener = Listener(self.address, authkey=self.authkey)
+        print(f"Coordinator listening on {self.address[0]}:{self.address[1]} with {len(self.configs)} jobs")
+
+        def accept():
+            # Agents connecting after the last result are served too, they are told the sweep is done
+            while not self.closed.is_set():
+                try:
+                    conn = listener.accept()
+                except multiprocessing.AuthenticationError as e:
+                    # A client without the key, the agents connecting after it are still accepted
+                    print(f"Rejected a connection: {e}")
+                    continue
+                except (OSError, EOFError):
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        self.finished.wait()
+        deadline = time.monotonic() + self.drain_timeout
+        while self.agents and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if self.agents:
+            print(f"{len(self.agents)} agents were not told the sweep is done")
+        self.closed.set()
+        listener.close()
+        return pd.DataFrame.from_dict(self.results, orient="index").sort_index()
+
+
+def _backtest(config: EasyDict) -> pd.Series:
+    """Run a job, a failing job gives its error as result instead of being retried"""
+    try:
+        return backtest(config)
+    except Exception as e:
+        return pd.Series({"error": repr(e)})
+
+
+def run_agent(address: Tuple[str, int], processes: int, authkey: bytes, poll: float = 1.0):
+    """Pull batches of jobs from a coordinator and stream back their metrics
+
+    The data files of every batch are checked against the coordinator's hashes before running it.
+    The sweep is over when the coordinator says so or closes the connection.
+
+    Args:
+        address (Tuple[str, int]): Address of the coordinator
+        processes (int): Number of worker processes
+        authkey (bytes): Shared key of the coordinator
+        poll (float, optional): Seconds to wait when the coordinator is not up or has no job available. Defaults to 1.0.
+    """
+    agent = f"{socket.gethostname()}:{os.getpid()}"
+    hashes: Dict[str, str] = {}
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            # The coordinator may still be hashing the data files
+            time.sleep(poll)
+    try:
+        conn.send({"type": "hello", "agent": agent})
+        with multiprocessing.Pool(processes) as pool:
+            while True:
+                conn.send({"type": "ready"})
+                message = conn.recv()
+                if message["type"] == "done":
+                    break
+                if message["type"] == "wait":
+                    time.sleep(poll)
+                    continue
+                for file_path in message["hashes"]:
+                    if file_path not in hashes:
+                        hashes[file_path] = file_hash(Path(file_path)) if Path(file_path).exists() else None
+                mismatched = [file_path for file_path, expected in message["hashes"].items() if hashes[file_path] != expected]
+                if mismatched:
+                    print(f"Data differs from the coordinator's: {mismatched}")
+                    conn.send({"type": "hash_mismatch", "files": mismatched})
+                    break
+                job_ids = [job_id for job_id, _ in message["jobs"]]
+                configs = [config for _, config in message["jobs"]]
+                for job_id, result in zip(job_ids, pool.imap(_backtest, configs)):
+                    conn.send({"type": "result", "job_id": job_id, "result": result})
+    except (EOFError, ConnectionError):
+        print("Coordinator closed the connection, the sweep is over")
+    conn.close()
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("role", choices=["coordinator", "agent"])
+    args.add_argument("-a", "--address", default="127.0.0.1:6000", help="host:port of the coordinator, on a trusted network only")
+    args.add_argument("-j", "--jobs", type=int, default=max(1, os.cpu_count() // 2), help="Worker processes of an agent")
+    args.add_argument("-o", "--output", default="sweep_results.csv", help="Results file of the coordinator")
+    args = args.parse_args()
+
+    if args.role == "coordinator":
+        results = Coordinator(sweep_configs(get_cfg()), parse_address(args.address), get_authkey(generate=True)).run()
+        results.to_csv(args.output)
+        print(results.to_string())
+    else:
+        run_agent(parse_address(args.address), args.jobs, get_authkey())
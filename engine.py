@@ -0,0 +1,137 @@
+import json
+import hashlib
+from datetime import datetime
+from dataclasses import dataclass, astuple
+from easydict import EasyDict
+from utils import to_minutes, handle_date_time, FILLS, TIE_BREAKS
+
+
+@dataclass(slots=True)
+class EngineState:
+    """State of the trade, read and written by the engine and the strategies on every bar"""
+
+    tp: float  # Target Price Percentage
+    sl: float  # Stop Loss Percentage
+    entry_price: float = 1
+    trailing_price: float = 0  # Used for the calculation of trailing stop loss
+    date_time: object = None
+    status: int = 0  # 1 long, -1 short and 0 no position
+    total_fee: float = 0
+    trades: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class EngineConfig:
+    """Backtester values read by the engine, resolved and validated once per run"""
+
+    tp: float
+    sl: float
+    capital: float
+    slippage: float
+    leverage: float
+    margin: float
+    trailing: bool
+    low_time: int  # Minutes
+    high_time: int  # Minutes
+    entry_date: datetime
+    exit_date: datetime
+    fills: str = "close"  # One of FILLS
+    tie_break: str = "sl"  # One of TIE_BREAKS
+    coarse_time: int = 0  # Minutes per block of coarse_levels, 0 to scan every bar
+    max_open: int = 1  # Positions open at once, above 1 the run is on the position book
+    position_size: float = 1.0  # Fraction of the capital committed to each position
+    checkpoint: bool = False  # Checkpoints are saved during the run
+
+    def __post_init__(self):
+        for name in ("tp", "sl", "capital", "leverage", "margin"):
+            if not getattr(self, name) > 0:
+                raise ValueError(f"backtester.{name} should be positive, got {getattr(self, name)}")
+        if self.slippage < 0:
+            raise ValueError(f"backtester.slippage should not be negative, got {self.slippage}")
+        if self.low_time >= self.high_time:
+            raise ValueError(f"low_time of {self.low_time}m should be shorter than high_time of {self.high_time}m")
+        if self.fills not in FILLS:
+            raise ValueError(f"backtester.fills should be one of {FILLS}, got {self.fills}")
+        if self.tie_break not in TIE_BREAKS:
+            raise ValueError(f"backtester.tie_break should be one of {TIE_BREAKS}, got {self.tie_break}")
+        if self.coarse_time and (self.coarse_time % self.low_time or self.coarse_time < 2 * self.low_time):
+            raise ValueError(
+                f"backtester.coarse_time of {self.coarse_time}m should be a multiple of low_time of {self.low_time}m, at least twice it"
+            )
+        if self.max_open < 1:
+            raise ValueError(f"backtester.positions.max_open should be at least 1, got {self.max_open}")
+        if not 0 < self.position_size <= 1:
+            raise ValueError(f"backtester.positions.size should be in (0, 1], got {self.position_size}")
+        # Open positions are not marked to market, so the capital they commit must be there
+        if self.position_size * self.max_open > 1 + 1e-9:
+            raise ValueError(
+                f"backtester.positions commits {self.position_size * self.max_open:g} times the capital, "
+                f"size times max_open should be at most 1"
+            )
+        if self.checkpoint and self.max_open > 1:
+            raise ValueError("backtester.checkpoint is not supported with positions.max_open above 1, the position book takes no checkpoints")
+        if self.entry_date >= self.exit_date:
+            raise ValueError(f"start_date {self.entry_date} should be before end_date {self.exit_date}")
+
+    @classmethod
+    def from_config(cls, config: EasyDict) -> "EngineConfig":
+        backtester = config.backtester
+        coarse_time = backtester.get("coarse_time")
+        positions = backtester.get("positions", {})
+        return cls(
+            tp=float(backtester.tp),
+            sl=float(backtester.sl),
+            capital=float(backtester.capital),
+            slippage=float(backtester.slippage),
+            leverage=backtester.leverage,
+            margin=float(backtester.margin),
+            trailing=bool(backtester.trailing),
+            low_time=to_minutes(backtester.low_time),
+            high_time=to_minutes(backtester.high_time),
+            entry_date=handle_date_time(config.data.start_date),
+            exit_date=handle_date_time(config.data.end_date),
+            fills=backtester.get("fills", "close"),
+            tie_break=backtester.get("tie_break", "sl"),
+            coarse_time=to_minutes(coarse_time) if coarse_time else 0,
+            max_open=int(positions.get("max_open", 1)),
+            position_size=float(positions.get("size", 1.0)),
+            checkpoint=bool(backtester.get("checkpoint", {}).get("enabled", False)),
+        )
+
+    @property
+    def coarse_block(self) -> int:
+        """Low timeframe bars per block of coarse_levels, 0 to scan every bar"""
+        return self.coarse_time // self.low_time
+
+    def state(self, date_time=None) -> EngineState:
+        """Initial state of a run"""
+        return EngineState(tp=self.tp, sl=self.sl, date_time=date_time)
+
+    def engine_kwargs(self) -> dict:
+        """Keyword arguments of generate_signals"""
+        return {
+            "low_time": self.low_time,
+            "high_time": self.high_time,
+            "margin": self.margin,
+            "leverage": self.leverage,
+            "trailing": self.trailing,
+            "slippage": self.slippage,
+            "capital": self.capital,
+            "entry_date": self.entry_date,
+            "exit_date": self.exit_date,
+            "fills": self.fills,
+            "tie_break": self.tie_break,
+        }
+
+    def position_kwargs(self) -> dict:
+        """Keyword arguments of generate_positions besides those of generate_signals"""
+        return {"max_open": self.max_open, "size": self.position_size}
+
+    def digest(self) -> str:
+        """Canonical hash of the values"""
+        return hashlib.sha1(repr(astuple(self)).encode()).hexdigest()
+
+
+def config_digest(config: EasyDict) -> str:
+    """Canonical hash of a whole config, the same for configs with the same values in any order"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
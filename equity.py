@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from utils import to_timestamps
+
+ORDER_STATUS = {"LONG": 1, "SHORT": -1, "Squared_Off": 0}
+
+
+def mark_to_market(
+    low_ns: np.ndarray,
+    low_close: np.ndarray,
+    event_ns: np.ndarray,
+    event_status: np.ndarray,
+    event_price: np.ndarray,
+    event_capital: np.ndarray,
+    leverage: float = 1,
+    slippage: float = 0.0015,
+    capital: float = 1000,
+    dtype: type = np.float32,
+) -> np.ndarray:
+    """Equity on every low timeframe bar from the position state after each trade event
+
+    Each bar takes the state of the last event at or before it: the position, its entry price
+    and the capital after the event (fees already charged). The open position is valued at the
+    bar close with leverage applied and net of the fee charged when it is closed, so the curve
+    meets the realised capital at every exit filled at a bar close.
+
+    Args:
+        low_ns (np.ndarray): int64 timestamps of the low timeframe bars
+        low_close (np.ndarray): Close of the low timeframe bars
+        event_ns (np.ndarray): int64 timestamps of the trade events, sorted
+        event_status (np.ndarray): Position after each event, 1 long, -1 short and 0 flat
+        event_price (np.ndarray): Executed price of each event
+        event_capital (np.ndarray): Capital after each event
+        leverage (float, optional): Leverage for the trade. Defaults to 1.
+        slippage (float, optional): Slippage for the trade, charged on the capital at the exit. Defaults to 0.0015.
+        capital (float, optional): Initial Capital before the first event. Defaults to 1000.
+        dtype (type, optional): dtype of the stored curve. Defaults to np.float32.
+
+    Returns:
+        np.ndarray: Equity on every low timeframe bar
+    """
+    last = np.searchsorted(event_ns, low_ns, side="right") - 1
+    status = np.concatenate(([0], event_status))[last + 1].astype(np.float64)
+    entry_price = np.concatenate(([1.0], event_price))[last + 1].astype(np.float64)
+    entry_price = np.where(status == 0, 1.0, entry_price)
+    balance = np.concatenate(([capital], event_capital))[last + 1].astype(np.float64)
+    close = np.asarray(low_close, dtype=np.float64)
+    fee = np.where(status == 0, 0.0, slippage)
+    equity = balance * (1 + ((close - entry_price) / entry_price) * status * leverage - fee)
+    return equity.astype(dtype)
+
+
+def equity_from_trade_sheet(
+    trade_sheet: pd.DataFrame,
+    low_csv: pd.DataFrame,
+    leverage: float = 1,
+    slippage: float = 0.0015,
+    capital: float = 1000,
+    dtype: type = np.float32,
+) -> pd.DataFrame:
+    """Mark-to-market equity curve of a trade sheet at the low timeframe resolution
+
+    Args:
+        trade_sheet (pd.DataFrame): Trade Book logged by generate_signals
+        low_csv (pd.DataFrame): Low timeframe data
+        leverage (float, optional): Leverage for the trade. Defaults to 1.
+        slippage (float, optional): Slippage for the trade. Defaults to 0.0015.
+        capital (float, optional): Initial Capital for the trade. Defaults to 1000.
+        dtype (type, optional): dtype of the stored curve. Defaults to np.float32.
+
+    Returns:
+        pd.DataFrame: 'datetime' as int64 nanoseconds and 'capital' on every low timeframe bar
+    """
+    low_ns = to_timestamps(low_csv["datetime"])
+    equity = mark_to_market(
+        low_ns,
+        low_csv["close"].to_numpy(),
+        to_timestamps(trade_sheet["date_time"]),
+        trade_sheet["order_status"].map(ORDER_STATUS).to_numpy(),
+        trade_sheet["executed_price"].to_numpy(dtype=np.float64),
+        trade_sheet["capital"].to_numpy(dtype=np.float64),
+        leverage,
+        slippage,
+        capital,
+        dtype,
+    )
+    return pd.DataFrame({"datetime": low_ns, "capital": equity})
+
+
+def _annualised_ratio(returns: np.ndarray, deviations: np.ndarray, bars_per_year: float) -> float:
+    # NaN like compute_metrics when the deviation is undefined or zero
+    if len(returns) == 0 or len(deviations) < 2:
+        return np.nan
+    deviation = deviations.std(ddof=1)
+    if deviation == 0:
+        return np.nan
+    return returns.mean() / deviation * np.sqrt(bars_per_year)
+
+
+def equity_metrics(equity: pd.DataFrame, bars_per_year: float) -> dict:
+    """Drawdown and risk adjusted returns of a mark-to-market equity curve
+
+    Bars following a zero capital have no return. A ratio is NaN when its deviation is taken on
+    fewer than two returns or is zero, e.g. on a constant curve.
+
+    Args:
+        equity (pd.DataFrame): Equity curve with the 'capital' column
+        bars_per_year (float): Number of bars in a year, used to annualise the ratios
+
+    Returns:
+        dict: max_dd, sharpe_ratio and sortino_ratio
+    """
+    capital = equity["capital"].to_numpy(dtype=np.float64)
+    if len(capital) == 0:
+        return {"max_dd": np.nan, "sharpe_ratio": np.nan, "sortino_ratio": np.nan}
+    cumulative_max = np.maximum.accumulate(capital)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drawdown = (capital - cumulative_max) / cumulative_max * 100
+        returns = np.diff(capital) / capital[:-1]
+    drawdown = drawdown[np.isfinite(drawdown)]
+    max_drawdown = drawdown.min() if len(drawdown) else np.nan
+    returns = returns[np.isfinite(returns)]
+    neg_returns = returns[returns < 0]
+    sharpe_ratio = _annualised_ratio(returns, returns, bars_per_year)
+    sortino_ratio = _annualised_ratio(returns, neg_returns, bars_per_year)
+    return {"max_dd": max_drawdown, "sharpe_ratio": sharpe_ratio, "sortino_ratio": sortino_ratio}
+
+
+def save_equity(file_path: str, equity: pd.DataFrame):
+    """Save an equity curve as a compressed npz file"""
+    np.savez_compressed(file_path, datetime=equity["datetime"].to_numpy(), capital=equity["capital"].to_numpy())
+
+
+def load_equity(file_path: str) -> pd.DataFrame:
+    """Load an equity curve saved by save_equity"""
+    with np.load(file_path) as data:
+        return pd.DataFrame({"datetime": data["datetime"], "capital": data["capital"]})
@@ -0,0 +1,448 @@
+import itertools
+import numpy as np
+import pandas as pd
+from easydict import EasyDict
+from datetime import datetime
+from typing import List, Tuple
+from pprint import pprint
+from utils import (
+    get_cfg, load_high_low, to_minutes, handle_date_time, index_range, to_timestamps, format_date_time, intrabar_exits,
+    INTRABAR_COLUMNS,
+)
+from data_quality import open_time_table
+from strategy import BaseStrategy, get_strategy
+from engine import EngineConfig
+
+MAX_BLOCK_SIZE = 4_000_000  # Max number of (parameter set, low bar) cells evaluated at once
+NO_HIT = np.iinfo(np.int64).max
+
+
+def param_grid(
+    tp: List[float],
+    sl: List[float],
+    trailing: List[bool] = (False,),
+    leverage: List[int] = (1,),
+) -> pd.DataFrame:
+    """Build the cartesian product of the exit parameters
+
+    Args:
+        tp (List[float]): Target Price Percentages
+        sl (List[float]): Stop Loss Percentages
+        trailing (List[bool], optional): Trailing stop loss flags. Defaults to (False,).
+        leverage (List[int], optional): Leverages. Defaults to (1,).
+
+    Returns:
+        pd.DataFrame: One row per parameter set with the tp, sl, trailing and leverage columns
+    """
+    rows = list(itertools.product(tp, sl, trailing, leverage))
+    return pd.DataFrame(rows, columns=["tp", "sl", "trailing", "leverage"])
+
+
+def compute_entries(
+    strategy: BaseStrategy,
+    high_csv: pd.DataFrame,
+    low_csv: pd.DataFrame,
+    low_time: int = 3,
+    high_time: int = 1440,
+    entry_date: datetime = None,
+    exit_date: datetime = None,
+) -> EasyDict:
+    """Evaluate the strategy hooks once on every high timeframe bar
+
+    The entry and exit bars of a strategy do not depend on the exit parameters, so they
+    are computed once here and shared by every parameter set of a grid. Bars whose open
+    time cannot be resolved in the low timeframe data are dropped, as generate_signals skips them.
+
+    Args:
+        strategy (BaseStrategy): Strategy to be used for generating the signals
+        high_csv (pd.DataFrame): High timeframe data
+        low_csv (pd.DataFrame): Low timeframe data
+        low_time (int, optional): Low timeframe in minutes. Defaults to 3.
+        high_time (int, optional): High timeframe in minutes. Defaults to 1440.
+        entry_date (datetime, optional): Entry date for the trade. Defaults to None.
+        exit_date (datetime, optional): Exit date for the trade. Defaults to None.
+
+    Returns:
+        EasyDict: Signal bars with their flags, entry prices and open times along with the
+        timestamps and closes needed to evaluate the exits
+    """
+    entry_index, exit_index = index_range(high_csv, entry_date, exit_date)
+    glob = strategy.glob
+    open_times = open_time_table(high_csv, low_csv, low_time, high_time)
+
+    bars, flags, long_price, short_price = [], [], [], []
+    for i in range(entry_index, exit_index):
+        bar = strategy.cursor.move(i)
+        long_entry = bool(strategy.check_long_entry(bar))
+        price_long = glob.entry_price
+        short_entry = bool(strategy.check_short_entry(bar))
+        price_short = glob.entry_price
+        long_exit = bool(strategy.check_long_exit(bar))
+        short_exit = bool(strategy.check_short_exit(bar))
+        if not (long_entry or short_entry or long_exit or short_exit):
+            continue
+        if not open_times.flag[i]:
+            continue
+        bars.append(i)
+        flags.append((long_entry, short_entry, long_exit, short_exit))
+        long_price.append(price_long)
+        short_price.append(price_short)
+
+    bars = np.array(bars, dtype=np.int64)
+    final_time = open_times.time[exit_index - 1]
+    if not open_times.flag[exit_index - 1]:
+        final_time = high_csv["datetime"].iloc[exit_index]
+
+    flags = np.array(flags, dtype=bool).reshape(-1, 4)
+    return EasyDict(
+        entry_index=entry_index,
+        exit_index=exit_index,
+        bars=bars,
+        long_entry=flags[:, 0],
+        short_entry=flags[:, 1],
+        long_exit=flags[:, 2],
+        short_exit=flags[:, 3],
+        long_price=np.array(long_price, dtype=np.float64),
+        short_price=np.array(short_price, dtype=np.float64),
+        open_times=open_times.time[bars],
+        final_time=final_time,
+        high_ns=to_timestamps(high_csv["datetime"]),
+        high_close=high_csv["close"].to_numpy(dtype=np.float64),
+        low_ns=to_timestamps(low_csv["datetime"]),
+        low_close=low_csv["close"].to_numpy(dtype=np.float64),
+        low_datetime=low_csv["datetime"].to_numpy(),
+        # Ranges of the low bars for the intrabar fills, when the data has them
+        low_ohl={
+            column: low_csv[column].to_numpy(dtype=np.float64) for column in INTRABAR_COLUMNS[:3] if column in low_csv
+        },
+    )
+
+
+def _next_closing_events(entries: EasyDict) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of the next event closing a long / short position opened at each event"""
+    n = len(entries.bars)
+    next_long, next_short = np.full(n, n), np.full(n, n)
+    close_long = entries.short_entry | entries.long_exit
+    close_short = entries.long_entry | entries.short_exit
+    nxt_l, nxt_s = n, n
+    for k in range(n - 1, -1, -1):
+        next_long[k], next_short[k] = nxt_l, nxt_s
+        if close_long[k]:
+            nxt_l = k
+        if close_short[k]:
+            nxt_s = k
+    return next_long, next_short
+
+
+def _first_hits(
+    closes: np.ndarray,
+    entry_price: float,
+    status: int,
+    tp: np.ndarray,
+    sl: np.ndarray,
+    trailing: np.ndarray,
+    leverage: np.ndarray,
+    margin: float,
+) -> np.ndarray:
+    """First low bar hitting the target, stop, trailing stop or margin price for each parameter set
+
+    Uses the same price formulas as tpsl so that the hit bars match bit for bit.
+
+    Returns:
+        np.ndarray: Offset of the first hit in closes for each parameter set, -1 if nothing is hit
+    """
+    hits = np.full(len(tp), -1, dtype=np.int64)
+    if len(closes) == 0:
+        return hits
+    accumulate = np.maximum.accumulate if status == 1 else np.minimum.accumulate
+    trailing_price = accumulate(np.concatenate(([entry_price], closes)))[1:]
+    target_price = entry_price + status * entry_price * tp
+    stop_loss = entry_price - status * entry_price * sl
+    margin_price = entry_price - status * margin / leverage * entry_price
+
+    block = max(1, MAX_BLOCK_SIZE // len(closes))
+    for start in range(0, len(tp), block):
+        rows = slice(start, start + block)
+        trailing_stop_loss = trailing_price - (status * trailing_price) * sl[rows, None]
+        if status == 1:
+            hit = (
+                (target_price[rows, None] <= closes)
+                | (stop_loss[rows, None] >= closes)
+                | (trailing[rows, None] & (trailing_stop_loss >= closes))
+                | (margin_price[rows, None] >= closes)
+            )
+        else:
+            hit = (
+                (target_price[rows, None] >= closes)
+                | (stop_loss[rows, None] <= closes)
+                | (trailing[rows, None] & (trailing_stop_loss <= closes))
+                | (margin_price[rows, None] <= closes)
+            )
+        first = hit.argmax(axis=1)
+        hits[rows] = np.where(hit[np.arange(len(first)), first], first, -1)
+    return hits
+
+
+def evaluate_grid(
+    entries: EasyDict,
+    grid: pd.DataFrame,
+    margin: float = 0.02,
+    slippage: float = 0.0015,
+    capital: float = 1000,
+    fills: str = "close",
+    tie_break: str = "sl",
+) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+    """Evaluate a grid of exit parameter sets over one fixed set of entries
+
+    All parameter sets are stepped together through the signal bars. The TP/SL scan of every
+    position is evaluated with NumPy for all the parameter sets holding it at once, so the
+    cost grows with the number of trades instead of the number of bars times parameter sets.
+    Trade accounting follows generate_signals: the fee is charged on every close and a
+    TP/SL hit on a signal bar skips that bar's signal. When a bar carries both a reversal
+    and an exit signal the reversal takes precedence.
+
+    Args:
+        entries (EasyDict): Signal bars computed by compute_entries
+        grid (pd.DataFrame): Parameter sets with the tp, sl, trailing and leverage columns
+        margin (float, optional): Margin for the trade. Defaults to 0.02.
+        slippage (float, optional): Slippage for the trade. Defaults to 0.0015.
+        capital (float, optional): Initial Capital for the trade. Defaults to 1000.
+        fills (str, optional): Exits checked against the close, or the high and low with intrabar_exits, of every low bar. Defaults to "close".
+        tie_break (str, optional): Exit of an intrabar bar touching both the target and a stop, sl, tp or open. Defaults to "sl".
+
+    Returns:
+        Tuple (pd.DataFrame, List[pd.DataFrame]):
+        - The grid with one row of metrics per parameter set
+        - The trade by trade equity curve of each parameter set
+    """
+    grid = pd.DataFrame(grid).reset_index(drop=True)
+    n = len(grid)
+    tp = grid["tp"].to_numpy(dtype=np.float64)
+    sl = grid["sl"].to_numpy(dtype=np.float64)
+    trailing = grid["trailing"].to_numpy(dtype=bool)
+    leverage = grid["leverage"].to_numpy(dtype=np.float64)
+
+    bars, high_ns, low_ns = entries.bars, entries.high_ns, entries.low_ns
+    if fills == "intrabar" and len(entries.low_ohl) < 3:
+        raise ValueError(f"Intrabar fills need the {INTRABAR_COLUMNS} columns of the low timeframe data")
+    next_long, next_short = _next_closing_events(entries)
+    exit_index = entries.exit_index
+
+    def low_start(bar: int) -> int:
+        return max(int(np.searchsorted(low_ns, high_ns[bar], "left")), 1)
+
+    status = np.zeros(n, dtype=np.int64)
+    entry_price = np.zeros(n)
+    hit_index = np.zeros(n, dtype=np.int64)
+    hit_price = np.zeros(n)
+    hit_bar = np.full(n, NO_HIT, dtype=np.int64)
+    cap = np.full(n, float(capital))
+    total_fee = np.zeros(n)
+    records = []  # (param rows, date_time, executed_price, capital, signal, order_type, profit_loss%, pnl)
+
+    def record(rows, date_time, price, signal, order_type, p, pnl):
+        count = len(rows)
+        records.append((
+            rows,
+            np.broadcast_to(np.asarray(date_time, dtype=object), (count,)),
+            np.broadcast_to(price, (count,)),
+            cap[rows].copy(),
+            np.broadcast_to(signal, (count,)),
+            np.broadcast_to(np.asarray(order_type, dtype=object), (count,)),
+            np.broadcast_to(p, (count,)),
+            np.broadcast_to(pnl, (count,)),
+        ))
+
+    def close(rows, exit_price):
+        e, s = entry_price[rows], status[rows]
+        pnl = cap[rows] * ((exit_price - e) / e) * s * leverage[rows]
+        p = ((exit_price - e) / e) * s * leverage[rows]
+        total_fee[rows] += cap[rows] * slippage
+        cap[rows] -= cap[rows] * slippage
+        cap[rows] += pnl
+        return pnl, p
+
+    def close_at_hit(rows):
+        idx = hit_index[rows]
+        exit_price = hit_price[rows]
+        signal = -1 * status[rows]
+        pnl, p = close(rows, exit_price)
+        order_type = np.where(pnl > 0, "TP", np.where(margin / leverage[rows] > sl[rows], "SL", "Margin"))
+        status[rows] = 0
+        hit_bar[rows] = NO_HIT
+        record(rows, entries.low_datetime[idx], exit_price, signal, order_type, p, pnl)
+
+    def open_position(rows, k, side):
+        bar = bars[k]
+        price = entries.long_price[k] if side == 1 else entries.short_price[k]
+        closing = (next_long if side == 1 else next_short)[k]
+        last_bar = bars[closing] if closing < len(bars) else exit_index - 1
+        start = low_start(bar + 1)
+        end = int(np.searchsorted(low_ns, high_ns[last_bar + 1], "left"))
+        if fills == "intrabar":
+            hits, prices = np.full(len(rows), -1, dtype=np.int64), np.zeros(len(rows))
+            block = max(1, MAX_BLOCK_SIZE // max(end - start, 1))
+            for first in range(0, len(rows), block):
+                chunk = rows[first : first + block]
+                hits[first : first + block], prices[first : first + block] = intrabar_exits(
+                    *(entries.low_ohl[column][start:end] for column in INTRABAR_COLUMNS[:3]),
+                    price, side, tp[chunk], sl[chunk], trailing[chunk], leverage[chunk], margin, tie_break=tie_break,
+                )
+        else:
+            hits = _first_hits(entries.low_close[start:end], price, side, tp[rows], sl[rows], trailing[rows], leverage[rows], margin)
+            prices = entries.low_close[np.maximum(start + hits, 0)]
+        status[rows] = side
+        entry_price[rows] = price
+        hit_index[rows] = start + hits
+        hit_price[rows] = prices
+        hit_bar[rows] = np.where(
+            hits >= 0,
+            np.searchsorted(high_ns, low_ns[np.maximum(start + hits, 0)], "right") - 1,
+            NO_HIT,
+        )
+
+    for k, bar in enumerate(bars):
+        hit = np.flatnonzero((status != 0) & (hit_bar <= bar))
+        skipped = hit[hit_bar[hit] == bar]
+        if len(hit):
+            close_at_hit(hit)
+        active = np.ones(n, dtype=bool)
+        active[skipped] = False
+        long_entry, short_entry = entries.long_entry[k], entries.short_entry[k]
+        long_exit, short_exit = entries.long_exit[k], entries.short_exit[k]
+        date_time, price = entries.open_times[k], entries.high_close[bar]
+
+        flat = np.flatnonzero(active & (status == 0))
+        longs = np.flatnonzero(active & (status == 1))
+        shorts = np.flatnonzero(active & (status == -1))
+        if (long_entry or short_entry) and len(flat):
+            side = 1 if long_entry else -1
+            open_position(flat, k, side)
+            record(flat, date_time, price, side, "Market", 0.0, np.nan)
+        if (short_entry or long_exit) and len(longs):
+            pnl, p = close(longs, price)
+            if short_entry:
+                open_position(longs, k, -1)
+                record(longs, date_time, price, -2, "Market", p, pnl)
+            else:
+                status[longs] = 0
+                hit_bar[longs] = NO_HIT
+                record(longs, date_time, price, -1, "Market", p, pnl)
+        if (long_entry or short_exit) and len(shorts):
+            pnl, p = close(shorts, price)
+            if long_entry:
+                open_position(shorts, k, 1)
+                record(shorts, date_time, price, 2, "Market", p, pnl)
+            else:
+                status[shorts] = 0
+                hit_bar[shorts] = NO_HIT
+                record(shorts, date_time, price, 1, "Market", p, pnl)
+
+    hit = np.flatnonzero((status != 0) & (hit_bar < exit_index))
+    if len(hit):
+        close_at_hit(hit)
+    open_rows = np.flatnonzero(status != 0)
+    if len(open_rows):
+        price = entries.high_close[exit_index]
+        signal = -1 * status[open_rows]
+        pnl, p = close(open_rows, price)
+        status[open_rows] = 0
+        record(open_rows, entries.final_time, price, signal, "Market", p, pnl)
+
+    columns = ["date_time", "executed_price", "capital", "signal", "order_type", "profit_loss%", "pnl"]
+    if records:
+        rows = np.concatenate([r[0] for r in records])
+        values = [np.concatenate([r[j] for r in records]) for j in range(1, 8)]
+    else:
+        rows, values = np.zeros(0, dtype=np.int64), [np.zeros(0)] * 7
+    order = np.argsort(rows, kind="stable")
+    splits = np.searchsorted(rows[order], np.arange(1, n))
+    curves = []
+    for chunk in np.split(order, splits):
+        curve = pd.DataFrame({name: value[chunk] for name, value in zip(columns, values)})
+        curve["date_time"] = curve["date_time"].map(format_date_time)
+        curve["signal"] = curve["signal"].astype(int)
+        curves.append(curve)
+
+    metrics = pd.DataFrame([_curve_metrics(curve, capital) for curve in curves])
+    metrics["total_fee"] = total_fee
+    return pd.concat([grid, metrics], axis=1), curves
+
+
+def _curve_metrics(curve: pd.DataFrame, initial_capital: float) -> dict:
+    """Headline metrics of one equity curve, computed as in compute_metrics"""
+    capital = curve["capital"].to_numpy(dtype=np.float64)
+    pnl = curve["pnl"].to_numpy(dtype=np.float64)
+    # Gross profit and loss are the capital changes of the closes, after the fee
+    change = (capital - np.concatenate(([initial_capital], capital[:-1])))[~np.isnan(pnl)]
+    returns = curve["profit_loss%"].to_numpy(dtype=np.float64)[~np.isnan(pnl)]
+    returns = returns[returns != 0]
+    pnl = pnl[~np.isnan(pnl)]
+
+    if len(capital):
+        cumulative_max = np.maximum.accumulate(capital)
+        max_drawdown = ((capital - cumulative_max) / cumulative_max * 100).min()
+        final_balance = capital[-1]
+    else:
+        max_drawdown, final_balance = 0.0, initial_capital
+    trades = len(pnl)
+    avg_returns = returns.mean() if len(returns) else np.nan
+    returns_dev = returns.std(ddof=1) if len(returns) > 1 else np.nan
+    neg_returns = returns[returns < 0]
+    neg_dev = neg_returns.std(ddof=1) if len(neg_returns) > 1 else np.nan
+    return {
+        "final_balance": final_balance,
+        "net_profit": final_balance - initial_capital,
+        "gross_profit": change[pnl > 0].sum(),
+        "gross_loss": change[pnl < 0].sum(),
+        "win_rate": (pnl > 0).sum() / trades * 100 if trades else np.nan,
+        "loss_rate": (pnl < 0).sum() / trades * 100 if trades else np.nan,
+        "max_dd": max_drawdown,
+        "sharpe_ratio": avg_returns / returns_dev * np.sqrt(365),
+        "sortino_ratio": avg_returns / neg_dev * np.sqrt(365),
+        "num_of_trades": trades,
+    }
+
+
+def run_grid(config: EasyDict) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+    """Compute the entries once and evaluate the grid from config.backtester.grid
+
+    Args:
+        config (EasyDict): Configuration for the backtesting
+
+    Returns:
+        Tuple (pd.DataFrame, List[pd.DataFrame]): Metrics and equity curves of every parameter set
+    """
+    settings = EngineConfig.from_config(config)
+    high_csv, low_csv = load_high_low(config)
+    entry_time = settings.entry_date
+    exit_time = settings.exit_date
+    low_csv = low_csv[(low_csv["datetime"].apply(handle_date_time) >= entry_time) & (low_csv["datetime"].apply(handle_date_time) <= exit_time)]
+    low_csv = low_csv.reset_index(drop=True)
+
+    GLOB = settings.state(high_csv.loc[0, "datetime"])
+    strat = get_strategy(config.backtester.strategy)(high_csv, low_csv, config, GLOB)
+    entries = compute_entries(
+        strat,
+        high_csv,
+        low_csv,
+        low_time=settings.low_time,
+        high_time=settings.high_time,
+        entry_date=entry_time,
+        exit_date=exit_time,
+    )
+    grid = param_grid(**config.backtester.grid)
+    return evaluate_grid(
+        entries,
+        grid,
+        margin=settings.margin,
+        slippage=settings.slippage,
+        capital=settings.capital,
+        fills=settings.fills,
+        tie_break=settings.tie_break,
+    )
+
+
+if __name__ == "__main__":
+    metrics, _ = run_grid(get_cfg())
+    pprint(metrics)
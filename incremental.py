@@ -0,0 +1,87 @@
+import os
+import pickle
+import yaml
+import pandas as pd
+from pathlib import Path
+from easydict import EasyDict
+from strategy import BaseStrategy
+from engine import config_digest
+
+STATE_VERSION = 2  # Bumped when the saved state changes, older files are ignored
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return {name: _plain(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _run_key(config: EasyDict, moving_end: bool = True) -> str:
+    """Everything in the config that a saved run depends on, the end date may move forward if moving_end"""
+    key = _plain(config)
+    key["state_version"] = STATE_VERSION
+    if moving_end:
+        key["data"].pop("end_date", None)
+    return yaml.safe_dump(key, sort_keys=True)
+
+
+def checkpoint_path(directory: str, config: EasyDict) -> Path:
+    """Checkpoint file of a run, named after its config so concurrent runs do not share one"""
+    return Path(directory) / f"{config_digest(config)[:16]}.pkl"
+
+
+def save_state(
+    file_path: str,
+    state: EasyDict,
+    strategy: BaseStrategy,
+    trade_sheet: pd.DataFrame,
+    signal_csv: pd.DataFrame,
+    config: EasyDict,
+    moving_end: bool = True,
+):
+    """Save a state of generate_signals so the next run only processes the bars after it
+
+    Args:
+        file_path (str): Path to the state file
+        state (EasyDict): State returned by generate_signals
+        strategy (BaseStrategy): Strategy used for the run, its indicator columns are saved
+        trade_sheet (pd.DataFrame): Trade Book of the run
+        signal_csv (pd.DataFrame): Signal file of the run
+        config (EasyDict): Configuration of the run
+        moving_end (bool, optional): Whether the state may be resumed with a later end date. Defaults to True.
+    """
+    state = EasyDict(state)
+    # Rows logged by the final square off are dropped, the position is still open
+    state.trade_sheet = trade_sheet.iloc[: state.trade_rows].copy()
+    state.signal_csv = signal_csv.iloc[: state.signal_rows].copy()
+    state.indicators = strategy.high_csv[strategy.indicator_columns].copy()
+    state.key = _run_key(config, moving_end)
+    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, a run killed while saving keeps the previous state
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, "wb") as stream:
+        pickle.dump(state, stream, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, file_path)
+
+
+def load_state(file_path: str, config: EasyDict, moving_end: bool = True) -> EasyDict | None:
+    """Load a state saved by save_state
+
+    Args:
+        file_path (str): Path to the state file
+        config (EasyDict): Configuration of the new run
+        moving_end (bool, optional): Whether the state may be resumed with a later end date. Defaults to True.
+
+    Returns:
+        EasyDict | None: The saved state, None if there is none or it was saved with another config
+    """
+    if not Path(file_path).exists():
+        return None
+    with open(file_path, "rb") as stream:
+        state = pickle.load(stream)
+    if state.key != _run_key(config, moving_end):
+        print(f"Config changed since {file_path} was saved, running from the start")
+        return None
+    return state
@@ -0,0 +1,132 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from indicators import _key
+
+POOLS = ("thread", "process")
+
+
+@dataclass(frozen=True, slots=True)
+class Node:
+    """Indicator of a strategy, computed from columns of the data or from other nodes
+
+    func is called with the arrays of the inputs in order and the params as keywords and
+    returns one value per row. An incremental func also takes start and returns the rows from
+    start on, the rows before are read from the column of the same name.
+    """
+
+    name: str  # Column of high_csv the output is written to
+    func: Callable[..., np.ndarray]
+    inputs: Tuple[str, ...] = ("close",)  # Names of other nodes, or else columns of the data
+    params: dict = field(default_factory=dict)
+    incremental: bool = False
+
+
+def _compute(func: Callable, arrays: List[np.ndarray], params: dict, start: int, previous: np.ndarray) -> np.ndarray:
+    """Output of a node, run in the pool"""
+    if previous is None:
+        return func(*arrays, **params)
+    values = np.empty(len(arrays[0]))
+    values[:start] = previous
+    values[start:] = func(*arrays, start=start, **params)
+    return values
+
+
+def _order(nodes: List[Node]) -> List[Node]:
+    """Nodes merged by name and sorted so that every node comes after the nodes it reads"""
+    by_name = {}
+    for node in nodes:
+        known = by_name.setdefault(node.name, node)
+        if known is not node and (_definition(known), known.inputs) != (_definition(node), node.inputs):
+            raise ValueError(f"Two different indicators are named {node.name}")
+    order, state = [], {}
+    for name in by_name:
+        stack = [(name, False)]
+        while stack:
+            name, done = stack.pop()
+            if done:
+                state[name] = "done"
+                order.append(by_name[name])
+            elif state.get(name) != "done":
+                if state.get(name) == "visiting":
+                    raise ValueError(f"Indicator {name} depends on itself")
+                state[name] = "visiting"
+                stack.append((name, True))
+                stack += [(parent, False) for parent in by_name[name].inputs if parent in by_name and state.get(parent) != "done"]
+    return order
+
+
+def _definition(node: Node) -> tuple:
+    """What a node computes, its inputs aside"""
+    return node.func.__module__, node.func.__qualname__, pickle.dumps(sorted(node.params.items())), node.incremental
+
+
+def evaluate(nodes: List[Node], frame: pd.DataFrame, start: int = 0, workers: int = 1, pool: str = "thread") -> Dict[str, np.ndarray]:
+    """Compute the nodes of one or several strategies, the independent ones at once
+
+    Nodes are identified by their function, their parameters and the data they read, so the
+    same indicator declared under several names or by several strategies is computed once, and
+    the batch functions of indicators are memoised across calls.
+
+    Args:
+        nodes (List[Node]): Nodes to compute
+        frame (pd.DataFrame): Data, usually high_csv
+        start (int, optional): First new row, the incremental nodes keep the rows before. Defaults to 0.
+        workers (int, optional): Nodes computed at once, 0 for one per core. Defaults to 1.
+        pool (str, optional): One of POOLS, NumPy and SciPy release the GIL in their kernels. Defaults to "thread".
+
+    Returns:
+        Dict[str, np.ndarray]: Output of every node by name
+    """
+    if pool not in POOLS:
+        raise ValueError(f"pool should be one of {POOLS}, got {pool}")
+    order = _order(nodes)
+    names = {node.name for node in order}
+    keys, columns = {}, {}
+    for node in order:
+        for name in node.inputs:
+            if name not in names and name not in columns:
+                if name not in frame.columns:
+                    raise ValueError(f"Indicator {node.name} reads {name}, which is neither a node nor a column")
+                columns[name] = frame[name].to_numpy(dtype=np.float64)
+        parents = [keys[name] if name in names else _key(columns[name]) for name in node.inputs]
+        keys[node.name] = hashlib.sha1(pickle.dumps((_definition(node), parents, start if node.incremental else 0))).hexdigest()
+
+    unique = {}
+    for node in order:
+        unique.setdefault(keys[node.name], node)
+    outputs = {}
+
+    def arguments(node: Node) -> tuple:
+        arrays = [outputs[keys[name]] if name in names else columns[name] for name in node.inputs]
+        previous = None
+        if node.incremental:
+            if start and node.name not in frame.columns:
+                raise ValueError(f"Indicator {node.name} starts at row {start} without the rows before")
+            previous = frame[node.name].to_numpy(dtype=np.float64)[:start] if start else np.empty(0)
+        return node.func, arrays, node.params, start, previous
+
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(unique) == 1:
+        for key, node in unique.items():
+            outputs[key] = _compute(*arguments(node))
+        return {name: outputs[keys[name]] for name in names}
+
+    Executor = ThreadPoolExecutor if pool == "thread" else ProcessPoolExecutor
+    waiting = dict(unique)
+    running = {}
+    with Executor(max_workers=min(workers, len(unique))) as executor:
+        while waiting or running:
+            for key, node in list(waiting.items()):
+                if all(name not in names or keys[name] in outputs for name in node.inputs):
+                    running[executor.submit(_compute, *arguments(node))] = key
+                    del waiting[key]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                outputs[running.pop(future)] = future.result()
+    return {name: outputs[keys[name]] for name in names}
@@ -0,0 +1,289 @@
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from collections import deque
+from functools import wraps
+from typing import Tuple
+from scipy.signal import butter, cheby1, lfilter, lfilter_zi, sosfilt, sosfilt_zi
+
+SERIES = {}  # Memoised indicator series of this process, keyed by the indicator, its arguments and its input data
+MAX_SERIES = 256  # Oldest series are dropped beyond this
+_SERIES_LOCK = threading.Lock()  # The indicator graph computes series on several threads
+
+
+def _key(value):
+    if isinstance(value, (np.ndarray, pd.Series)):
+        data = np.ascontiguousarray(np.asarray(value, dtype=np.float64))
+        return hashlib.sha1(data.view(np.uint8)).hexdigest()
+    return value
+
+
+def memoised(function):
+    """Compute a batch indicator once per input data and arguments, the result is read only"""
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        key = (function.__name__, *map(_key, args), *sorted((name, _key(value)) for name, value in kwargs.items()))
+        result = SERIES.get(key)
+        if result is None:
+            result = function(*args, **kwargs)
+            for array in result if isinstance(result, tuple) else (result,):
+                array.flags.writeable = False
+            with _SERIES_LOCK:
+                while len(SERIES) >= MAX_SERIES:
+                    del SERIES[next(iter(SERIES))]
+                SERIES[key] = result
+        return result
+
+    return wrapper
+
+
+def _floats(values) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+
+def butterworth_coefficients(order: int, cutoff_frequency: float, output: str = "ba"):
+    """Low pass Butterworth filter as (b, a), or as second-order sections with output sos"""
+    return butter(N=order, Wn=cutoff_frequency, btype="low", analog=False, output=output)
+
+
+def chebyshev_coefficients(order: int, ripple_factor: float, cutoff_frequency: float, output: str = "ba"):
+    """Low pass Chebyshev type I filter as (b, a), or as second-order sections with output sos"""
+    return cheby1(N=order, rp=ripple_factor, Wn=cutoff_frequency, btype="low", analog=False, output=output)
+
+
+# Batch forms, vectorised over the whole series
+
+
+@memoised
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    """Exponential moving average, seeded with the first value"""
+    return pd.Series(_floats(values)).ewm(span=span, adjust=False).mean().to_numpy()
+
+
+@memoised
+def sma(values: np.ndarray, window: int) -> np.ndarray:
+    """Simple moving average, NaN until the window is full"""
+    return pd.Series(_floats(values)).rolling(window).mean().to_numpy()
+
+
+@memoised
+def rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Relative strength index with Wilder's smoothing, NaN on the first bar"""
+    delta = np.diff(_floats(close))
+    gain = pd.Series(np.maximum(delta, 0)).ewm(alpha=1 / period, adjust=False).mean().to_numpy()
+    loss = pd.Series(np.maximum(-delta, 0)).ewm(alpha=1 / period, adjust=False).mean().to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+    return np.concatenate(([np.nan], values))
+
+
+@memoised
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Average true range with Wilder's smoothing"""
+    high, low, close = _floats(high), _floats(low), _floats(close)
+    previous_close = np.concatenate(([np.nan], close[:-1]))
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+    return pd.Series(true_range).ewm(alpha=1 / period, adjust=False).mean().to_numpy()
+
+
+@memoised
+def bollinger(close: np.ndarray, window: int = 20, k: float = 2) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Middle, upper and lower Bollinger bands with the population standard deviation"""
+    rolling = pd.Series(_floats(close)).rolling(window)
+    middle = rolling.mean().to_numpy()
+    deviation = rolling.std(ddof=0).to_numpy()
+    return middle, middle + k * deviation, middle - k * deviation
+
+
+@memoised
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    return pd.Series(_floats(values)).rolling(window).max().to_numpy()
+
+
+@memoised
+def rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+    return pd.Series(_floats(values)).rolling(window).min().to_numpy()
+
+
+@memoised
+def iir(values: np.ndarray, b: np.ndarray, a: np.ndarray) -> np.ndarray:
+    """Causal IIR filter started at rest on the first value"""
+    values = _floats(values)
+    filtered, _ = lfilter(b, a, values, zi=lfilter_zi(b, a) * values[0])
+    return filtered
+
+
+@memoised
+def sos(values: np.ndarray, sections: np.ndarray) -> np.ndarray:
+    """Causal filter in second-order sections started at rest on the first value, stable for high orders"""
+    values = _floats(values)
+    filtered, _ = sosfilt(sections, values, zi=sosfilt_zi(sections) * values[0])
+    return filtered
+
+
+@memoised
+def trailing_filtfilt(values: np.ndarray, b: np.ndarray, a: np.ndarray, start: int = 0) -> np.ndarray:
+    """Last value of the zero-phase filter over every prefix, the view a bar had of the filter
+
+    filtfilt with padlen=0 runs the backward pass from rest on the last forward output, so its
+    last value is that output times the DC gain b.sum() / a.sum(): the forward filter scaled,
+    up to rounding. The values from start on are returned.
+    """
+    return (np.sum(b) / np.sum(a) * iir(values, b, a))[start:]
+
+
+# Incremental forms, O(1) per update and equal to the batch forms up to rounding
+
+
+class EMA:
+    def __init__(self, span: int):
+        self.alpha = 2 / (span + 1)
+        self.value = np.nan
+
+    def update(self, value: float) -> float:
+        self.value = value if np.isnan(self.value) else (1 - self.alpha) * self.value + self.alpha * value
+        return self.value
+
+
+class SMA:
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+
+    def update(self, value: float) -> float:
+        self.values.append(value)
+        self.total += value
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+        return self.total / self.window if len(self.values) == self.window else np.nan
+
+
+class RSI:
+    def __init__(self, period: int = 14):
+        self.gain = EMA(2 * period - 1)  # alpha = 1 / period
+        self.loss = EMA(2 * period - 1)
+        self.previous = None
+
+    def update(self, close: float) -> float:
+        if self.previous is None:
+            self.previous = close
+            return np.nan
+        delta, self.previous = close - self.previous, close
+        gain = self.gain.update(max(delta, 0.0))
+        loss = self.loss.update(max(-delta, 0.0))
+        return 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+
+class ATR:
+    def __init__(self, period: int = 14):
+        self.average = EMA(2 * period - 1)  # alpha = 1 / period
+        self.previous = None
+
+    def update(self, high: float, low: float, close: float) -> float:
+        true_range = high - low
+        if self.previous is not None:
+            true_range = max(true_range, abs(high - self.previous), abs(low - self.previous))
+        self.previous = close
+        return self.average.update(true_range)
+
+
+class Bollinger:
+    """Sliding Welford mean and variance, stable where a running sum of squares cancels"""
+
+    def __init__(self, window: int = 20, k: float = 2):
+        self.window = window
+        self.k = k
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, close: float) -> Tuple[float, float, float]:
+        self.values.append(close)
+        delta = close - self.mean
+        self.mean += delta / len(self.values)
+        self.m2 += delta * (close - self.mean)
+        if len(self.values) > self.window:
+            dropped = self.values.popleft()
+            delta = dropped - self.mean
+            self.mean -= delta / len(self.values)
+            self.m2 -= delta * (dropped - self.mean)
+        if len(self.values) < self.window:
+            return np.nan, np.nan, np.nan
+        deviation = np.sqrt(max(self.m2 / self.window, 0.0))
+        return self.mean, self.mean + self.k * deviation, self.mean - self.k * deviation
+
+
+class RollingMax:
+    """Monotonic queue of the candidates, amortised O(1)"""
+
+    sign = 1
+
+    def __init__(self, window: int):
+        self.window = window
+        self.candidates = deque()  # (index, value), values decreasing for the max
+        self.count = 0
+
+    def update(self, value: float) -> float:
+        while self.candidates and self.sign * self.candidates[-1][1] <= self.sign * value:
+            self.candidates.pop()
+        self.candidates.append((self.count, value))
+        if self.candidates[0][0] <= self.count - self.window:
+            self.candidates.popleft()
+        self.count += 1
+        return self.candidates[0][1] if self.count >= self.window else np.nan
+
+
+class RollingMin(RollingMax):
+    sign = -1
+
+
+class IIR:
+    """Causal IIR filter in transposed direct form II, started at rest on the first value"""
+
+    def __init__(self, b: np.ndarray, a: np.ndarray):
+        self.b = np.asarray(b, dtype=np.float64) / a[0]
+        self.a = np.asarray(a, dtype=np.float64) / a[0]
+        self.zi = lfilter_zi(b, a)
+        self.state = None
+
+    def update(self, value: float) -> float:
+        if self.state is None:
+            self.state = self.zi * value
+        output = self.b[0] * value + self.state[0]
+        # Shift the delay line, each tap adds the new input and output
+        self.state[:-1] = self.state[1:] + self.b[1:-1] * value - self.a[1:-1] * output
+        self.state[-1] = self.b[-1] * value - self.a[-1] * output
+        return output
+
+
+class TrailingFiltfilt(IIR):
+    """Last value of the zero-phase filter over the values so far, the forward filter times its DC gain"""
+
+    def __init__(self, b: np.ndarray, a: np.ndarray):
+        super().__init__(b, a)
+        self.gain = np.sum(b) / np.sum(a)
+
+    def update(self, value: float) -> float:
+        return self.gain * super().update(value)
+
+
+class SOS:
+    """Causal filter in second-order sections, the state of every section is carried between bars"""
+
+    def __init__(self, sections: np.ndarray):
+        self.sections = np.asarray(sections, dtype=np.float64)
+        self.zi = sosfilt_zi(self.sections)
+        self.state = None
+
+    def update(self, value: float) -> float:
+        if self.state is None:
+            self.state = self.zi * value
+        for (b0, b1, b2, _, a1, a2), state in zip(self.sections, self.state):
+            output = b0 * value + state[0]
+            state[0] = b1 * value - a1 * output + state[1]
+            state[1] = b2 * value - a2 * output
+            value = output
+        return value
@@ -1,15 +1,30 @@
+import copy
 import pandas as pd
-from utils import load_high_low, get_cfg, convert_to_open_timings, to_minutes, handle_date_time
+from utils import load_high_low, get_cfg, coarse_levels, convert_to_open_timings, to_minutes, handle_date_time, format_date_time
 from easydict import EasyDict
+from range_index import range_index
 from backtesting_ps_code import generate_signals, check_signal_file
-from strategy import EMAStrategy, ButterChebyStrategy
-from metrics import compute_metrics
+from positions import generate_positions
+from strategy import get_strategy
+from metrics import compute_metrics, MetricsAccumulator
+from equity import equity_from_trade_sheet, equity_metrics, save_equity
+from plots import render_equity_and_drawdown
+from incremental import load_state, save_state, checkpoint_path
+from data_quality import check_quality, open_time_table
+from timeframes import aligned_views
+from engine import EngineConfig
 from datetime import datetime
 from pprint import pprint
 
 
 
-def main():
+def main(accumulator: MetricsAccumulator = None):
+    """Backtest of config.yaml, writes the trade sheet and the signal file
+
+    Returns the signal file and, with mark_to_market, the equity on every low timeframe bar. With
+    positions.max_open above 1 the run is on the position book, it writes the trade book and
+    returns None for both, its metrics are those of the accumulator.
+    """
     trade_sheet = pd.DataFrame(
         columns=[
             "date_time",
@@ -26,71 +41,145 @@ def main():
         columns=["datetime", "open", "high", "low", "close", "volume", "signals","signal_type"],
     )
 
-    high_csv, low_csv = load_high_low(get_cfg())
+    config = get_cfg()
+    # Scalars of the engine, resolved and validated once
+    settings = EngineConfig.from_config(config)
+    if config.data.quality.report:
+        check_quality(config)
+    high_csv, low_csv = load_high_low(config, signal_file=True)
 
-    entry_time = handle_date_time(get_cfg().data.start_date)
-    exit_time = handle_date_time(get_cfg().data.end_date)
+    entry_time = settings.entry_date
+    exit_time = settings.exit_date
 
     # Write to make low_csv "datetime" lie between entry_time and exit_time using handle_date_time
     low_csv = low_csv[(low_csv["datetime"].apply(handle_date_time) >= entry_time) & (low_csv["datetime"].apply(handle_date_time) <= exit_time)]
     low_csv = low_csv.reset_index(drop=True)
+    open_times = open_time_table(high_csv, low_csv, settings.low_time, settings.high_time)
+
+    # Intialzing the state at the start date of the backtesting, with no position
+    GLOB = settings.state(high_csv.loc[0, "datetime"])
 
+    incremental = config.backtester.get("incremental", {})
+    trees = config.backtester.get("range_index", {})
+    checkpointing = config.backtester.get("checkpoint", {})
+    resume = None
+    if checkpointing.get("enabled", False):
+        # An interrupted run with the same config continues from its last checkpoint
+        checkpoint_file = checkpoint_path(checkpointing.dir, config)
+        resume = load_state(checkpoint_file, config, moving_end=False)
+        if resume is not None:
+            print(f"Resuming from the checkpoint at {high_csv['datetime'].iloc[resume.index]}")
+    if resume is None and incremental.get("enabled", False):
+        resume = load_state(incremental.state, config)
+    if resume is not None:
+        # Continue the saved run, only the bars after its state are processed
+        GLOB = copy.copy(resume.glob)
+        trade_sheet, signal_csv = resume.trade_sheet, resume.signal_csv
+        if accumulator is not None and resume.metrics is not None:
+            accumulator.__dict__.update(resume.metrics.__dict__)
 
-    GLOB = EasyDict(
-        tp=get_cfg().backtester.tp,  # Target Price Percentage
-        sl=get_cfg().backtester.sl,  # Stop Loss Percentage
-        entry_price=1,
-        trailing_price=0,  # Trailing Price of the current position of the trade (used for the calculation of trailing stop loss)
-        date_time=high_csv.loc[
-            0, "datetime"
-        ],  # Intialzing the start date of the backtesting
-        status=0,  # Initialing the status as 0 (no position currently)
-        total_fee=0,
-        trades=0,
+    Strategy = get_strategy(config.backtester.strategy)
+    strat = Strategy(
+        high_csv,
+        low_csv,
+        config,
+        GLOB,
+        resume.indicators if resume else None,
+        aligned_views(config, Strategy.timeframes, high_csv),
     )
+    checkpoint = None
+    if checkpointing.get("enabled", False):
+        checkpoint = lambda state: save_state(
+            checkpoint_file, state, strat, trade_sheet, signal_csv, config, moving_end=False
+        )
 
-    strat = ButterChebyStrategy(high_csv, low_csv, get_cfg(), GLOB)
+    early_stop = config.backtester.early_stop if config.backtester.early_stop.enabled else None
+    if settings.max_open > 1:
+        # Pyramiding runs on the position book, which logs a trade book instead of the signal file
+        if incremental.get("enabled", False):
+            raise ValueError("backtester.incremental is not supported with positions.max_open above 1")
+        state = generate_positions(
+            strat,
+            GLOB,
+            high_csv,
+            low_csv,
+            **settings.engine_kwargs(),
+            **settings.position_kwargs(),
+            metrics=accumulator,
+            open_times=open_times,
+            early_stop=early_stop,
+        )
+        state.trade_book["date_time"] = state.trade_book["date_time"].map(format_date_time)
+        state.trade_book.to_csv(config.backtester.positions.get("trade_book", "trade_book.csv"), index=False)
+        return None, None
 
-    generate_signals(
+    state = generate_signals(
         strat,
         GLOB,
         high_csv,
         low_csv,
         trade_sheet,
         signal_csv,
-        low_time = to_minutes(get_cfg().backtester.low_time),
-        high_time = to_minutes(get_cfg().backtester.high_time),
-        margin=get_cfg().backtester.margin,
-        leverage=get_cfg().backtester.leverage,
-        trailing=get_cfg().backtester.trailing,
-        slippage=get_cfg().backtester.slippage,
-        capital=get_cfg().backtester.capital,
-        entry_date=entry_time,
-        exit_date=exit_time,
+        **settings.engine_kwargs(),
+        metrics=accumulator,
+        resume=resume,
+        open_times=open_times,
+        coarse=coarse_levels(low_csv, high_csv, settings.coarse_block) if settings.coarse_block else None,
+        range_index=range_index(low_csv, high_csv, trees.get("dir")) if trees.get("enabled", False) else None,
+        event_driven=config.backtester.get("event_driven", False),
+        early_stop=early_stop,
+        checkpoint=checkpoint,
+        checkpoint_every=checkpointing.get("every", 100),
     )
+    if incremental.get("enabled", False):
+        save_state(incremental.state, state, strat, trade_sheet, signal_csv, config)
+    if checkpointing.get("enabled", False):
+        checkpoint_file.unlink(missing_ok=True)
 
+    trade_sheet["date_time"] = trade_sheet["date_time"].map(format_date_time)
+    signal_csv["datetime"] = signal_csv["datetime"].map(format_date_time)
     trade_sheet.to_csv("trade_sheet.csv", index=False)
     signal_csv = signal_csv.drop(columns=["signal_type"])
     signal_csv.to_csv("signal_csv.csv", index=False)
-    return signal_csv
+    equity = None
+    if config.backtester.mark_to_market:
+        equity = equity_from_trade_sheet(
+            trade_sheet, low_csv, settings.leverage, settings.slippage, settings.capital
+        )
+        if config.backtester.get("equity_path"):
+            save_equity(config.backtester.equity_path, equity)
+    return signal_csv, equity
 
 
-def metrics(signal_csv: pd.DataFrame):
-    pprint(
-        compute_metrics(
-            signal_csv,
-            get_cfg().backtester.plots.show,
-            get_cfg().backtester.leverage,
-            get_cfg().backtester.slippage,
-            get_cfg().backtester.capital,
-        )
+def metrics(signal_csv: pd.DataFrame, equity: pd.DataFrame = None):
+    mark_to_market = equity is not None
+    save_path = get_cfg().backtester.plots.path if get_cfg().backtester.plots.save else None
+    metrics_df = compute_metrics(
+        signal_csv,
+        get_cfg().backtester.plots.show,
+        get_cfg().backtester.leverage,
+        get_cfg().backtester.slippage,
+        get_cfg().backtester.capital,
+        None if mark_to_market else save_path,
     )
+    if mark_to_market:
+        # Drawdown and ratios from the equity on every low timeframe bar
+        bars_per_year = 365 * 24 * 60 / to_minutes(get_cfg().backtester.low_time)
+        for key, value in equity_metrics(equity, bars_per_year).items():
+            metrics_df[key] = value
+        if save_path:
+            render_equity_and_drawdown(equity, save_path)
+    pprint(metrics_df)
     check_signal_file(signal_csv, get_cfg())
 
 
 if __name__ == "__main__":
-    signal_csv = main()
+    accumulator = MetricsAccumulator(get_cfg().backtester.capital)
+    signal_csv, equity = main(accumulator)
     
     # signal_csv = pd.read_csv("signal_csv.csv")
     if get_cfg().backtester.print_metrics:
-        metrics(signal_csv)
+        if get_cfg().backtester.streaming_metrics or signal_csv is None:
+            pprint(accumulator.result())
+        else:
+            metrics(signal_csv, equity)
@@ -1,13 +1,16 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import handle_date_time
+from easydict import EasyDict
+from utils import handle_date_time, to_timestamps
+from plots import render_equity_and_drawdown
 
 def plot_equity_and_drawdown_filled(df):
     """
     Function to plot the equity curve and drawdown plot with filled regions.
     :param df: DataFrame containing the 'datetime', 'capital', and 'drawdown_percentage' columns.
     """
+    import matplotlib.pyplot as plt
+
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8), sharex=True)
 
     # Plotting the equity curve on the first subplot
@@ -69,7 +72,155 @@ def calculate_average_holding_duration(df: pd.DataFrame, date_column: str) -> pd
     return average_holding_duration, max_holding_duration
 
 
-def compute_metrics(signals: pd.DataFrame, plot: bool = False, leverage: int = 1, slippage: float = 0.0015, capital: float = 1000):
+class MetricsAccumulator:
+    """Online metrics updated by generate_signals as the trades occur.
+
+    Tracks the running capital, high-water mark and max drawdown, the Welford mean and
+    variance of the trade returns and the win / loss counts and extremes, so the metrics
+    are available at any time during the run without a pass over the signal file.
+    """
+
+    def __init__(self, capital: float = 1000):
+        self.initial_capital = capital
+        self.capital = capital
+        self.high_water_mark = capital
+        self.max_dd = 0.0
+        self.min_portfolio_balance = capital
+        self.max_portfolio_balance = capital
+        self.total_fee = 0.0
+        self.trades = 0
+        self.total_long_trades = 0
+        self.total_short_trades = 0
+        self.wins = 0
+        self.losses = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.winning_pnl = 0.0
+        self.losing_pnl = 0.0
+        self.largest_winning_trade = np.nan
+        self.largest_losing_trade = np.nan
+        # Welford accumulators of the non zero returns and of the negative returns
+        self.n_returns, self.mean_returns, self.m2_returns = 0, 0.0, 0.0
+        self.n_neg_returns, self.mean_neg_returns, self.m2_neg_returns = 0, 0.0, 0.0
+        self.entry_time = None
+        self.holding_duration = pd.Timedelta(0)
+        self.maximum_holding_duration = pd.Timedelta(0)
+
+    def on_entry(self, status: int, date_time=None):
+        """Register a new position
+
+        Args:
+            status (int): 1 for long and -1 for short
+            date_time (optional): Time of the entry. Defaults to None.
+        """
+        if status == 1:
+            self.total_long_trades += 1
+        elif status == -1:
+            self.total_short_trades += 1
+        self.entry_time = date_time
+
+    def on_close(self, capital: float, pnl: float, returns: float, fee: float, date_time=None, entry_time=None):
+        """Register the close of the current position
+
+        Args:
+            capital (float): Capital after the close
+            pnl (float): Profit/Loss of the trade
+            returns (float): Profit/Loss percentage of the trade
+            fee (float): Fee charged for the trade
+            date_time (optional): Time of the close. Defaults to None.
+            entry_time (optional): Time of the entry, when several positions are open. Defaults to the last entry.
+        """
+        if entry_time is not None:
+            self.entry_time = entry_time
+        change = capital - self.capital
+        self.capital = capital
+        self.total_fee += fee
+        self.trades += 1
+        if pnl > 0:
+            self.wins += 1
+            self.gross_profit += change
+            self.winning_pnl += pnl
+            self.largest_winning_trade = np.fmax(self.largest_winning_trade, pnl)
+        elif pnl < 0:
+            self.losses += 1
+            self.gross_loss += change
+            self.losing_pnl += pnl
+            self.largest_losing_trade = np.fmin(self.largest_losing_trade, pnl)
+
+        self.high_water_mark = max(self.high_water_mark, capital)
+        self.max_dd = min(self.max_dd, (capital - self.high_water_mark) / self.high_water_mark * 100)
+        self.min_portfolio_balance = min(self.min_portfolio_balance, capital)
+        self.max_portfolio_balance = max(self.max_portfolio_balance, capital)
+
+        if returns != 0:
+            self.n_returns += 1
+            delta = returns - self.mean_returns
+            self.mean_returns += delta / self.n_returns
+            self.m2_returns += delta * (returns - self.mean_returns)
+        if returns < 0:
+            self.n_neg_returns += 1
+            delta = returns - self.mean_neg_returns
+            self.mean_neg_returns += delta / self.n_neg_returns
+            self.m2_neg_returns += delta * (returns - self.mean_neg_returns)
+
+        if self.entry_time is not None and date_time is not None:
+            duration = pd.Timestamp(handle_date_time(date_time)) - pd.Timestamp(handle_date_time(self.entry_time))
+            self.holding_duration += duration
+            self.maximum_holding_duration = max(self.maximum_holding_duration, duration)
+        self.entry_time = None
+
+    def result(self) -> pd.Series:
+        """Metrics of the trades registered so far
+
+        Returns:
+            pd.Series: Metrics with the keys of compute_metrics that can be computed online
+        """
+        returns_dev = np.sqrt(self.m2_returns / (self.n_returns - 1)) if self.n_returns > 1 else np.nan
+        neg_returns = np.sqrt(self.m2_neg_returns / (self.n_neg_returns - 1)) if self.n_neg_returns > 1 else np.nan
+        avg_returns = self.mean_returns if self.n_returns else np.nan
+        metrics_dict = {
+            'final_balance': self.capital, 'gross_profit': self.gross_profit, 'gross_loss': self.gross_loss,
+            'net_profit': self.capital - self.initial_capital, 'total_long_trades': self.total_long_trades,
+            'total_short_trades': self.total_short_trades,
+            'win_rate': self.wins / self.trades * 100 if self.trades else np.nan,
+            'loss_rate': self.losses / self.trades * 100 if self.trades else np.nan,
+            'avg_winning_trade': self.winning_pnl / self.wins if self.wins else np.nan,
+            'avg_losing_trade': self.losing_pnl / self.losses if self.losses else np.nan,
+            'largest_losing_trade': self.largest_losing_trade, 'largest_winning_trade': self.largest_winning_trade,
+            'max_dd': self.max_dd, 'sharpe_ratio': (avg_returns / returns_dev) * np.sqrt(365),
+            'sortino_ratio': (avg_returns / neg_returns) * np.sqrt(365),
+            'average_holding_duration': self.holding_duration / self.trades if self.trades else pd.NaT,
+            'maximum_holding_duration': self.maximum_holding_duration,
+            'min_portfolio_balance': self.min_portfolio_balance, 'max_portfolio_balance': self.max_portfolio_balance,
+            'num_of_trades': self.trades, 'total_fee': self.total_fee,
+        }
+        return pd.Series(metrics_dict)
+
+
+def early_stop_reason(metrics: MetricsAccumulator, rules: EasyDict, past_checkpoint: bool = False) -> str | None:
+    """Check the early-termination rules of a run against its online metrics
+
+    The drawdown and the capital are those of the closed trades, an open position is not marked,
+    so a run under water inside a trade is only stopped once the trade is closed.
+
+    Args:
+        metrics (MetricsAccumulator): Metrics of the run so far
+        rules (EasyDict): max_drawdown (percent), min_capital and min_trades (by the checkpoint date), each optional
+        past_checkpoint (bool, optional): The run has reached the checkpoint date. Defaults to False.
+
+    Returns:
+        str | None: The rule that was broken, None to continue
+    """
+    if rules.get("max_drawdown") is not None and metrics.max_dd <= -abs(rules.max_drawdown):
+        return "max_drawdown"
+    if rules.get("min_capital") is not None and metrics.capital < rules.min_capital:
+        return "min_capital"
+    if past_checkpoint and rules.get("min_trades") is not None and metrics.trades < rules.min_trades:
+        return "min_trades"
+    return None
+
+
+def compute_metrics(signals: pd.DataFrame, plot: bool = False, leverage: int = 1, slippage: float = 0.0015, capital: float = 1000, save_path: str = None):
     signals['returns'] = 0.0
     signals['pnl'] = np.nan
     total_fee = 0
@@ -199,5 +350,169 @@ def compute_metrics(signals: pd.DataFrame, plot: bool = False, leverage: int = 1
     metrics_df = pd.Series(metrics_dict)
     if plot:
         plot_equity_and_drawdown_filled(signals)
+    if save_path:
+        render_equity_and_drawdown(signals, save_path)
     return metrics_df
-       
\ No newline at end of file
+       
+
+# Status after a row of the signal file as replayed by compute_metrics, by signal + 2 and status + 1.
+# A reversal signal (2 or -2) received while flat, or in the position it reverses to, only squares off
+TRANSITIONS = np.array([
+    [-1, 0, -1],  # -2
+    [-1, -1, 0],  # -1
+    [-1, 0, 1],  # 0
+    [0, 1, 1],  # 1
+    [1, 0, 1],  # 2
+])
+
+
+def _padded(values, dtype, fill) -> np.ndarray:
+    """Ragged runs as one array of shape (runs, longest run), padded with fill"""
+    if isinstance(values, np.ndarray) and values.ndim == 2:
+        return values.astype(dtype, copy=False)
+    runs = [np.asarray(run, dtype=dtype) for run in values]
+    padded = np.full((len(runs), max(map(len, runs), default=0)), fill, dtype=dtype)
+    for row, run in enumerate(runs):
+        padded[row, : len(run)] = run
+    return padded
+
+
+def _timestamps(date_times) -> np.ndarray:
+    """int64 nanoseconds of datetimes given as datetime64, int64 timestamps or strings"""
+    if isinstance(date_times, np.ndarray) and date_times.ndim == 2 and date_times.dtype.kind in "iM":
+        return date_times.astype("datetime64[ns]").view(np.int64) if date_times.dtype.kind == "M" else date_times.astype(np.int64)
+    return _padded([to_timestamps(pd.Series(np.asarray(run))) for run in date_times], np.int64, 0)
+
+
+def _masked_std(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Sample standard deviation of the masked values of every row, NaN below two values"""
+    count = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(mask, values, 0).sum(axis=1) / count
+        squares = np.where(mask, (values - mean[:, None]) ** 2, 0).sum(axis=1)
+        return np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+
+
+def batch_metrics(
+    signals,
+    closes,
+    date_times=None,
+    lengths: np.ndarray = None,
+    leverage=1,
+    slippage=0.0015,
+    capital=1000,
+) -> pd.DataFrame:
+    """The metrics of compute_metrics for many signal files at once
+
+    The runs are the rows of 2-D arrays, padded after lengths[r] rows, or lists of 1-D arrays.
+    The statuses are composed from TRANSITIONS with a prefix scan and the capital is the product
+    of the growth of every close, so there is no loop over the rows. The capital differs from
+    the one compute_metrics accumulates by rounding only.
+
+    Args:
+        signals: Signals of the signal files
+        closes: Close prices of the signal files
+        date_times (optional): Datetimes of the signal files, for the holding durations. Defaults to None, NaT durations.
+        lengths (np.ndarray, optional): Rows of every padded run. Defaults to None, every row.
+        leverage (optional): Leverage, one for all runs or one per run. Defaults to 1.
+        slippage (optional): Slippage, one for all runs or one per run. Defaults to 0.0015.
+        capital (optional): Initial capital, one for all runs or one per run. Defaults to 1000.
+
+    Returns:
+        pd.DataFrame: One row of metrics per run, with the keys of compute_metrics
+    """
+    signal = _padded(signals, np.int64, 0)
+    close = _padded(closes, np.float64, np.nan)
+    runs, width = signal.shape
+    if lengths is None:
+        lengths = [len(run) for run in signals] if not isinstance(signals, np.ndarray) else np.full(runs, width)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    rows = np.arange(width)
+    valid = rows < lengths[:, None]
+    signal = np.where(valid, signal, 0)
+    leverage, slippage, initial_capital = (np.broadcast_to(np.asarray(value, dtype=np.float64), (runs,))[:, None] for value in (leverage, slippage, capital))
+
+    # Status after every row, composing the transitions of the rows before it in log2(width) steps
+    composed = TRANSITIONS[signal + 2] + 1
+    step = 1
+    while step < width:
+        composed[:, step:] = np.take_along_axis(composed[:, step:], composed[:, :-step], axis=2)
+        step *= 2
+    status = composed[:, :, 1] - 1
+    before = np.concatenate((np.zeros((runs, 1), dtype=np.int64), status[:, :-1]), axis=1)
+
+    moved = signal != 0
+    closing = moved & (before != 0)
+    entering = moved & (
+        (before == 0) | ((before == 1) & np.isin(signal, (-2, 1))) | ((before == -1) & np.isin(signal, (2, -1)))
+    )
+    long_entries = ((before == 0) & (signal == 1)) | ((before == 1) & (signal == 1)) | ((before == -1) & (signal == 2))
+    short_entries = ((before == 0) & (signal == -1)) | ((before == 1) & (signal == -2)) | ((before == -1) & (signal == -1))
+
+    # Entry price of the position a row closes, the close of the last entry before it
+    last_entry = np.maximum.accumulate(np.where(entering, rows, -1), axis=1)
+    last_entry = np.concatenate((np.full((runs, 1), -1), last_entry[:, :-1]), axis=1)
+    entry_price = np.take_along_axis(close, np.maximum(last_entry, 0), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.where(closing, (close - entry_price) / entry_price * before * leverage, 0.0)
+
+    growth = np.where(closing, 1 - slippage + returns, 1.0)
+    running = initial_capital * np.cumprod(growth, axis=1)  # Capital after every row
+    previous = np.concatenate((initial_capital, running[:, :-1]), axis=1)
+    pnl = np.where(closing, previous * returns, np.nan)
+    fee = np.where(closing, previous * slippage, 0.0)
+    # compute_metrics writes the capital on the closes and the entries from flat, the other rows keep 1000
+    balance = np.where(closing | (moved & (before == 0)), running, 1000.0)
+    balance = np.where(valid, balance, np.nan)
+    change = balance - np.concatenate((np.zeros((runs, 1)), balance[:, :-1]), axis=1)
+
+    last = np.maximum(lengths - 1, 0)[:, None]
+    final_balance = np.take_along_axis(balance, last, axis=1)[:, 0]
+    wins, losses = closing & (pnl > 0), closing & (pnl < 0)
+    trades = closing.sum(axis=1)
+    cumulative_max = np.fmax.accumulate(balance, axis=1)
+    nonzero, negative = valid & (returns != 0), valid & (returns < 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_returns = np.where(nonzero, returns, 0).sum(axis=1) / nonzero.sum(axis=1)
+        first_close, last_close = close[:, 0], np.take_along_axis(close, last, axis=1)[:, 0]
+        metrics_dict = {
+            'final_balance': final_balance,
+            'gross_profit': np.where(wins, change, 0).sum(axis=1),
+            'gross_loss': np.where(losses, change, 0).sum(axis=1),
+            'net_profit': final_balance - initial_capital[:, 0],
+            'total_long_trades': (long_entries & valid).sum(axis=1),
+            'total_short_trades': (short_entries & valid).sum(axis=1),
+            'win_rate': wins.sum(axis=1) / trades * 100,
+            'loss_rate': losses.sum(axis=1) / trades * 100,
+            'avg_winning_trade': np.where(wins, pnl, 0).sum(axis=1) / wins.sum(axis=1),
+            'avg_losing_trade': np.where(losses, pnl, 0).sum(axis=1) / losses.sum(axis=1),
+            'buy_and_hold_return': (last_close - first_close) / first_close * initial_capital[:, 0] - (initial_capital * slippage)[:, 0],
+            'largest_losing_trade': np.where(losses, pnl, np.inf).min(axis=1, initial=np.inf),
+            'largest_winning_trade': np.where(wins, pnl, -np.inf).max(axis=1, initial=-np.inf),
+            'max_dd': np.nanmin(np.where(valid, (balance - cumulative_max) / cumulative_max * 100, np.nan), axis=1),
+            'sharpe_ratio': avg_returns / _masked_std(returns, nonzero) * np.sqrt(365),
+            'sortino_ratio': avg_returns / _masked_std(returns, negative) * np.sqrt(365),
+            'average_holding_duration': pd.NaT,
+            'maximum_holding_duration': pd.NaT,
+            'maximum_pnl': np.where(closing, pnl, -np.inf).max(axis=1, initial=-np.inf),
+            'minimum_pnl': np.where(closing, pnl, np.inf).min(axis=1, initial=np.inf),
+            'min_portfolio_balance': np.nanmin(balance, axis=1),
+            'max_portfolio_balance': np.nanmax(balance, axis=1),
+            'num_of_trades': trades,
+            'total_fee': fee.sum(axis=1),
+        }
+    for name in ('largest_losing_trade', 'largest_winning_trade', 'maximum_pnl', 'minimum_pnl'):
+        metrics_dict[name] = np.where(np.isinf(metrics_dict[name]), np.nan, metrics_dict[name])
+
+    if date_times is not None:
+        # compute_metrics pairs the rows two by two, the entry and the exit of every trade
+        times = _timestamps(date_times)
+        durations = times[:, 1::2] - times[:, : 2 * (width // 2) : 2]
+        paired = 2 * np.arange(durations.shape[1]) + 1 < lengths[:, None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = np.where(paired, durations, 0).sum(axis=1) / paired.sum(axis=1)
+        maximum = np.where(paired, durations, np.iinfo(np.int64).min).max(axis=1, initial=np.iinfo(np.int64).min)
+        has_pairs = paired.any(axis=1)
+        metrics_dict['average_holding_duration'] = pd.to_timedelta(np.where(has_pairs, average, np.nan), unit="ns")
+        metrics_dict['maximum_holding_duration'] = pd.to_timedelta(np.where(has_pairs, maximum, np.nan), unit="ns")
+    return pd.DataFrame(metrics_dict, index=pd.RangeIndex(runs, name="run"))
@@ -1,13 +1,193 @@
+import copy
+import itertools
+import math
 import multiprocessing
-from multiprocessing.synchronize import Semaphore, Event
+import resource
+import numpy as np
+import pandas as pd
+from collections import deque
+from multiprocessing.synchronize import Event
 import time
 import os
 import argparse
 from worker import backtest
 from utils import get_cfg
 from easydict import EasyDict
+from typing import Iterable, Iterator, List, Tuple
 
 NUMBER_OF_PROCESSES = os.cpu_count() * 50 // 100  # Adjust this as desired
+MEMORY_FRACTION = 0.8  # Fraction of the available memory used when no budget is configured
+MB = 1024 * 1024
+
+
+def available_memory() -> int:
+    """Memory available for new processes in bytes"""
+    try:
+        with open("/proc/meminfo") as stream:
+            for line in stream:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def resident_memory() -> int:
+    """Resident set size of this process in bytes, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as stream:
+            return int(stream.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def reset_peak_memory() -> bool:
+    """Reset the peak resident set size of this process to its current one, False where /proc is not available"""
+    try:
+        with open("/proc/self/clear_refs", "w") as stream:
+            stream.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory() -> int | None:
+    """Peak resident set size of this process in bytes since the last reset, None where /proc is not available"""
+    try:
+        with open("/proc/self/status") as stream:
+            for line in stream:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def job_type(config: EasyDict) -> Tuple[str, str, str]:
+    """Jobs of the same symbol and timeframes need about the same memory"""
+    return config.data.symbol, config.backtester.high_time, config.backtester.low_time
+
+
+def _run_job(index: int, config: EasyDict, results: multiprocessing.Queue):
+    # Right after the fork the resident pages are those shared with the parent. ru_maxrss keeps the
+    # parent's peak across the exec of the spawn and forkserver methods, VmHWM is read after a reset
+    baseline = resident_memory()
+    reset = reset_peak_memory()
+    inherited_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    result, error = None, None
+    try:
+        result = backtest(config)
+    except Exception as e:
+        error = repr(e)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    peak = peak_memory() if reset else None
+    if peak is None:
+        # ru_maxrss is in kilobytes on Linux and starts at the parent's peak, it only tells the job's
+        # peak when the job went above it, the current resident set size is used otherwise
+        peak = usage.ru_maxrss * 1024 if usage.ru_maxrss > inherited_peak else resident_memory()
+    # The peak includes the pages shared with the parent, the job's own is what it adds to them
+    peak = max(peak - baseline, 0)
+    results.put((index, result, error, peak, usage.ru_utime + usage.ru_stime, time.perf_counter() - start))
+
+
+class JobScheduler:
+    """Run backtests in separate processes within a core budget and a memory budget.
+
+    A job is admitted when a core is free and the peak RSS measured for its job type, above the
+    pages it shares with the scheduler, fits in the memory left. The first job of a type is a calibration run: it reserves all the memory left
+    until its peak RSS is known.
+    """
+
+    def __init__(self, cores: int, memory_budget: int = None):
+        self.cores = max(1, cores)
+        self.memory_budget = memory_budget or int(available_memory() * MEMORY_FRACTION)
+        self.stats = {}  # job type -> [(peak_rss, cpu_seconds, wall_seconds, failed)]
+
+    def estimate(self, kind: Tuple[str, str, str]) -> int | None:
+        """Peak RSS of the job type, None before its calibration run"""
+        measured = [peak for peak, _, _, failed in self.stats.get(kind, []) if not failed]
+        return max(measured) if measured else None
+
+    def run(self, configs: Iterable[EasyDict], stop_event: Event = None) -> Iterator[Tuple[int, pd.Series | None]]:
+        """Run the configs, yield their index and metrics as they finish, None for a failed job"""
+        configs = iter(enumerate(configs))
+        pending = deque()
+        running = {}  # index -> (process, job type, reserved memory)
+        results = multiprocessing.Queue()
+        try:
+            while True:
+                if not pending and (stop_event is None or not stop_event.is_set()):
+                    pending.extend(itertools.islice(configs, 1))
+                if not pending and not running:
+                    return
+                reserved = sum(memory for _, _, memory in running.values())
+                if pending and len(running) < self.cores:
+                    index, config = pending[0]
+                    kind = job_type(config)
+                    estimate = self.estimate(kind)
+                    calibrating = estimate is None and any(running_kind == kind for _, running_kind, _ in running.values())
+                    if estimate is None:
+                        estimate = self.memory_budget - reserved
+                    if not calibrating and (reserved + estimate <= self.memory_budget or not running):
+                        if estimate > self.memory_budget:
+                            print(f"Job {index} needs {estimate // MB} MB, over the {self.memory_budget // MB} MB budget")
+                        pending.popleft()
+                        process = multiprocessing.Process(target=_run_job, args=(index, config, results))
+                        process.start()
+                        running[index] = (process, kind, estimate)
+                        continue
+                yield from self._collect(running, results)
+        finally:
+            for process, _, _ in running.values():
+                process.terminate()
+
+    def _collect(self, running: dict, results: multiprocessing.Queue) -> Iterator[Tuple[int, pd.Series | None]]:
+        try:
+            index, result, error, peak, cpu, wall = results.get(timeout=0.5)
+        except Exception:
+            # A process killed before reporting, e.g. by the OOM killer, never sends its result
+            for index, (process, kind, _) in list(running.items()):
+                if not process.is_alive() and process.exitcode != 0:
+                    print(f"Job {index} died with exit code {process.exitcode}")
+                    del running[index]
+                    self.stats.setdefault(kind, []).append((0, 0.0, 0.0, True))
+                    yield index, None
+            return
+        process, kind, _ = running.pop(index)
+        process.join()
+        if error:
+            print(f"Error in job {index}: {error}")
+        self.stats.setdefault(kind, []).append((peak, cpu, wall, error is not None))
+        yield index, result
+
+    def report(self) -> pd.DataFrame:
+        """Memory and CPU statistics of every job type"""
+        rows = []
+        for (symbol, high_time, low_time), stats in self.stats.items():
+            peak, cpu, wall, failed = map(np.array, zip(*stats))
+            done = ~failed
+            rows.append({
+                "symbol": symbol,
+                "high_time": high_time,
+                "low_time": low_time,
+                "jobs": len(stats),
+                "failed": int(failed.sum()),
+                "peak_rss_mb": peak[done].max() / MB if done.any() else np.nan,
+                "mean_rss_mb": peak[done].mean() / MB if done.any() else np.nan,
+                "mean_cpu_s": cpu[done].mean() if done.any() else np.nan,
+                "mean_wall_s": wall[done].mean() if done.any() else np.nan,
+                "cpu_utilisation": cpu[done].sum() / wall[done].sum() if done.any() else np.nan,
+            })
+        return pd.DataFrame(rows)
+
+
+def scheduler(config: EasyDict, processes: int) -> JobScheduler:
+    """Scheduler with the budgets of the scheduler section, processes if no core budget is set"""
+    settings = config.get("scheduler", {})
+    memory_budget = settings.get("memory_budget_mb")
+    return JobScheduler(settings.get("cores") or processes, memory_budget * MB if memory_budget else None)
+
 
 def with_continuous_multiprocessing(stop_event: Event):
     """Function to continuously spawn processes until interrupted.
@@ -16,33 +196,86 @@ def with_continuous_multiprocessing(stop_event: Event):
         stop_event (Event): Event to signal stopping
     """
     global NUMBER_OF_PROCESSES
-    semaphore = multiprocessing.Semaphore(NUMBER_OF_PROCESSES)
     config = get_cfg() # TODO: Replace with fetching the configuration from a redis server
+    jobs = scheduler(config, NUMBER_OF_PROCESSES)
+    try:
+        for _, result in jobs.run(itertools.repeat(config), stop_event):
+            if result is not None:
+                print("Worker completed.")
+    finally:
+        print(jobs.report().to_string(index=False))
 
-    while not stop_event.is_set():
-        if stop_event.wait(0.1):
-            break
+def sweep_configs(config: EasyDict) -> List[EasyDict]:
+    """Build one configuration per combination of the swept backtester values
+
+    Args:
+        config (EasyDict): Base configuration with the sweep.params section
+
+    Returns:
+        List[EasyDict]: Configurations of the sweep
+    """
+    names = list(config.sweep.params)
+    configs = []
+    for values in itertools.product(*(config.sweep.params[name] for name in names)):
+        swept = copy.deepcopy(config)
+        swept.backtester.update(dict(zip(names, values)))
+        swept.backtester.print_metrics = False
+        configs.append(swept)
+    return configs
 
-        semaphore.acquire()
-        process = multiprocessing.Process(target=worker, args=(config, semaphore, stop_event))
-        process.start()
 
-def worker(config: EasyDict, semaphore: Semaphore, stop_event: Event):
-    """Wrapper for backtest to release the semaphore after completion.
+def promote(indexes: List[int], scores: List[float], keep: int) -> List[int]:
+    """The keep indexes of the highest scores, ties in order
+
+    A metric undefined for a config, e.g. the sharpe ratio without trades, ranks it last.
+    """
+    scores = np.nan_to_num(np.asarray(scores, dtype=np.float64), nan=-np.inf)
+    return [indexes[i] for i in np.argsort(-scores, kind="stable")[:keep]]
+
+
+def successive_halving(config: EasyDict, processes: int) -> pd.DataFrame:
+    """Run a sweep with successive halving
+
+    Every config is run up to the first horizon, then only the best fraction of them is
+    promoted to the next, longer horizon, until the last horizon.
 
     Args:
-        config (EasyDict): Configuration dictionary for the backtester
-        semaphore (Semaphore): Semaphore to control the number of active processes
-        stop_event (Event): Event to signal stopping
+        config (EasyDict): Base configuration with the sweep section
+        processes (int): Number of worker processes
+
+    Returns:
+        pd.DataFrame: Swept values, last horizon reached and metrics of every config
     """
-    try:
-        if not stop_event.is_set():
-            backtest(config)
-            print("Worker completed.")
-    except Exception as e:
-        print(f"Error in worker: {e}")
-    finally:
-        semaphore.release()
+    halving = config.sweep.halving
+    configs = sweep_configs(config)
+    names = list(config.sweep.params)
+    results = [None] * len(configs)
+    alive = list(range(len(configs)))
+    jobs = scheduler(config, processes)
+    for rung, horizon in enumerate(halving.horizons):
+        for index in alive:
+            configs[index].data.end_date = horizon
+        print(f"--- Rung {rung}: {len(alive)} configs up to {horizon} ---")
+        for position, result in jobs.run([configs[index] for index in alive]):
+            if result is None:
+                result = pd.Series({"stopped": "failed"})
+            result["horizon"] = horizon
+            results[alive[position]] = result
+        # Runs stopped early or failed are never promoted, the others are ranked by the metric
+        keep = max(1, math.ceil(len(alive) * halving.keep))
+        alive = [index for index in alive if not results[index]["stopped"]]
+        scores = [results[index][halving.metric] for index in alive]
+        alive = promote(alive, scores, keep)
+        if not alive:
+            break
+    print(jobs.report().to_string(index=False))
+
+    rows = [
+        {**{name: configs[index].backtester[name] for name in names}, **results[index]}
+        for index in range(len(configs))
+    ]
+    return pd.DataFrame(rows).sort_values(["horizon", halving.metric], ascending=False)
+
 
 def main():
     global NUMBER_OF_PROCESSES
@@ -69,6 +302,7 @@ if __name__ == "__main__":
     args_group = args.add_mutually_exclusive_group()
     args_group.add_argument('-j', '--jobs', type=int, help='Number of processes to spawn, default = Half of CPU cores')
     args_group.add_argument('-p', '--percentage', type=int, help='Percentage of CPU cores to use, default = 50%%')
+    args.add_argument('--halving', action='store_true', help='Run the sweep section of the config with successive halving')
     args = args.parse_args()
     
     if args.jobs:
@@ -80,4 +314,7 @@ if __name__ == "__main__":
         print("Number of processes should be at least 1.")
         exit(1)
     
-    main()
+    if args.halving:
+        print(successive_halving(get_cfg(), NUMBER_OF_PROCESSES).to_string(index=False))
+    else:
+        main()
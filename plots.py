@@ -0,0 +1,119 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import List, Tuple
+from utils import to_timestamps
+
+MAX_POINTS = 2000  # Points kept per curve when rendering
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling
+
+    Keeps the first and last points and, in each of the n_out - 2 buckets in between, the point
+    forming the largest triangle with the point kept in the previous bucket and the mean of the
+    next bucket, which preserves the peaks and troughs of the curve.
+
+    Args:
+        x (np.ndarray): Increasing x values
+        y (np.ndarray): y values
+        n_out (int): Number of points to keep
+
+    Returns:
+        np.ndarray: Indices of the points kept
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for b in range(n_out - 2):
+        start, end = edges[b], edges[b + 1]
+        next_start, next_end = end, edges[b + 2] if b + 2 < len(edges) else n
+        mean_x = x[next_start:next_end].mean()
+        mean_y = y[next_start:next_end].mean()
+        area = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(area.argmax())
+        kept[b + 1] = previous
+    return kept
+
+
+def render_equity_and_drawdown(
+    df: pd.DataFrame,
+    path: str,
+    max_points: int = MAX_POINTS,
+    date_column: str = "datetime",
+):
+    """Render the equity curve and drawdown plot to a png or svg file without a display
+
+    Args:
+        df (pd.DataFrame): DataFrame containing the date and 'capital' columns
+        path (str): Output file, the format is taken from the suffix
+        max_points (int, optional): Points kept per curve after LTTB downsampling. Defaults to MAX_POINTS.
+        date_column (str, optional): Name of the date column. Defaults to "datetime".
+    """
+    # The Figure API renders without a GUI backend and is only imported when rendering
+    from matplotlib.figure import Figure
+
+    x = to_timestamps(df[date_column])
+    capital = df["capital"].to_numpy(dtype=np.float64)
+    cumulative_max = np.maximum.accumulate(capital)
+    drawdown = (capital - cumulative_max) / cumulative_max * 100
+
+    equity_kept = lttb(x, capital, max_points)
+    drawdown_kept = lttb(x, drawdown, max_points)
+    dates = x.view("datetime64[ns]")
+
+    fig = Figure(figsize=(12, 8))
+    ax1, ax2 = fig.subplots(2, 1, sharex=True)
+    ax1.plot(dates[equity_kept], capital[equity_kept], label="Equity Curve", color="blue")
+    ax1.set_ylabel("Capital")
+    ax1.set_title("Equity Curve")
+    ax1.legend()
+
+    ax2.fill_between(dates[drawdown_kept], drawdown[drawdown_kept], 0,
+                     where=(drawdown[drawdown_kept] < 0), color="red", alpha=0.5, label="Drawdown (%)")
+    ax2.axhline(0, color="black", linewidth=1, linestyle="--")
+    ax2.set_ylabel("Drawdown Percentage (%)")
+    ax2.set_title("Drawdown Plot with Filled Regions")
+    ax2.legend()
+    ax2.set_xlabel("Date Time")
+
+    fig.tight_layout()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(path)
+
+
+def _render(args: Tuple[pd.DataFrame, str, int, str]):
+    render_equity_and_drawdown(*args)
+    return args[1]
+
+
+def render_many(
+    curves: List[Tuple[pd.DataFrame, str]],
+    processes: int = None,
+    max_points: int = MAX_POINTS,
+    date_column: str = "datetime",
+) -> List[str]:
+    """Render many equity curves, e.g. the results of a sweep, in parallel worker processes
+
+    Args:
+        curves (List[Tuple[pd.DataFrame, str]]): Pairs of equity curve and output file
+        processes (int, optional): Number of worker processes. Defaults to None (cpu count).
+        max_points (int, optional): Points kept per curve. Defaults to MAX_POINTS.
+        date_column (str, optional): Name of the date column. Defaults to "datetime".
+
+    Returns:
+        List[str]: Files written
+    """
+    jobs = [(df, path, max_points, date_column) for df, path in curves]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_render, jobs)
@@ -0,0 +1,298 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Tuple
+from easydict import EasyDict
+from utils import index_range, handle_date_time, to_timestamps, first_touch, INTRABAR_COLUMNS
+from strategy import BaseStrategy
+from engine import EngineState
+from cursor import BarCursor
+from metrics import MetricsAccumulator, early_stop_reason
+from data_quality import open_time_table
+
+CAPACITY = 16  # Initial position slots of a book, doubled when they are all taken
+BOOK_COLUMNS = ["date_time", "position", "side", "action", "order_type", "executed_price", "size", "capital", "profit_loss%", "pnl"]
+
+
+class PositionBook:
+    """Open positions held in preallocated arrays, one slot per position
+
+    A free slot has side 0. The exits of all the open positions are evaluated at once over a
+    window of low timeframe bars, long and short positions alike.
+    """
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.side = np.zeros(capacity, dtype=np.int64)  # 1 long, -1 short and 0 free
+        self.size = np.zeros(capacity)  # Capital committed at the entry
+        self.leverage = np.ones(capacity)
+        self.entry_price = np.zeros(capacity)
+        self.target = np.zeros(capacity)
+        self.stop = np.zeros(capacity)  # Tightest of the stop loss and the margin price
+        self.sl = np.zeros(capacity)  # Stop loss percentage, for the trailing stop
+        self.trailing = np.zeros(capacity, dtype=bool)
+        self.trailing_price = np.zeros(capacity)  # Extreme price since the entry
+        self.entry_time = np.empty(capacity, dtype=object)
+        self.id = np.full(capacity, -1, dtype=np.int64)
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.side))
+
+    def slots(self, side: int = None) -> np.ndarray:
+        """Slots of the open positions, of one side if given, in the order they were opened"""
+        slots = np.flatnonzero(self.side != 0 if side is None else self.side == side)
+        return slots[np.argsort(self.id[slots], kind="stable")]
+
+    def _grow(self):
+        for name, values in vars(self).items():
+            if isinstance(values, np.ndarray):
+                grown = np.zeros(2 * len(values), dtype=values.dtype) if values.dtype != object else np.empty(2 * len(values), dtype=object)
+                grown[: len(values)] = values
+                if name == "id":
+                    grown[len(values) :] = -1
+                setattr(self, name, grown)
+
+    def open(
+        self,
+        side: int,
+        size: float,
+        entry_price: float,
+        tp: float,
+        sl: float,
+        margin: float,
+        leverage: float,
+        trailing: bool = False,
+        trailing_price: float = None,
+        date_time=None,
+    ) -> int:
+        """Open a position, its levels follow the formulas of tpsl
+
+        Returns:
+            int: Slot of the position
+        """
+        free = np.flatnonzero(self.side == 0)
+        if not len(free):
+            free = [len(self.side)]
+            self._grow()
+        slot = free[0]
+        self.side[slot] = side
+        self.size[slot] = size
+        self.leverage[slot] = leverage
+        self.entry_price[slot] = entry_price
+        self.target[slot] = entry_price + side * entry_price * tp
+        stop_loss = entry_price - side * entry_price * sl
+        margin_price = entry_price - side * margin / leverage * entry_price
+        self.stop[slot] = side * max(side * stop_loss, side * margin_price)
+        self.sl[slot] = sl
+        self.trailing[slot] = trailing
+        self.trailing_price[slot] = entry_price if trailing_price is None else trailing_price
+        self.entry_time[slot] = date_time
+        self.id[slot] = self.next_id
+        self.next_id += 1
+        return slot
+
+    def close(self, slots: np.ndarray, price: np.ndarray, slippage: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Close positions at their exit prices and free their slots
+
+        Returns:
+            Tuple (np.ndarray, np.ndarray, np.ndarray): pnl, profit/loss percentage and fee of every position
+        """
+        entry_price, side = self.entry_price[slots], self.side[slots]
+        p = ((price - entry_price) / entry_price) * side * self.leverage[slots]
+        pnl = self.size[slots] * p
+        fee = self.size[slots] * slippage
+        self.side[slots] = 0
+        return pnl, p, fee
+
+    def exits(
+        self, opens: np.ndarray, highs: np.ndarray, lows: np.ndarray, closes: np.ndarray, fills: str = "close", tie_break: str = "sl"
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """First bar of the window where every open position hits its target or a stop
+
+        With close fills the closes are compared as in tpsl, with intrabar fills the highs and lows
+        as in intrabar_exits. The trailing price of the positions left open is moved to the extreme
+        of the window.
+
+        Args:
+            opens (np.ndarray): Open prices of the low timeframe bars of the window, used by the intrabar fills
+            highs (np.ndarray): High prices, used by the intrabar fills
+            lows (np.ndarray): Low prices, used by the intrabar fills
+            closes (np.ndarray): Close prices, used by the close fills
+            fills (str, optional): close or intrabar. Defaults to "close".
+            tie_break (str, optional): Exit of an intrabar bar touching both levels. Defaults to "sl".
+
+        Returns:
+            Tuple (np.ndarray, np.ndarray, np.ndarray): Slots of the positions hit, in the order of the hits,
+            the offsets of the hits in the window and the exit prices
+        """
+        slots = self.slots()
+        if not len(slots) or not len(closes):
+            return slots[:0], np.zeros(0, dtype=np.int64), np.zeros(0)
+        # Prices multiplied by the side, so that every position reads as a long
+        side = self.side[slots, None].astype(np.float64)
+        if fills == "intrabar":
+            opens = side * opens
+            favourable = np.where(side == 1, highs, -lows)
+            adverse = np.where(side == 1, lows, -highs)
+        else:
+            opens = favourable = adverse = side * closes
+        extreme = np.maximum.accumulate(np.concatenate((side * self.trailing_price[slots, None], favourable), axis=1), axis=1)
+        # A close moves the trailing stop of its own bar, a bar's high or low only that of the next bars
+        reached = side * (extreme[:, :-1] if fills == "intrabar" else extreme[:, 1:])
+        trailing_stop = side * (reached - side * reached * self.sl[slots, None])
+        stop = side * self.stop[slots, None]
+        stop = np.where(self.trailing[slots, None], np.maximum(stop, trailing_stop), stop)
+        offsets, prices = first_touch(opens, favourable, adverse, side * self.target[slots, None], stop, tie_break)
+
+        last = np.where(offsets >= 0, offsets, len(closes) - 1)
+        self.trailing_price[slots] = side[:, 0] * extreme[np.arange(len(slots)), last + 1]
+        hit = np.flatnonzero(offsets >= 0)
+        order = hit[np.argsort(offsets[hit], kind="stable")]
+        return slots[order], offsets[order], side[order, 0] * prices[order]
+
+
+def generate_positions(
+    strategy: BaseStrategy,
+    glob: EngineState,
+    high_csv: pd.DataFrame,
+    low_csv: pd.DataFrame,
+    low_time: int = 3,
+    high_time: int = 1440,
+    margin: float = 0.02,
+    leverage: int = 1,
+    trailing: bool = False,
+    slippage: float = 0.0015,
+    capital: float = 1000,
+    entry_date: datetime = None,
+    exit_date: datetime = None,
+    fills: str = "close",
+    tie_break: str = "sl",
+    max_open: int = 1,
+    size: float = 1.0,
+    metrics: MetricsAccumulator = None,
+    open_times: EasyDict = None,
+    early_stop: EasyDict = None,
+) -> EasyDict:
+    """generate_signals on a position book, with pyramiding
+
+    An entry signal in the direction of the open positions adds one while fewer than max_open
+    are open, an entry in the other direction closes them all and opens one, and an exit signal
+    closes all the positions of its side. Every position commits size times the capital at its
+    entry. The exits of all the open positions are checked at once on every bar, and as in
+    generate_signals a TP/SL exit on a bar skips the signals of that bar. With max_open 1 and
+    size 1 the trades and metrics are those of generate_signals.
+
+    Args:
+        strategy (BaseStrategy): Strategy to be used for generating the signals
+        glob (EngineState): State read by the strategy, its entry price, trailing price, tp and sl are read after an entry signal
+        high_csv (pd.DataFrame): High timeframe data
+        low_csv (pd.DataFrame): Low timeframe data
+        max_open (int, optional): Positions open at once. Defaults to 1.
+        size (float, optional): Fraction of the capital committed to each position. Defaults to 1.0.
+        metrics (MetricsAccumulator, optional): Online metrics updated on every trade. Defaults to None.
+        open_times (EasyDict, optional): Open times of every bar from open_time_table. Defaults to computing it.
+        early_stop (EasyDict, optional): Rules ending the run early, see early_stop_reason. Defaults to None.
+        The other arguments are those of generate_signals.
+
+    Returns:
+        EasyDict: The trade book with one row per open and close, the capital, the total fee and the early stop reason if any
+    """
+    entry_index, exit_index = index_range(high_csv, entry_date, exit_date)
+    if open_times is None:
+        open_times = open_time_table(high_csv, low_csv, low_time, high_time)
+    if fills == "intrabar" and any(column not in low_csv for column in INTRABAR_COLUMNS):
+        raise ValueError(f"Intrabar fills need the {INTRABAR_COLUMNS} columns of the low timeframe data")
+    low_ns, high_ns = to_timestamps(low_csv["datetime"]), to_timestamps(high_csv["datetime"])
+    prices = {column: low_csv[column].to_numpy(dtype=np.float64) for column in INTRABAR_COLUMNS if column in low_csv}
+    high_close = high_csv["close"].to_numpy(dtype=np.float64)
+    low_datetime = low_csv["datetime"].to_numpy()
+    if early_stop is not None:
+        if metrics is None:
+            metrics = MetricsAccumulator(capital)
+        checkpoint_index = exit_index
+        if early_stop.get("checkpoint_date"):
+            checkpoint_time = pd.Timestamp(handle_date_time(early_stop.checkpoint_date)).value
+            checkpoint_index = int(np.searchsorted(high_ns, checkpoint_time))
+
+    book = PositionBook()
+    rows = []
+    total_fee = 0.0
+    stopped = None
+
+    def close(slots, price, date_times, order_type=None):
+        nonlocal capital, total_fee
+        sides, ids, sizes, sl, entry_times = (
+            book.side[slots].copy(), book.id[slots], book.size[slots], book.sl[slots], book.entry_time[slots]
+        )
+        pnl, p, fee = book.close(slots, price, slippage)
+        for k in range(len(slots)):
+            total_fee += fee[k]
+            capital = capital - fee[k] + pnl[k]
+            kind = order_type or ("TP" if pnl[k] > 0 else "SL" if margin / leverage > sl[k] else "Margin")
+            if metrics is not None:
+                metrics.on_close(capital, pnl[k], p[k], fee[k], date_times[k], entry_times[k])
+            rows.append((date_times[k], ids[k], sides[k], "close", kind, price[k], sizes[k], capital, p[k], pnl[k]))
+
+    def entry(check, bar: BarCursor) -> EasyDict | None:
+        # The strategy sets the entry price, the trailing price and the exit parameters of its entries
+        if not check(bar):
+            return None
+        return EasyDict(price=glob.entry_price, trailing_price=glob.trailing_price, tp=glob.tp, sl=glob.sl)
+
+    low_pointer = 1
+    for i in range(entry_index, exit_index):
+        if early_stop is not None:
+            stopped = early_stop_reason(metrics, early_stop, i >= checkpoint_index)
+            if stopped:
+                print(f"Stopping early at {high_csv['datetime'].iloc[i]}: {stopped}")
+                exit_index = i
+                break
+        low_pointer = max(low_pointer, int(np.searchsorted(low_ns, high_ns[i])))
+        if len(book):
+            end = len(low_ns) if i + 1 == len(high_ns) else int(np.searchsorted(low_ns, high_ns[i + 1]))
+            window = slice(low_pointer, max(end, low_pointer))
+            slots, offsets, exit_prices = book.exits(
+                *(prices.get(column, prices["close"])[window] for column in INTRABAR_COLUMNS), fills, tie_break
+            )
+            if len(slots):
+                close(slots, exit_prices, low_datetime[low_pointer + offsets])
+                continue
+
+        side = int(book.side[book.slots()[0]]) if len(book) else 0
+        bar = strategy.cursor.move(i)
+        long_entry, short_entry = entry(strategy.check_long_entry, bar), entry(strategy.check_short_entry, bar)
+        long_exit, short_exit = strategy.check_long_exit(bar), strategy.check_short_exit(bar)
+        if side == 0:
+            closing, new, new_side = False, long_entry or short_entry, 1 if long_entry else -1
+        else:
+            # A reversal takes precedence over an exit, which takes precedence over pyramiding
+            reverse, add = (short_entry, long_entry) if side == 1 else (long_entry, short_entry)
+            leave = long_exit if side == 1 else short_exit
+            closing = bool(reverse or leave)
+            new = reverse or (add if not leave and len(book) < max_open else None)
+            new_side = -side if reverse else side
+        if not (closing or new) or not open_times.flag[i]:
+            continue
+        date_time = open_times.time[i]
+        if closing:
+            slots = book.slots(side)
+            close(slots, np.full(len(slots), high_close[i]), [date_time] * len(slots), "Market")
+        if new:
+            slot = book.open(
+                new_side, size * capital, new.price, new.tp, new.sl, margin, leverage, trailing, new.trailing_price, date_time
+            )
+            if metrics is not None:
+                metrics.on_entry(new_side, date_time)
+            rows.append((date_time, book.id[slot], new_side, "open", "Market", new.price, book.size[slot], capital, 0.0, np.nan))
+
+    if len(book):
+        date_time = open_times.time[exit_index - 1] if open_times.flag[exit_index - 1] else high_csv["datetime"].iloc[exit_index]
+        slots = book.slots()
+        close(slots, np.full(len(slots), high_close[exit_index]), [date_time] * len(slots), "Market")
+
+    return EasyDict(
+        trade_book=pd.DataFrame(rows, columns=BOOK_COLUMNS),
+        capital=capital,
+        total_fee=total_fee,
+        stopped=stopped,
+    )
@@ -0,0 +1,203 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Tuple
+from easydict import EasyDict
+from utils import to_timestamps, _scan_closes
+
+MAX_TREES = 16  # Saved trees kept in a directory, the least recently used are removed beyond this
+
+
+def build_tree(closes: np.ndarray) -> np.ndarray:
+    """Segment trees of the highest close and of the highest negated close
+
+    Row 0 holds the maxima and row 1 the maxima of the negated closes, that is the minima, so
+    that both queries read as a first value at least x. Node k has the children 2k and 2k + 1,
+    the leaves start at the size of the tree and the padding leaves are -inf. Missing closes
+    are ignored by the inner nodes, as tpsl never exits on them.
+
+    Args:
+        closes (np.ndarray): Close prices of the low timeframe data
+
+    Returns:
+        np.ndarray: Array of shape (2, 2 * size), size being a power of two
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    size = 1 << max(1, (len(closes) - 1).bit_length())
+    tree = np.full((2, 2 * size), -np.inf)
+    tree[0, size : size + len(closes)] = closes
+    tree[1, size : size + len(closes)] = -closes
+    width = size
+    while width > 1:
+        half = width // 2
+        tree[:, half:width] = np.fmax(tree[:, width : 2 * width : 2], tree[:, width + 1 : 2 * width : 2])
+        width = half
+    return tree
+
+
+def range_index(low_csv: pd.DataFrame, high_csv: pd.DataFrame, directory: str = None) -> EasyDict:
+    """Segment trees over the low timeframe closes, read by tpsl_indexed
+
+    With a directory the trees are saved once per dataset, keyed by a hash of the closes, and
+    memory-mapped, so every worker on the same data shares one copy in the page cache. Beyond
+    MAX_TREES files the least recently used ones are removed.
+
+    Args:
+        low_csv (pd.DataFrame): Low timeframe data
+        high_csv (pd.DataFrame): High timeframe data
+        directory (str, optional): Directory of the saved trees. Defaults to None, built in memory.
+
+    Returns:
+        EasyDict: The trees with their size, the closes and the timestamps of both timeframes
+    """
+    closes = low_csv["close"].to_numpy(dtype=np.float64)
+    if directory is None:
+        tree = build_tree(closes)
+    else:
+        file_path = Path(directory) / f"{hashlib.sha1(np.ascontiguousarray(closes).view(np.uint8)).hexdigest()}.npy"
+        try:
+            os.utime(file_path)  # Recently used, for prune_trees
+        except FileNotFoundError:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = file_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temporary, "wb") as stream:
+                np.save(stream, build_tree(closes))
+            os.replace(temporary, file_path)
+            prune_trees(file_path.parent)
+        tree = np.asarray(np.load(file_path, mmap_mode="r"))
+    return EasyDict(
+        tree=tree,
+        size=tree.shape[1] // 2,
+        closes=closes,
+        low_ns=to_timestamps(low_csv["datetime"]),
+        high_ns=to_timestamps(high_csv["datetime"]),
+    )
+
+
+def prune_trees(directory: Path, keep: int = MAX_TREES):
+    """Remove the saved trees beyond the keep most recently used, mapped ones stay readable"""
+    files = []
+    for file_path in Path(directory).glob("*.npy"):
+        try:
+            files.append((file_path.stat().st_mtime_ns, file_path))
+        except FileNotFoundError:
+            pass  # Removed by another worker
+    for _, file_path in sorted(files, reverse=True)[keep:]:
+        file_path.unlink(missing_ok=True)
+
+
+def first_at_least(tree: np.ndarray, size: int, start: int, end: int, x: float) -> int:
+    """First leaf in [start, end) whose value is at least x, in O(log n)
+
+    Returns:
+        int: Index of the leaf, -1 if there is none
+    """
+    left, right = start + size, end + size
+    left_nodes, right_nodes = [], []
+    while left < right:
+        if left & 1:
+            left_nodes.append(left)
+            left += 1
+        if right & 1:
+            right -= 1
+            right_nodes.append(right)
+        left >>= 1
+        right >>= 1
+    # The covering nodes from left to right, the first one reaching x holds the leaf
+    for node in left_nodes + right_nodes[::-1]:
+        if tree[node] >= x:
+            while node < size:
+                node = 2 * node if tree[2 * node] >= x else 2 * node + 1
+            return node - size
+    return -1
+
+
+def range_max(tree: np.ndarray, size: int, start: int, end: int) -> float:
+    """Highest value of the leaves in [start, end), in O(log n)"""
+    left, right = start + size, end + size
+    value = -np.inf
+    while left < right:
+        if left & 1:
+            value = max(value, tree[left])
+            left += 1
+        if right & 1:
+            right -= 1
+            value = max(value, tree[right])
+        left >>= 1
+        right >>= 1
+    return value
+
+
+def first_crossing(index: EasyDict, start: int, end: int, status: int, target_price: float, stop: float) -> int:
+    """First low bar in [start, end) whose close reaches the target or the stop of a position
+
+    Args:
+        index (EasyDict): Trees from range_index
+        start (int): First low bar
+        end (int): End of the low bars
+        status (int): 1 long and -1 short
+        target_price (float): Target price
+        stop (float): Tightest of the fixed stops
+
+    Returns:
+        int: Index of the bar, -1 if there is none
+    """
+    tree, size = index.tree, index.size
+    if status == 1:
+        hits = first_at_least(tree[0], size, start, end, target_price), first_at_least(tree[1], size, start, end, -stop)
+    else:
+        hits = first_at_least(tree[1], size, start, end, -target_price), first_at_least(tree[0], size, start, end, stop)
+    hits = [hit for hit in hits if hit >= 0]
+    return min(hits) if hits else -1
+
+
+def tpsl_indexed(
+    low_pointer: int,
+    high_pointer: int,
+    index: EasyDict,
+    margin: float,
+    leverage: int,
+    glob: "EngineState",
+    trailing=False,
+) -> Tuple[int, int]:
+    """tpsl answering the first crossing of the fixed target, stop and margin prices on the trees
+
+    The cost does not depend on how long the position is held. The trailing stop moves with
+    every close, so trailing positions are scanned bar by bar in NumPy. The exit index and the
+    trailing price are those of tpsl.
+
+    Args:
+        low_pointer (int): Pointer to the low timeframe data
+        high_pointer (int): Pointer to the high timeframe bar, the window ends at the next one
+        index (EasyDict): Trees from range_index
+        margin (float): Margin for the trade
+        leverage (int): Leverage for the trade
+        glob (EngineState): State of the trade, its trailing price is updated
+        trailing (bool, optional): Is the Stop loss trailing. Defaults to False.
+
+    Returns:
+        Tuple: (int, int)
+        - 1 if the condition is satisfied, 0 otherwise
+        - Index at which the condition is satisfied
+    """
+    status = glob.status
+    start = int(low_pointer)
+    end = len(index.closes) if high_pointer + 1 == len(index.high_ns) else int(np.searchsorted(index.low_ns, index.high_ns[high_pointer + 1]))
+    if end <= start:
+        return 0, 0
+    target_price = glob.entry_price + status * glob.entry_price * glob.tp
+    stop_loss = glob.entry_price - status * glob.entry_price * glob.sl
+    margin_price = glob.entry_price - status * margin / leverage * glob.entry_price
+    if trailing:
+        offset = _scan_closes(index.closes[start:end], glob, target_price, stop_loss, margin_price, trailing)
+        return (1, start + offset) if offset >= 0 else (0, 0)
+
+    stop = status * max(status * stop_loss, status * margin_price)
+    hit = first_crossing(index, start, end, status, target_price, stop)
+    # The trailing price follows the closes up to the exit, as in tpsl
+    last = hit + 1 if hit >= 0 else end
+    extreme = range_max(index.tree[0 if status == 1 else 1], index.size, start, last)
+    glob.trailing_price = max(glob.trailing_price, extreme) if status == 1 else min(glob.trailing_price, -extreme)
+    return (1, hit) if hit >= 0 else (0, 0)
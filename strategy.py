@@ -1,53 +1,99 @@
-from scipy.signal import butter, cheby1, filtfilt
 import pandas as pd
 import numpy as np
+from typing import List
 from easydict import EasyDict
+from engine import EngineState
+from cursor import BarCursor
+from indicator_graph import Node, evaluate
+from timeframes import aligned_views
+import indicators
 
 
 class BaseStrategy:
+    indicator_columns = []  # Columns added to high_csv by preprocessing
+    timeframes = []  # Timeframes used besides the high and low ones, e.g. ["4h", "1w"]
+
     def __init__(
         self,
         high_csv: pd.DataFrame,
         low_csv: pd.DataFrame,
         config: EasyDict,
-        glob: EasyDict,
+        glob: EngineState,
+        indicators: pd.DataFrame = None,
+        timeframes: dict = None,
     ):
         self.high_csv = high_csv
         self.low_csv = low_csv
         self.config = config
         self.glob = glob
-        self.preprocessing()
-
-    def preprocessing(self):
+        # AlignedView of every declared timeframe, read as self.timeframes["4h"].at(bar, "close")
+        self.timeframes = timeframes if timeframes is not None else aligned_views(config, type(self).timeframes, high_csv)
+        start = 0
+        if indicators is not None:
+            # Restore the indicators of a saved run and only compute the new rows
+            start = len(indicators)
+            for column in self.indicator_columns:
+                self.high_csv.loc[: start - 1, column] = indicators[column].to_numpy()
+        self.preprocessing(start)
+        # Moved to every bar by the engine and passed to the hooks
+        self.cursor = BarCursor(self.high_csv)
+
+    def indicator_nodes(self) -> List[Node]:
+        """Indicators written to high_csv by preprocessing, the columns of indicator_columns among them"""
+        return []
+
+    def preprocessing(self, start: int = 0):
+        nodes = self.indicator_nodes()
+        if not nodes:
+            return
+        settings = self.config.backtester.get("indicators", {})
+        outputs = evaluate(nodes, self.high_csv, start, settings.get("workers", 1), settings.get("pool", "thread"))
+        for column in self.indicator_columns:
+            if start == 0:
+                self.high_csv[column] = outputs[column]
+            else:
+                self.high_csv.loc[start:, column] = outputs[column][start:]
+
+    def signal_arrays(self) -> EasyDict:
+        """Bars on which each hook fires, None when only calling the hooks tells
+
+        Boolean arrays long_entry, short_entry, long_exit and short_exit over the rows of high_csv,
+        read by the event-driven loop of generate_signals. That loop skips the bars where no hook
+        can fire, so the hooks should have no side effect on the bars they do not fire.
+        """
+        return None
+
+    def check_long_entry(self, bar: BarCursor):
         pass
 
-    def check_long_entry(self, high_pointer: int):
+    def check_short_entry(self, bar: BarCursor):
         pass
 
-    def check_short_entry(self, high_pointer: int):
+    def check_long_exit(self, bar: BarCursor):
         pass
 
-    def check_long_exit(self, high_pointer: int):
-        pass
-
-    def check_short_exit(self, high_pointer: int):
+    def check_short_exit(self, bar: BarCursor):
         pass
 
 
 class EMAStrategy(BaseStrategy):
-    def preprocessing(self):
-        self.high_csv["long_EMA"] = (
-            self.high_csv["close"].ewm(span=12, adjust=False).mean()
-        )
-        self.high_csv["short_EMA"] = (
-            self.high_csv["close"].ewm(span=9, adjust=False).mean()
-        )
-
-    def check_long_entry(self, high_pointer: int):
-        long_ema = self.high_csv["long_EMA"].iloc[high_pointer]
-        short_ema = self.high_csv["short_EMA"].iloc[high_pointer]
-        Close = self.high_csv["close"].iloc[high_pointer]
-        if short_ema > long_ema:
+    indicator_columns = ["long_EMA", "short_EMA"]
+
+    def indicator_nodes(self) -> List[Node]:
+        return [
+            Node("long_EMA", indicators.ema, params={"span": 12}),
+            Node("short_EMA", indicators.ema, params={"span": 9}),
+        ]
+
+    def signal_arrays(self) -> EasyDict:
+        long_ema = self.high_csv["long_EMA"].to_numpy()
+        short_ema = self.high_csv["short_EMA"].to_numpy()
+        never = np.zeros(len(self.high_csv), dtype=bool)
+        return EasyDict(long_entry=short_ema > long_ema, short_entry=short_ema < long_ema, long_exit=never, short_exit=never)
+
+    def check_long_entry(self, bar: BarCursor):
+        Close = bar["close"]
+        if bar["short_EMA"] > bar["long_EMA"]:
             self.glob.tp = 0.1
             self.glob.sl = 0.05
             self.glob.entry_price = Close
@@ -55,11 +101,9 @@ class EMAStrategy(BaseStrategy):
             return 1
         return 0
 
-    def check_short_entry(self, high_pointer: int):
-        long_ema = self.high_csv["long_EMA"].iloc[high_pointer]
-        short_ema = self.high_csv["short_EMA"].iloc[high_pointer]
-        Close = self.high_csv["close"].iloc[high_pointer]
-        if short_ema < long_ema:
+    def check_short_entry(self, bar: BarCursor):
+        Close = bar["close"]
+        if bar["short_EMA"] < bar["long_EMA"]:
             self.glob.tp = 0.1
             self.glob.sl = 0.05
             self.glob.entry_price = Close
@@ -67,68 +111,95 @@ class EMAStrategy(BaseStrategy):
             return 1
         return 0
 
-    def check_long_exit(self, high_pointer: int):
+    def check_long_exit(self, bar: BarCursor):
         return 0
 
-    def check_short_exit(self, high_pointer: int):
+    def check_short_exit(self, bar: BarCursor):
         return 0
 
 
 class ButterChebyStrategy(BaseStrategy):
-    def butterworth(self, data: pd.DataFrame):
-        order = self.config.strategies.strat_cheby.butterworth.order
-        cutoff_freq = self.config.strategies.strat_cheby.butterworth.cutoff_frequency
-        b, a = butter(N=order, Wn=cutoff_freq, btype="low", analog=False, output="ba")
-        smooth_data = filtfilt(b, a, data["close"], padlen=0)
-        return smooth_data
-
-    def chebyshev(self, data: pd.DataFrame):
-        cutoff_freq = self.config.strategies.strat_cheby.chebyshev.cutoff_frequency
-        rp = self.config.strategies.strat_cheby.chebyshev.ripple_factor
-        order = self.config.strategies.strat_cheby.chebyshev.order
-        b, a = cheby1(
-            N=order, rp=rp, Wn=cutoff_freq, btype="low", analog=False, output="ba"
-        )
-        smooth_data = filtfilt(b, a, data["close"], padlen=0)
-        return smooth_data
-
-    def preprocessing(self):
-        self.high_csv["butter"] = 0.0
-        self.high_csv["cheby"] = 0.0
-        df_temp = pd.DataFrame(columns=self.high_csv.columns)
-        for i in range(1, len(self.high_csv) + 1):
-            df_temp.loc[len(df_temp)] = self.high_csv.loc[i - 1]
-            self.high_csv.loc[i - 1, "butter"] = self.butterworth(df_temp)[-1]
-            self.high_csv.loc[i - 1, "cheby"] = self.chebyshev(df_temp)[-1]
-
-    def check_long_entry(self, high_pointer: int):
-        i = high_pointer
-        if not i:
+    indicator_columns = ["butter", "cheby"]
+
+    def indicator_nodes(self) -> List[Node]:
+        # Every bar sees the zero-phase filters over the bars up to it, not the future ones
+        butterworth = self.config.strategies.strat_cheby.butterworth
+        chebyshev = self.config.strategies.strat_cheby.chebyshev
+        b, a = indicators.butterworth_coefficients(butterworth.order, butterworth.cutoff_frequency)
+        butter = Node("butter", indicators.trailing_filtfilt, params={"b": b, "a": a}, incremental=True)
+        b, a = indicators.chebyshev_coefficients(chebyshev.order, chebyshev.ripple_factor, chebyshev.cutoff_frequency)
+        cheby = Node("cheby", indicators.trailing_filtfilt, params={"b": b, "a": a}, incremental=True)
+        return [butter, cheby]
+
+    def signal_arrays(self) -> EasyDict:
+        cheby = self.high_csv["cheby"].to_numpy()
+        butter = self.high_csv["butter"].to_numpy()
+        long_entry = np.zeros(len(cheby), dtype=bool)
+        short_entry = np.zeros(len(cheby), dtype=bool)
+        long_entry[1:] = (cheby[1:] > butter[1:]) & (cheby[:-1] < butter[:-1])
+        short_entry[1:] = (cheby[1:] < butter[1:]) & (cheby[:-1] > butter[:-1])
+        never = np.zeros(len(cheby), dtype=bool)
+        return EasyDict(long_entry=long_entry, short_entry=short_entry, long_exit=never, short_exit=never)
+
+    def check_long_entry(self, bar: BarCursor):
+        if not bar.bar:
             return False
-        c1 = self.high_csv.loc[i, "cheby"] > self.high_csv.loc[i, "butter"]
-        c2 = self.high_csv.loc[i - 1, "cheby"] < self.high_csv.loc[i - 1, "butter"]
-        Close = self.high_csv.loc[i, "close"]
+        c1 = bar["cheby"] > bar["butter"]
+        c2 = bar["cheby", 1] < bar["butter", 1]
+        Close = bar["close"]
         if c1 and c2:
             self.glob.entry_price = Close
             self.glob.trailing_price = Close
             return True
         return False
 
-    def check_short_entry(self, high_pointer: int):
-        i = high_pointer
-        if not i:
+    def check_short_entry(self, bar: BarCursor):
+        if not bar.bar:
             return False
-        c1 = self.high_csv.loc[i, "cheby"] < self.high_csv.loc[i, "butter"]
-        c2 = self.high_csv.loc[i - 1, "cheby"] > self.high_csv.loc[i - 1, "butter"]
-        Close = self.high_csv.loc[i, "close"]
+        c1 = bar["cheby"] < bar["butter"]
+        c2 = bar["cheby", 1] > bar["butter", 1]
+        Close = bar["close"]
         if c1 and c2:
             self.glob.entry_price = Close
             self.glob.trailing_price = Close
             return True
         return False
 
-    def check_long_exit(self, high_pointer: int):
+    def check_long_exit(self, bar: BarCursor):
         return 0
 
-    def check_short_exit(self, high_pointer: int):
+    def check_short_exit(self, bar: BarCursor):
         return 0
+
+
+class CausalButterChebyStrategy(ButterChebyStrategy):
+    """ButterCheby crossovers on causal filters in second-order sections
+
+    Unlike filtfilt over the whole series, a causal filter value never changes when bars are appended, so the columns
+    cost one filter step per bar and match what a live run computes bar by bar with indicators.SOS.
+    """
+
+    def indicator_nodes(self) -> List[Node]:
+        butterworth = self.config.strategies.strat_cheby.butterworth
+        chebyshev = self.config.strategies.strat_cheby.chebyshev
+        sections = indicators.butterworth_coefficients(butterworth.order, butterworth.cutoff_frequency, "sos")
+        butter = Node("butter", indicators.sos, params={"sections": sections})
+        sections = indicators.chebyshev_coefficients(
+            chebyshev.order, chebyshev.ripple_factor, chebyshev.cutoff_frequency, "sos"
+        )
+        cheby = Node("cheby", indicators.sos, params={"sections": sections})
+        return [butter, cheby]
+
+
+STRATEGIES = {
+    "ema": EMAStrategy,
+    "buttercheby": ButterChebyStrategy,
+    "buttercheby_causal": CausalButterChebyStrategy,
+}
+
+
+def get_strategy(name: str) -> type:
+    """Strategy class selected by backtester.strategy"""
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {name}, expected one of {', '.join(STRATEGIES)}")
+    return STRATEGIES[name]
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import utils
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """config.yaml on the shipped 4h data, returned by get_cfg, with the outputs written to a temporary directory"""
+    config = utils._load_cfg(ROOT / "config.yaml")
+    config.data.path = str(ROOT / "data")
+    config.backtester.low_time = "4h"
+    config.backtester.plots.show = False
+    config.backtester.plots.save = False
+    monkeypatch.setitem(utils.CACHE, "config.yaml", config)
+    monkeypatch.chdir(tmp_path)
+    return config
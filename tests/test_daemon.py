@@ -0,0 +1,23 @@
+import pytest
+from daemon import parse_overrides, apply_overrides
+from engine import EngineConfig
+from utils import handle_date_time
+
+
+def test_overrides_keep_the_types_of_the_config(config):
+    overrides = parse_overrides(["data.end_date=2020-01-01", "backtester.tp=0.2", "backtester.trailing=true", "data.symbol=123"])
+    run_config = apply_overrides(config, overrides)
+
+    assert run_config.data.end_date == "2020-01-01"
+    assert handle_date_time(run_config.data.end_date).year == 2020
+    assert run_config.backtester.tp == 0.2 and run_config.backtester.trailing is True
+    assert run_config.data.symbol == "123"
+    assert EngineConfig.from_config(run_config).exit_date == handle_date_time("2020-01-01")
+    assert config.data.end_date != "2020-01-01"  # The base config is not changed
+
+
+def test_overrides_reject_unknown_keys(config):
+    with pytest.raises(KeyError):
+        apply_overrides(config, {"backtester.unknown": "1"})
+    with pytest.raises(ValueError):
+        parse_overrides(["backtester.tp"])
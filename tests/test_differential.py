@@ -0,0 +1,9 @@
+import differential
+
+
+def test_engines_match_the_reference(config):
+    report = differential.run_harness(config, list(differential.ENGINES), configs=2, synthetic=1, symbols=("BTCUSDT",))
+    assert set(report["engine"]) == set(differential.ENGINES)
+    assert report["trade_sheet"].isin(["ok", "-"]).all()
+    assert report["signal_file"].isin(["ok", "-"]).all()
+    assert (report["metrics"] == "ok").all()
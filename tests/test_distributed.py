@@ -0,0 +1,57 @@
+import copy
+import socket
+import threading
+import time
+import multiprocessing
+import pandas as pd
+import pytest
+from multiprocessing.connection import Client
+from easydict import EasyDict
+import distributed
+from distributed import Coordinator, run_agent
+
+
+def _job(config):
+    # Module level so that the pool of the agent can pickle it
+    return pd.Series({"job": config.job})
+
+
+def _free_port() -> int:
+    with socket.socket() as stream:
+        stream.bind(("127.0.0.1", 0))
+        return stream.getsockname()[1]
+
+
+def _connect(address, authkey):
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+
+def test_bad_key_client_does_not_stop_the_coordinator(config, monkeypatch):
+    monkeypatch.setattr(distributed, "_backtest", _job)
+    configs = [EasyDict(copy.deepcopy(config), job=job) for job in range(4)]
+    address = ("127.0.0.1", _free_port())
+    coordinator = Coordinator(configs, address, b"key", drain_timeout=5)
+    results = {}
+    coordinating = threading.Thread(target=lambda: results.update(frame=coordinator.run()), daemon=True)
+    coordinating.start()
+
+    with pytest.raises(multiprocessing.AuthenticationError):
+        _connect(address, b"wrong")
+    agent = threading.Thread(target=run_agent, args=(address, 1, b"key", 0.1), daemon=True)
+    agent.start()
+    agent.join(60)
+    coordinating.join(10)
+
+    assert not agent.is_alive() and not coordinating.is_alive()
+    assert results["frame"]["job"].tolist() == [0, 1, 2, 3]
+
+
+def test_agent_needs_the_key(monkeypatch):
+    monkeypatch.delenv(distributed.AUTHKEY_VARIABLE, raising=False)
+    with pytest.raises(ValueError):
+        distributed.get_authkey()
+    assert len(distributed.get_authkey(generate=True)) == 64
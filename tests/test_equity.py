@@ -0,0 +1,33 @@
+import warnings
+import numpy as np
+import pandas as pd
+from equity import equity_metrics, mark_to_market
+
+
+def test_mark_meets_realised_capital_at_exit():
+    slippage = 0.0015
+    # Long at 100 on bar 0, closed at the 110 close of bar 2 on bar 3
+    equity = mark_to_market(
+        np.arange(5, dtype=np.int64),
+        np.array([100.0, 105.0, 110.0, 110.0, 120.0]),
+        np.array([0, 3], dtype=np.int64),
+        np.array([1, 0]),
+        np.array([100.0, 110.0]),
+        np.array([1000.0, 1000 * (1 - slippage + 0.1)]),
+        slippage=slippage,
+        dtype=np.float64,
+    )
+    np.testing.assert_allclose(equity, 1000 * np.array([1 - slippage, 1.05 - slippage, 1.1 - slippage, 1.1 - slippage, 1.1 - slippage]))
+
+
+def test_equity_metrics_undefined_ratios():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        constant = equity_metrics(pd.DataFrame({"capital": [1000.0] * 10}), 365)
+        ruined = equity_metrics(pd.DataFrame({"capital": [1000.0, 900.0, 0.0, 0.0, 0.0]}), 365)
+        empty = equity_metrics(pd.DataFrame({"capital": []}), 365)
+    assert constant["max_dd"] == 0
+    assert np.isnan(constant["sharpe_ratio"]) and np.isnan(constant["sortino_ratio"])
+    assert ruined["max_dd"] == -100
+    assert np.isfinite(ruined["sharpe_ratio"]) and np.isfinite(ruined["sortino_ratio"])
+    assert all(np.isnan(value) for value in empty.values())
@@ -0,0 +1,13 @@
+import pandas as pd
+import main
+
+
+def test_lean_run_writes_the_same_signal_file(config):
+    config.backtester.print_metrics = False
+    main.main()
+    reference = pd.read_csv("signal_csv.csv")
+    config.data.lean.enabled = True
+    main.main()
+    lean = pd.read_csv("signal_csv.csv")
+    assert not lean[["open", "high", "low", "volume"]].isna().any().any()
+    pd.testing.assert_frame_equal(reference, lean)
@@ -0,0 +1,14 @@
+import pandas as pd
+import main
+from metrics import MetricsAccumulator
+
+
+def test_main_applies_early_stop(config):
+    config.backtester.print_metrics = False
+    full, _ = main.main(MetricsAccumulator(config.backtester.capital))
+    config.backtester.early_stop.enabled = True
+    config.backtester.early_stop.min_capital = config.backtester.capital * 10
+    accumulator = MetricsAccumulator(config.backtester.capital)
+    stopped, _ = main.main(accumulator)
+    assert len(stopped) < len(full)
+    assert accumulator.capital < config.backtester.early_stop.min_capital
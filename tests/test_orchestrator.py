@@ -0,0 +1,26 @@
+import numpy as np
+from orchestrator import promote
+
+
+def test_promote_ranks_undefined_scores_last():
+    assert promote([10, 11, 12], [0.1, np.nan, 0.3], 2) == [12, 10]
+    assert promote([10, 11, 12], [np.nan, np.nan, 0.3], 3) == [12, 10, 11]
+    assert promote([10, 11, 12], [0.2, 0.2, 0.1], 1) == [10]
+
+
+
+def test_job_peak_excludes_parent_peak():
+    import multiprocessing
+    import orchestrator
+
+    # The spawned job starts from the peak of the parent at the fork, the job itself fails at once
+    parent = np.ones(256 * orchestrator.MB // 8)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=orchestrator._run_job, args=(0, None, results))
+    process.start()
+    _, _, error, peak, _, _ = results.get(timeout=120)
+    process.join()
+    assert error is not None
+    assert peak < 64 * orchestrator.MB
+    del parent
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+import main
+from metrics import MetricsAccumulator
+
+
+def _run(config):
+    accumulator = MetricsAccumulator(config.backtester.capital)
+    main.main(accumulator)
+    return pd.read_csv("trade_sheet.csv"), pd.read_csv("signal_csv.csv"), accumulator.capital
+
+
+def _record_resumes(monkeypatch):
+    load_state = main.load_state
+    resumed = []
+
+    def recording(*args, **kwargs):
+        state = load_state(*args, **kwargs)
+        resumed.append(state is not None)
+        return state
+
+    monkeypatch.setattr(main, "load_state", recording)
+    return resumed
+
+
+def _assert_same_run(run, other):
+    pd.testing.assert_frame_equal(run[0], other[0])
+    pd.testing.assert_frame_equal(run[1], other[1])
+    assert run[2] == other[2]
+
+
+def test_checkpoint_resume(config, monkeypatch):
+    config.backtester.print_metrics = False
+    full = _run(config)
+
+    config.backtester.checkpoint.enabled = True
+    config.backtester.checkpoint.every = 50
+    save_state = main.save_state
+    saved = []
+
+    def interrupted(*args, **kwargs):
+        # The run is killed right after its third checkpoint
+        save_state(*args, **kwargs)
+        saved.append(args[0])
+        if len(saved) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(main, "save_state", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _run(config)
+    assert saved[-1].exists()
+    monkeypatch.setattr(main, "save_state", save_state)
+    resumed = _record_resumes(monkeypatch)
+    _assert_same_run(_run(config), full)
+    assert resumed == [True]
+    assert not saved[-1].exists()
+
+
+def test_incremental_resume(config, monkeypatch):
+    config.backtester.print_metrics = False
+    full = _run(config)
+
+    config.backtester.incremental.enabled = True
+    end_date = config.data.end_date
+    config.data.end_date = "2022-01-01"
+    _run(config)
+    config.data.end_date = end_date
+    resumed = _record_resumes(monkeypatch)
+    _assert_same_run(_run(config), full)
+    assert resumed == [True]
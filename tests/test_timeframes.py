@@ -0,0 +1,51 @@
+import copy
+import strategy
+import timeframes
+import worker
+from cursor import BarCursor
+from strategy import EMAStrategy
+
+
+class WeeklyTrendStrategy(EMAStrategy):
+    """EMA entries taken only in the direction of the last closed weekly bar"""
+
+    timeframes = ["1w"]
+
+    def weekly_trend(self, bar: BarCursor) -> int:
+        try:
+            return 1 if self.timeframes["1w"].at(bar, "close") > self.timeframes["1w"].at(bar, "open") else -1
+        except IndexError:
+            return 0
+
+    def check_long_entry(self, bar: BarCursor):
+        return self.weekly_trend(bar) == 1 and super().check_long_entry(bar)
+
+    def check_short_entry(self, bar: BarCursor):
+        return self.weekly_trend(bar) == -1 and super().check_short_entry(bar)
+
+
+def test_worker_builds_the_declared_timeframes(config, monkeypatch):
+    monkeypatch.setitem(strategy.STRATEGIES, "weekly", WeeklyTrendStrategy)
+    config.backtester.strategy = "weekly"
+    config.backtester.print_metrics = False
+    result = worker.backtest(copy.deepcopy(config))
+    assert result["num_of_trades"] > 0
+
+
+def test_views_read_only_closed_bars(config):
+    high_csv, low_csv = worker.load_data(config)
+    views = timeframes.aligned_views(config, ["1w", "2d"], high_csv)
+    high_close = timeframes.to_timestamps(high_csv["datetime"]) + 1440 * timeframes.MINUTE
+    for name, minutes in (("1w", 7 * 1440), ("2d", 2 * 1440)):
+        view = views[name]
+        rows = view.offsets >= 0
+        close_time = timeframes.to_timestamps(view.data["datetime"])[view.offsets[rows]] + minutes * timeframes.MINUTE
+        assert (close_time <= high_close[rows]).all()
+
+
+def test_frames_are_bounded(config, monkeypatch):
+    monkeypatch.setattr(timeframes, "FRAMES", {})
+    monkeypatch.setattr(timeframes, "MAX_FRAMES", 2)
+    for timeframe in ("1d", "2d", "3d", "1w"):
+        timeframes.load_timeframe(config, timeframe)
+    assert len(timeframes.FRAMES) <= 2
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List
+from easydict import EasyDict
+from utils import to_minutes, to_timestamps, format_date_time
+
+FRAMES = {}  # Timeframes loaded or resampled in this process, by data file and timeframe
+MAX_FRAMES = 16  # Oldest frames are dropped beyond this
+MINUTE = 60 * 10**9  # Nanoseconds in a minute
+ORIGIN = pd.Timestamp("1970-01-05")  # A Monday, so weekly bars start on Mondays like the exchange exports
+
+
+class AlignedView:
+    """No-lookahead view of a timeframe indexed by the high timeframe bar.
+
+    The bar visible at high bar i is the last bar of the timeframe that has closed by the close of
+    high bar i. The offsets are computed once, on first access, so the hot loop only indexes arrays.
+    """
+
+    def __init__(self, data: pd.DataFrame, minutes: int, high_csv: pd.DataFrame, high_minutes: int):
+        self.data = data
+        self.minutes = minutes
+        self.high_csv = high_csv
+        self.high_minutes = high_minutes
+        self._offsets = None
+        self._columns = {}
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """Index of the last closed bar of the timeframe at every high timeframe bar, -1 if none"""
+        if self._offsets is None:
+            close_time = to_timestamps(self.data["datetime"]) + self.minutes * MINUTE
+            high_close_time = to_timestamps(self.high_csv["datetime"]) + self.high_minutes * MINUTE
+            self._offsets = np.searchsorted(close_time, high_close_time, side="right") - 1
+        return self._offsets
+
+    def column(self, column: str) -> np.ndarray:
+        if column not in self._columns:
+            self._columns[column] = self.data[column].to_numpy()
+        return self._columns[column]
+
+    def index(self, high_pointer: int, lag: int = 0) -> int:
+        """Row of the timeframe visible at the high timeframe bar, lag bars back"""
+        row = self.offsets[high_pointer] - lag
+        if row < 0:
+            raise IndexError(f"No closed {self.minutes}m bar {lag} bars before high bar {high_pointer}")
+        return row
+
+    def at(self, high_pointer: int, column: str, lag: int = 0):
+        """Value of a column of the timeframe visible at the high timeframe bar, lag bars back"""
+        return self.column(column)[self.index(high_pointer, lag)]
+
+    def row(self, high_pointer: int, lag: int = 0) -> pd.Series:
+        """Row of the timeframe visible at the high timeframe bar, lag bars back"""
+        return self.data.iloc[self.index(high_pointer, lag)]
+
+
+def resample(data: pd.DataFrame, minutes: int) -> pd.DataFrame:
+    """Resample OHLCV data to a coarser timeframe
+
+    Args:
+        data (pd.DataFrame): OHLCV data with the datetime column
+        minutes (int): Timeframe to resample to in minutes
+
+    Returns:
+        pd.DataFrame: Resampled data, datetime in the same representation as the input
+    """
+    index = pd.DatetimeIndex(to_timestamps(data["datetime"]).view("datetime64[ns]"))
+    aggregations = {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"}
+    aggregations = {column: how for column, how in aggregations.items() if column in data.columns}
+    resampled = (
+        data.drop(columns=["datetime"])
+        .set_axis(index)
+        .resample(f"{minutes}min", origin=ORIGIN)
+        .agg(aggregations)
+        .dropna(subset=["close"])
+    )
+    timestamps = resampled.index.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    if pd.api.types.is_integer_dtype(data["datetime"]):
+        datetimes = timestamps
+    else:
+        datetimes = [format_date_time(timestamp) for timestamp in timestamps]
+    return resampled.reset_index(drop=True).assign(datetime=datetimes)[["datetime", *aggregations]]
+
+
+def load_timeframe(config: EasyDict, timeframe: str) -> pd.DataFrame:
+    """Load a timeframe from its data file, or resample it from the finest file that divides it
+
+    Args:
+        config (EasyDict): Config object containing the data file paths
+        timeframe (str): Timeframe in 1d, 1h, 1m format
+
+    Returns:
+        pd.DataFrame: Data of the timeframe
+    """
+    DATA_DIR = Path(config.data.path)
+    minutes = to_minutes(timeframe)
+    file_name = config.data.files.get(timeframe)
+    if file_name and (DATA_DIR / file_name).exists():
+        key = _frame_key(DATA_DIR / file_name, timeframe)
+        if key not in FRAMES:
+            _remember(key, pd.read_csv(DATA_DIR / file_name))
+        return FRAMES[key]
+
+    sources = [
+        (to_minutes(name), name)
+        for name, file_name in config.data.files.items()
+        if (DATA_DIR / file_name).exists() and minutes % to_minutes(name) == 0 and to_minutes(name) < minutes
+    ]
+    if not sources:
+        raise FileNotFoundError(f"No data file to load or resample the {timeframe} timeframe from")
+    _, source = min(sources)
+    key = _frame_key(DATA_DIR / config.data.files[source], timeframe)
+    if key not in FRAMES:
+        _remember(key, resample(load_timeframe(config, source), minutes))
+    return FRAMES[key]
+
+
+def _remember(key: tuple, frame: pd.DataFrame):
+    while len(FRAMES) >= MAX_FRAMES:
+        del FRAMES[next(iter(FRAMES))]
+    FRAMES[key] = frame
+
+
+def _frame_key(file_path: Path, timeframe: str) -> tuple:
+    """Key of a timeframe read or resampled from a data file, with its modification time so edited files are reloaded"""
+    return str(file_path.resolve()), os.stat(file_path).st_mtime_ns, timeframe
+
+
+def aligned_views(config: EasyDict, timeframes: List[str], high_csv: pd.DataFrame) -> Dict[str, AlignedView]:
+    """No-lookahead views of the timeframes a strategy declares, aligned to the high timeframe
+
+    Args:
+        config (EasyDict): Config object containing the data file paths
+        timeframes (List[str]): Timeframes in 1d, 1h, 1m format
+        high_csv (pd.DataFrame): High timeframe data
+
+    Returns:
+        Dict[str, AlignedView]: View of every timeframe
+    """
+    high_minutes = to_minutes(config.backtester.high_time)
+    return {
+        timeframe: AlignedView(load_timeframe(config, timeframe), to_minutes(timeframe), high_csv, high_minutes)
+        for timeframe in timeframes
+    }
@@ -1,12 +1,25 @@
+import io
+import hashlib
+import pickle
 import yaml
 from easydict import EasyDict
 import pandas as pd
+import numpy as np
 from pathlib import Path
-from typing import Tuple
+from typing import Callable, List, Tuple
 from datetime import datetime,timedelta
 from time import perf_counter
 
 CACHE = {}
+EPOCH = datetime(1970, 1, 1)
+LEAN_COLUMNS = ["datetime", "close"]  # Columns of the low timeframe data read by the engine
+INTRABAR_COLUMNS = ["open", "high", "low", "close"]  # Columns read by the intrabar fills
+SIGNAL_FILE_COLUMNS = ["open", "high", "low", "close", "volume"]  # Columns of the bars logged to the signal file
+FILLS = ("close", "intrabar")  # Exits checked against the close, or the high and low, of every low timeframe bar
+TIE_BREAKS = ("sl", "tp", "open")  # Exit of an intrabar bar touching both the target and a stop
+COARSE_MARGIN = 1e-9  # Relative margin of the levels when skipping blocks of low timeframe bars
+FLOAT32_TOLERANCE = 1e-6  # Max relative error allowed when storing prices as float32
+TAIL_CHECK_BYTES = 4096  # Bytes before the cached end that must be unchanged to reuse the cache
 
 
 def get_cfg(file_path: str = "config.yaml") -> EasyDict:
@@ -41,12 +54,13 @@ def _load_cfg(file_path: str = "config.yaml") -> EasyDict | None:
 
 
 def load_high_low(
-    config: EasyDict
+    config: EasyDict, signal_file: bool = False
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """Load the high and low timeframe dataframes
 
     Args:
         config (EasyDict): Config object containing the data file paths and strategy parameters
+        signal_file (bool, optional): A signal file is written, the lean loader keeps the OHLCV columns it logs. Defaults to False.
 
     Returns:
         Tuple (pd.DataFrame, pd.DataFrame): DataFrames containing the high and low timeframe data
@@ -54,16 +68,122 @@ def load_high_low(
     high_time = config.backtester.high_time
     low_time = to_minutes(config.backtester.low_time)
     DATA_DIR = Path(config.data.path)
+    cache_dir = config.data.get("cache")
+
+    def read(file_path: Path, reader: Callable = pd.read_csv, key: tuple = ("csv",)) -> pd.DataFrame:
+        if cache_dir:
+            return load_cached(file_path, cache_dir, reader, key)
+        return reader(file_path)
 
     load_time = perf_counter()
-    high_csv = pd.read_csv(DATA_DIR / config.data.files[config.backtester.high_time])
+    high_csv = read(DATA_DIR / config.data.files[config.backtester.high_time])
     # print(f"High CSV loaded in {perf_counter() - load_time:.4f} seconds")
     load_time = perf_counter()
-    low_csv = pd.read_csv(DATA_DIR / config.data.files[config.backtester.low_time])
+    lean = config.data.get("lean", {})
+    if lean.get("enabled", False):
+        columns = lean.get("columns", LEAN_COLUMNS)
+        if config.backtester.get("fills", "close") == "intrabar":
+            columns = [*columns, *INTRABAR_COLUMNS]
+        if signal_file:
+            columns = [*columns, *SIGNAL_FILE_COLUMNS]
+        float32 = lean.get("float32", False)
+        tolerance = lean.get("float32_tolerance", FLOAT32_TOLERANCE)
+        low_csv = read(
+            DATA_DIR / config.data.files[config.backtester.low_time],
+            lambda file_path: load_lean(file_path, columns, float32, tolerance),
+            ("lean", tuple(columns), float32, tolerance),
+        )
+    else:
+        low_csv = read(DATA_DIR / config.data.files[config.backtester.low_time])
     # print(f"Low CSV loaded in {perf_counter() - load_time:.4f} seconds")
     return high_csv, low_csv
 
-def handle_date_time(date_time: str) -> datetime:
+def load_cached(
+    file_path: Path, cache_dir: str, reader: Callable = pd.read_csv, key: tuple = ("csv",)
+) -> pd.DataFrame:
+    """Load a csv through a pickle cache, parsing only the rows appended since it was cached
+
+    The data files are append-only: the cache is reused when the bytes just before its end are
+    unchanged, and only the complete lines after it are parsed and appended. Otherwise the
+    whole file is parsed again. Every reader has its own cache file, named after its key.
+
+    Args:
+        file_path (Path): Path to the csv file
+        cache_dir (str): Directory of the cache files
+        reader (Callable, optional): Parser of a csv file or buffer. Defaults to pd.read_csv.
+        key (tuple, optional): Parameters of the reader, which give the same frame for the same key. Defaults to ("csv",).
+
+    Returns:
+        pd.DataFrame: DataFrame of the whole file
+    """
+    file_path = Path(file_path)
+    key = repr(key)
+    cache_path = Path(cache_dir) / f"{file_path.name}.{hashlib.sha1(key.encode()).hexdigest()[:12]}.pkl"
+    with open(file_path, "rb") as stream:
+        content = stream.read()
+    # Only complete lines are ingested, a row being written is picked up by the next load
+    end = content.rfind(b"\n") + 1 or len(content)
+
+    cached = None
+    if cache_path.exists():
+        with open(cache_path, "rb") as stream:
+            cached = pickle.load(stream)
+        check_start = max(cached["size"] - TAIL_CHECK_BYTES, 0)
+        check = hashlib.sha1(content[check_start : cached["size"]]).hexdigest()
+        if cached.get("key") != key or cached["size"] > end or check != cached["check"]:
+            cached = None
+
+    if cached is None:
+        csv = reader(io.BytesIO(content[:end]))
+    elif cached["size"] == end:
+        return cached["csv"]
+    else:
+        header = content[: content.find(b"\n") + 1]
+        tail = reader(io.BytesIO(header + content[cached["size"] : end]))
+        csv = pd.concat([cached["csv"], tail], ignore_index=True)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, "wb") as stream:
+        check = hashlib.sha1(content[max(end - TAIL_CHECK_BYTES, 0) : end]).hexdigest()
+        pickle.dump({"key": key, "size": end, "check": check, "csv": csv}, stream)
+    return csv
+
+
+def load_lean(
+    file_path: Path,
+    columns: List[str] = LEAN_COLUMNS,
+    float32: bool = False,
+    tolerance: float = FLOAT32_TOLERANCE,
+) -> pd.DataFrame:
+    """Load a timeframe csv keeping only the given columns, with int64 timestamps
+
+    Args:
+        file_path (Path): Path to the csv file
+        columns (List[str], optional): Columns to keep. Defaults to LEAN_COLUMNS.
+        float32 (bool, optional): Store the prices as float32. Defaults to False.
+        tolerance (float, optional): Max relative error of the float32 prices. Defaults to FLOAT32_TOLERANCE.
+
+    Returns:
+        pd.DataFrame: DataFrame with the datetime column as int64 nanoseconds since epoch
+    """
+    columns = list(dict.fromkeys(["datetime", *columns]))
+    price_columns = [column for column in columns if column != "datetime"]
+    csv = pd.read_csv(file_path, usecols=columns, dtype={column: np.float64 for column in price_columns})
+    csv["datetime"] = to_timestamps(csv["datetime"])
+    if float32:
+        for column in price_columns:
+            values = csv[column].to_numpy()
+            compact = values.astype(np.float32)
+            if np.any(np.abs(compact - values) > tolerance * np.abs(values)):
+                raise ValueError(f"Column {column} of {file_path} does not fit in float32 within {tolerance}")
+            csv[column] = compact
+    return csv[columns]
+
+
+def handle_date_time(date_time: str | int) -> datetime:
+    if isinstance(date_time, (int, np.integer)):
+        # int64 nanosecond timestamps of the lean loader
+        return EPOCH + timedelta(microseconds=int(date_time) // 1000)
     try:
         # Try parsing with microseconds
         date_object = datetime.strptime(date_time, "%Y-%m-%d %H:%M:%S.%f")
@@ -77,6 +197,66 @@ def handle_date_time(date_time: str) -> datetime:
     return date_object
 
 
+def format_date_time(date_time: str | int) -> str:
+    """Format a timestamp of the lean loader like the csv files, strings are returned as is
+
+    Args:
+        date_time (str | int): Datetime string or int64 nanoseconds since epoch
+
+    Returns:
+        str: Datetime string
+    """
+    if not isinstance(date_time, (int, np.integer)):
+        return date_time
+    date_object = handle_date_time(date_time)
+    if date_object.microsecond:
+        return date_object.isoformat(" ", "milliseconds")
+    return date_object.isoformat(" ", "seconds")
+
+
+def to_timestamps(date_times: pd.Series) -> np.ndarray:
+    """Convert a datetime column to int64 nanosecond timestamps
+
+    Args:
+        date_times (pd.Series): Datetime column, either strings or int64 timestamps
+
+    Returns:
+        np.ndarray: int64 nanoseconds since epoch
+    """
+    if pd.api.types.is_integer_dtype(date_times):
+        return date_times.to_numpy(dtype=np.int64)
+    return pd.to_datetime(date_times, format="mixed").to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def index_range(
+    high_csv: pd.DataFrame, entry_date: datetime = None, exit_date: datetime = None
+) -> Tuple[int, int]:
+    """Get the high timeframe index range to be backtested
+
+    Args:
+        high_csv (pd.DataFrame): High timeframe data
+        entry_date (datetime, optional): Entry date for the trade. Defaults to None.
+        exit_date (datetime, optional): Exit date for the trade. Defaults to None.
+
+    Returns:
+        Tuple (int, int): First and last index of the high timeframe data
+    """
+    entry_index = 0
+    exit_index = len(high_csv) - 1
+    if entry_date:
+        entry_index = high_csv[
+            pd.to_datetime(high_csv["datetime"]) >= entry_date
+        ].index[0]
+    if exit_date:
+        if pd.to_datetime(high_csv["datetime"].iloc[-1]) <= exit_date:
+            exit_index = len(high_csv) - 1
+        else:
+            exit_index = (
+                high_csv[pd.to_datetime(high_csv["datetime"]) > exit_date].index[0] - 1
+            )
+    return entry_index, exit_index
+
+
 def day_low_csv(low_pointer: int, low_csv: pd.DataFrame) -> datetime:
     """Get the day of the low timeframe data
 
@@ -175,7 +355,8 @@ def generate_csv(
     high_csv: pd.DataFrame,
     signal_csv: pd.DataFrame,
     signal_type: str,
-    time_to_open: datetime
+    time_to_open: datetime,
+    price: float = None,
 ):
     """Generate the Signal CSV
 
@@ -186,6 +367,7 @@ def generate_csv(
         low_csv (pd.DataFrame): low timeframe data
         high_csv (pd.DataFrame): high timeframe data
         signal_csv (pd.DataFrame): DataFrame to log the signal details
+        price (float, optional): Executed price logged as the close, the metrics trade at it. Defaults to the close of the bar.
     """
     if csv_value == 0:
         data = low_csv.iloc[ptr]
@@ -194,11 +376,11 @@ def generate_csv(
     log = {
         # "datetime": data["datetime"],
         "datetime": time_to_open,
-        "open": data["open"],
-        "high": data["high"],
-        "low": data["low"],
-        "close": data["close"],
-        "volume": data["volume"],
+        "open": data.get("open", np.nan),
+        "high": data.get("high", np.nan),
+        "low": data.get("low", np.nan),
+        "close": data["close"] if price is None else price,
+        "volume": data.get("volume", np.nan),
         "signals": signal,
         "signal_type": signal_type,
     }
@@ -212,7 +394,7 @@ def tpsl(
     high_csv: pd.DataFrame,
     margin: float,
     leverage: int,
-    glob: EasyDict,
+    glob: "EngineState",
     trailing=False,
 ) -> Tuple[int, int]:
     """Function to check the target price and stop loss conditions
@@ -222,7 +404,7 @@ def tpsl(
         low_csv (pd.DataFrame): DataFrame containing the low timeframe data
         margin (float): Margin for the trade
         leverage (int): Leverage for the trade
-        glob (EasyDict): Global variables containing the trade details
+        glob (EngineState): State of the trade, its trailing price is updated
         trailing (bool, optional): Is the Stop loss trailing. Defaults to False.
 
     Returns:
@@ -270,6 +452,307 @@ def tpsl(
     # print("Ending TPSL check at ", low_csv["datetime"].iloc[index])
     return 0, 0
 
+
+def intrabar_exits(
+    opens: np.ndarray,
+    highs: np.ndarray,
+    lows: np.ndarray,
+    entry_price: float,
+    status: int,
+    tp: np.ndarray,
+    sl: np.ndarray,
+    trailing: np.ndarray,
+    leverage: np.ndarray,
+    margin: float,
+    trailing_price: float = None,
+    tie_break: str = "sl",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """First bar whose range touches the target, stop, trailing stop or margin price for each parameter set
+
+    A touched level fills at the level, or at the open when the bar gaps through it. The order of
+    the high and the low inside a bar is unknown, so a bar's own extreme moves the trailing stop
+    from the next bar on, and a bar touching both the target and a stop exits by tie_break: sl,
+    tp, or open for the level nearer to the open.
+
+    Args:
+        opens (np.ndarray): Open prices of the low timeframe bars of the window
+        highs (np.ndarray): High prices of the bars
+        lows (np.ndarray): Low prices of the bars
+        entry_price (float): Entry price of the position
+        status (int): 1 long and -1 short
+        tp (np.ndarray): Target price percentage of every parameter set
+        sl (np.ndarray): Stop loss percentage of every parameter set
+        trailing (np.ndarray): Is the stop loss trailing, for every parameter set
+        leverage (np.ndarray): Leverage of every parameter set
+        margin (float): Margin for the trade
+        trailing_price (float, optional): Extreme price of the position before the window. Defaults to the entry price.
+        tie_break (str, optional): Exit of a bar touching both levels, one of TIE_BREAKS. Defaults to "sl".
+
+    Returns:
+        Tuple (np.ndarray, np.ndarray): Offset of the first exit in the window for each parameter set, -1 if
+        nothing is touched, and its fill price
+    """
+    tp, sl, leverage = (np.asarray(values, dtype=np.float64).reshape(-1, 1) for values in (tp, sl, leverage))
+    trailing = np.asarray(trailing, dtype=bool).reshape(-1, 1)
+    if len(opens) == 0:
+        return np.full(len(tp), -1, dtype=np.int64), np.full(len(tp), np.nan)
+    favourable, adverse = (highs, lows) if status == 1 else (lows, highs)
+    accumulate = np.maximum.accumulate if status == 1 else np.minimum.accumulate
+    start = entry_price if trailing_price is None else trailing_price
+    extreme = accumulate(np.concatenate(([start], favourable)))[:-1]  # Before each bar
+
+    # Prices are multiplied by the status so that the comparisons of a short read as those of a long
+    target = status * (entry_price + status * entry_price * tp)
+    stop = np.maximum(
+        status * (entry_price - status * entry_price * sl),
+        status * (entry_price - status * margin / leverage * entry_price),
+    )
+    stop = np.where(trailing, np.maximum(stop, status * (extreme - status * extreme * sl)), stop)
+    offsets, prices = first_touch(status * opens, status * favourable, status * adverse, target, stop, tie_break)
+    return offsets, status * prices
+
+
+def first_touch(
+    opens: np.ndarray,
+    favourable: np.ndarray,
+    adverse: np.ndarray,
+    target: np.ndarray,
+    stop: np.ndarray,
+    tie_break: str = "sl",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """First bar of every row touching its target or its stop, with the fill price
+
+    The prices are multiplied by the side of the position, so that the comparisons of a short
+    read as those of a long. The arguments broadcast to (rows, bars).
+
+    Args:
+        opens (np.ndarray): Open prices of the bars
+        favourable (np.ndarray): Highs of a long, lows of a short
+        adverse (np.ndarray): Lows of a long, highs of a short
+        target (np.ndarray): Target price
+        stop (np.ndarray): Tightest of the stops
+        tie_break (str, optional): Exit of a bar touching both levels, one of TIE_BREAKS. Defaults to "sl".
+
+    Returns:
+        Tuple (np.ndarray, np.ndarray): Offset of the first touch of every row, -1 if nothing is
+        touched, and its fill price, still multiplied by the side
+    """
+    opens, favourable, adverse, target, stop = np.broadcast_arrays(opens, favourable, adverse, target, stop)
+    touch_target = favourable >= target
+    touch_stop = adverse <= stop
+    if tie_break == "sl":
+        prefer_target = np.zeros_like(touch_target)
+    elif tie_break == "tp":
+        prefer_target = np.ones_like(touch_target)
+    elif tie_break == "open":
+        prefer_target = np.abs(opens - target) < np.abs(opens - stop)
+    else:
+        raise ValueError(f"tie_break should be one of {TIE_BREAKS}, got {tie_break}")
+    gap_target, gap_stop = opens >= target, opens <= stop
+    exit_target = gap_target | (~gap_stop & touch_target & (~touch_stop | prefer_target))
+    hit = touch_target | touch_stop
+
+    offsets = np.full(hit.shape[0], -1, dtype=np.int64)
+    prices = np.full(hit.shape[0], np.nan)
+    if hit.shape[1] == 0:
+        return offsets, prices
+    first = hit.argmax(axis=1)
+    rows = np.arange(len(first))
+    found = hit[rows, first]
+    price = np.where(
+        exit_target[rows, first],
+        np.maximum(target[rows, first], opens[rows, first]),
+        np.minimum(stop[rows, first], opens[rows, first]),
+    )
+    offsets[found] = first[found]
+    prices[found] = price[found]
+    return offsets, prices
+
+
+def tpsl_intrabar(
+    low_pointer: int,
+    high_pointer: int,
+    low_csv: pd.DataFrame,
+    low_ns: np.ndarray,
+    high_ns: np.ndarray,
+    margin: float,
+    leverage: int,
+    glob: "EngineState",
+    trailing=False,
+    tie_break: str = "sl",
+) -> Tuple[int, int, float]:
+    """tpsl against the high and low of every low timeframe bar, see intrabar_exits
+
+    Args:
+        low_pointer (int): Pointer to the low timeframe data
+        high_pointer (int): Pointer to the high timeframe bar, the window ends at the next one
+        low_csv (pd.DataFrame): Low timeframe data with the open, high and low columns
+        low_ns (np.ndarray): Timestamps of the low timeframe data
+        high_ns (np.ndarray): Timestamps of the high timeframe data
+        margin (float): Margin for the trade
+        leverage (int): Leverage for the trade
+        glob (EngineState): State of the trade, its trailing price is updated
+        trailing (bool, optional): Is the Stop loss trailing. Defaults to False.
+        tie_break (str, optional): Exit of a bar touching both levels, one of TIE_BREAKS. Defaults to "sl".
+
+    Returns:
+        Tuple: (int, int, float)
+        - 1 if the condition is satisfied, 0 otherwise
+        - Index at which the condition is satisfied
+        - Fill price
+    """
+    missing = [column for column in INTRABAR_COLUMNS if column not in low_csv]
+    if missing:
+        raise ValueError(f"Intrabar fills need the {missing} columns of the low timeframe data")
+    end = len(low_csv) if high_pointer + 1 == len(high_ns) else int(np.searchsorted(low_ns, high_ns[high_pointer + 1]))
+    window = slice(int(low_pointer), max(end, int(low_pointer)))
+    highs = low_csv["high"].to_numpy(dtype=np.float64)[window]
+    lows = low_csv["low"].to_numpy(dtype=np.float64)[window]
+    offsets, prices = intrabar_exits(
+        low_csv["open"].to_numpy(dtype=np.float64)[window],
+        highs,
+        lows,
+        glob.entry_price,
+        glob.status,
+        [glob.tp],
+        [glob.sl],
+        [trailing],
+        [leverage],
+        margin,
+        glob.trailing_price,
+        tie_break,
+    )
+    offset = offsets[0]
+    favourable = highs if glob.status == 1 else lows
+    seen = favourable[: offset + 1] if offset >= 0 else favourable
+    if len(seen):
+        extreme = seen.max() if glob.status == 1 else seen.min()
+        glob.trailing_price = max(glob.trailing_price, extreme) if glob.status == 1 else min(glob.trailing_price, extreme)
+    if offset < 0:
+        return 0, 0, np.nan
+    return 1, window.start + int(offset), float(prices[0])
+
+
+def coarse_levels(low_csv: pd.DataFrame, high_csv: pd.DataFrame, block: int) -> EasyDict:
+    """Highest and lowest close of every block of low timeframe bars, read by tpsl_coarse
+
+    The blocks are runs of block consecutive rows rather than calendar bars, so their extremes
+    bound exactly the closes tpsl reads whatever the gaps of the data. With block the number of
+    low bars in 1h or 4h they are the close-only 1h or 4h bars.
+
+    Args:
+        low_csv (pd.DataFrame): Low timeframe data
+        high_csv (pd.DataFrame): High timeframe data
+        block (int): Low timeframe bars per block
+
+    Returns:
+        EasyDict: The block size, the closes, the block extremes and the timestamps of both timeframes
+    """
+    closes = low_csv["close"].to_numpy(dtype=np.float64)
+    blocks = closes[: len(closes) // block * block].reshape(-1, block)
+    return EasyDict(
+        block=block,
+        closes=closes,
+        high=blocks.max(axis=1),
+        low=blocks.min(axis=1),
+        low_ns=to_timestamps(low_csv["datetime"]),
+        high_ns=to_timestamps(high_csv["datetime"]),
+    )
+
+
+def _scan_closes(closes: np.ndarray, glob: "EngineState", target_price: float, stop_loss: float, margin_price: float, trailing: bool) -> int:
+    """The loop of tpsl over a run of closes in NumPy, same formulas and same trailing price
+
+    Returns:
+        int: Offset of the first hit, -1 if nothing is hit
+    """
+    accumulate = np.maximum.accumulate if glob.status == 1 else np.minimum.accumulate
+    trailing_price = accumulate(np.concatenate(([glob.trailing_price], closes)))[1:]
+    trailing_stop_loss = trailing_price - glob.status * trailing_price * glob.sl
+    if glob.status == 1:
+        hit = (target_price <= closes) | (stop_loss >= closes) | (trailing & (trailing_stop_loss >= closes)) | (margin_price >= closes)
+    else:
+        hit = (target_price >= closes) | (stop_loss <= closes) | (trailing & (trailing_stop_loss <= closes)) | (margin_price <= closes)
+    offset = int(hit.argmax()) if hit.any() else -1
+    glob.trailing_price = trailing_price[offset]
+    return offset
+
+
+def tpsl_coarse(
+    low_pointer: int,
+    high_pointer: int,
+    coarse: EasyDict,
+    margin: float,
+    leverage: int,
+    glob: "EngineState",
+    trailing=False,
+) -> Tuple[int, int]:
+    """tpsl that only scans the low timeframe bars of the blocks able to reach a level
+
+    A block is skipped when its highest and lowest close reach neither the target nor the
+    tightest stop, the trailing stop taken at the extreme the block could reach, with a small
+    margin against rounding. The first hit, its index and the trailing price are those of tpsl.
+
+    Args:
+        low_pointer (int): Pointer to the low timeframe data
+        high_pointer (int): Pointer to the high timeframe bar, the window ends at the next one
+        coarse (EasyDict): Block extremes from coarse_levels
+        margin (float): Margin for the trade
+        leverage (int): Leverage for the trade
+        glob (EngineState): State of the trade, its trailing price is updated
+        trailing (bool, optional): Is the Stop loss trailing. Defaults to False.
+
+    Returns:
+        Tuple: (int, int)
+        - 1 if the condition is satisfied, 0 otherwise
+        - Index at which the condition is satisfied
+    """
+    status, block, closes = glob.status, coarse.block, coarse.closes
+    start = int(low_pointer)
+    end = len(closes) if high_pointer + 1 == len(coarse.high_ns) else int(np.searchsorted(coarse.low_ns, coarse.high_ns[high_pointer + 1]))
+    target_price = glob.entry_price + status * glob.entry_price * glob.tp
+    stop_loss = glob.entry_price - status * glob.entry_price * glob.sl
+    margin_price = glob.entry_price - status * margin / leverage * glob.entry_price
+
+    first_block, last_block = -(-start // block), end // block  # Blocks entirely in the window
+    segments = [(start, end)]
+    if first_block < last_block:
+        # Prices multiplied by the status, so that a short reads as a long
+        if status == 1:
+            favourable, adverse = coarse.high[first_block:last_block], coarse.low[first_block:last_block]
+        else:
+            favourable, adverse = -coarse.low[first_block:last_block], -coarse.high[first_block:last_block]
+        head = status * closes[start : first_block * block]
+        extreme = np.maximum.accumulate(np.concatenate(([status * glob.trailing_price, head.max(initial=-np.inf)], favourable)))[2:]
+        extreme = status * extreme
+        stop = max(status * stop_loss, status * margin_price)
+        if trailing:
+            stop = np.maximum(stop, status * (extreme - status * extreme * glob.sl))
+        reach = (favourable >= status * target_price - COARSE_MARGIN * abs(target_price)) | (
+            adverse <= stop + COARSE_MARGIN * np.abs(stop)
+        )
+        segments = [(start, first_block * block)]
+        segments += [(k * block, (k + 1) * block) for k in first_block + np.flatnonzero(reach)]
+        segments += [(last_block * block, end)]
+
+    done = start
+    extremes = coarse.high if status == 1 else coarse.low
+    for segment_start, segment_end in segments:
+        if segment_end <= segment_start:
+            continue
+        if segment_start > done:
+            # Skipped blocks still move the trailing price
+            skipped = extremes[done // block : segment_start // block]
+            glob.trailing_price = max(glob.trailing_price, skipped.max()) if status == 1 else min(glob.trailing_price, skipped.min())
+        offset = _scan_closes(closes[segment_start:segment_end], glob, target_price, stop_loss, margin_price, trailing)
+        if offset >= 0:
+            return 1, segment_start + offset
+        done = segment_end
+    if end > done:
+        skipped = extremes[done // block : end // block]
+        glob.trailing_price = max(glob.trailing_price, skipped.max()) if status == 1 else min(glob.trailing_price, skipped.min())
+    return 0, 0
+
 def to_minutes(time: str) -> int:
     """Convert the time to minutes
 
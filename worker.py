@@ -1,26 +1,100 @@
+import os
+import copy
+import json
 import pandas as pd
-from utils import load_high_low, get_cfg, convert_to_open_timings
+from pathlib import Path
+from typing import Tuple
+from utils import load_high_low, get_cfg, coarse_levels, convert_to_open_timings, handle_date_time, to_minutes, format_date_time
 from easydict import EasyDict
+from range_index import range_index
 from backtesting_ps_code import generate_signals, check_signal_file
-from strategy import EMAStrategy, ButterChebyStrategy
-from metrics import compute_metrics
+from positions import generate_positions
+from strategy import get_strategy
+from metrics import compute_metrics, MetricsAccumulator
+from data_quality import open_time_table
+from engine import EngineConfig, config_digest
+from incremental import load_state, save_state, checkpoint_path
 from datetime import datetime
 from pprint import pprint
 from time import perf_counter
+from functools import wraps
 
 
+# Kept across the runs of a process, so a daemon or a pool worker loads the data and computes the
+# indicators once per data config instead of once per run
+DATASETS = {}
+INDICATORS = {}
+RANGE_INDEXES = {}
+MAX_DATASETS = 4  # Oldest data configs are dropped beyond this
+
 
 def time_taken(func):
+    @wraps(func)
     def wrapper(*args, **kwargs):
         start = perf_counter()
-        func(*args, **kwargs)
+        result = func(*args, **kwargs)
         end = perf_counter()
         print(f"Time taken: {end-start}")
+        return result
     return wrapper
 
 
+def _data_key(config: EasyDict) -> str:
+    """Data config of a run, with the modification time of its files so edited files are reloaded"""
+    DATA_DIR = Path(config.data.path)
+    timeframes = [config.backtester.high_time, config.backtester.low_time]
+    files = [DATA_DIR / config.data.files[timeframe] for timeframe in timeframes]
+    return json.dumps(
+        [config.data, timeframes, [os.stat(file_path).st_mtime_ns for file_path in files]], sort_keys=True
+    )
+
+
+def load_data(config: EasyDict) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """High and low timeframe data of a run, limited to its dates
+
+    Args:
+        config (EasyDict): Configuration for the backtesting
+
+    Returns:
+        Tuple (pd.DataFrame, pd.DataFrame): High and low timeframe data, the high one is a copy the strategy may add columns to
+    """
+    key = _data_key(config)
+    if key not in DATASETS:
+        high_csv, low_csv = load_high_low(config)
+        entry_time = handle_date_time(config.data.start_date)
+        exit_time = handle_date_time(config.data.end_date)
+        low_csv = low_csv[(low_csv["datetime"].apply(handle_date_time) >= entry_time) & (low_csv["datetime"].apply(handle_date_time) <= exit_time)]
+        low_csv = low_csv.reset_index(drop=True)
+        # Indicators only depend on past bars, so the bars after the end date are not needed
+        high_csv = high_csv[pd.to_datetime(high_csv["datetime"], format="mixed") <= exit_time]
+        while len(DATASETS) >= MAX_DATASETS:
+            dropped = next(iter(DATASETS))
+            del DATASETS[dropped]
+            INDICATORS.pop(dropped, None)
+            RANGE_INDEXES.pop(dropped, None)
+        DATASETS[key] = (high_csv, low_csv)
+    high_csv, low_csv = DATASETS[key]
+    return high_csv.copy(), low_csv
+
+
+def load_range_index(config: EasyDict, high_csv: pd.DataFrame, low_csv: pd.DataFrame) -> EasyDict:
+    """Segment trees of the data of a run, built or loaded once per data config like the data"""
+    key = _data_key(config)
+    if key not in RANGE_INDEXES:
+        RANGE_INDEXES[key] = range_index(low_csv, high_csv, config.backtester.range_index.get("dir"))
+    return RANGE_INDEXES[key]
+
+
 @time_taken
-def backtest(config: EasyDict):
+def backtest(config: EasyDict) -> pd.Series:
+    """Run one backtest with the given configuration
+
+    Args:
+        config (EasyDict): Configuration for the backtesting
+
+    Returns:
+        pd.Series: Metrics of the run, with the early stop reason if it was stopped
+    """
     trade_sheet = pd.DataFrame(
         columns=[
             "date_time",
@@ -37,54 +111,99 @@ def backtest(config: EasyDict):
         columns=["datetime", "open", "high", "low", "close", "volume", "signals","signal_type"],
     )
 
-    high_csv, low_csv, low_time = load_high_low(get_cfg())
-
-    GLOB = EasyDict(
-        tp=get_cfg().backtester.tp,  # Target Price Percentage
-        sl=get_cfg().backtester.sl,  # Stop Loss Percentage
-        entry_price=1,
-        trailing_price=0,  # Trailing Price of the current position of the trade (used for the calculation of trailing stop loss)
-        date_time=high_csv.loc[
-            0, "datetime"
-        ],  # Intialzing the start date of the backtesting
-        status=0,  # Initialing the status as 0 (no position currently)
-        total_fee=0,
-        trades=0,
-    )
+    settings = EngineConfig.from_config(config)
+    high_csv, low_csv = load_data(config)
+    GLOB = settings.state(high_csv.loc[0, "datetime"])
 
-    strat = ButterChebyStrategy(high_csv, low_csv, get_cfg(), GLOB)
+    accumulator = MetricsAccumulator(settings.capital)
+    checkpointing = config.backtester.get("checkpoint", {})
+    trees = config.backtester.get("range_index", {})
+    resume = None
+    if checkpointing.get("enabled", False):
+        # A run terminated by the orchestrator continues from its last checkpoint
+        checkpoint_file = checkpoint_path(checkpointing.dir, config)
+        resume = load_state(checkpoint_file, config, moving_end=False)
+    if resume is not None:
+        GLOB = copy.copy(resume.glob)
+        trade_sheet, signal_csv = resume.trade_sheet, resume.signal_csv
+        accumulator.__dict__.update(resume.metrics.__dict__)
 
-    generate_signals(
+    # Indicators of the same data and strategy config are reused, only the trading values differ
+    data_key = _data_key(config)
+    Strategy = get_strategy(config.backtester.strategy)
+    indicator_key = json.dumps([config.strategies, Strategy.__name__], sort_keys=True)
+    indicators = resume.indicators if resume else INDICATORS.get(data_key, {}).get(indicator_key)
+    strat = Strategy(high_csv, low_csv, config, GLOB, indicators)
+    INDICATORS.setdefault(data_key, {})[indicator_key] = strat.high_csv[strat.indicator_columns].copy()
+    checkpoint = None
+    if checkpointing.get("enabled", False):
+        checkpoint = lambda state: save_state(
+            checkpoint_file, state, strat, trade_sheet, signal_csv, config, moving_end=False
+        )
+    early_stop = config.backtester.early_stop if config.backtester.early_stop.enabled else None
+    positions = config.backtester.get("positions", {})
+    if settings.max_open > 1:
+        # Pyramiding runs on the position book, which logs a trade book instead of the signal file
+        state = generate_positions(
+            strat,
+            GLOB,
+            high_csv,
+            low_csv,
+            **settings.engine_kwargs(),
+            **settings.position_kwargs(),
+            metrics=accumulator,
+            early_stop=early_stop,
+        )
+        result = accumulator.result()
+        if config.backtester.print_metrics:
+            pprint(result)
+        result["stopped"] = state.stopped
+        if positions.get("trade_book_dir"):
+            # Named after the config like the checkpoints, so the runs of a sweep do not share one
+            book_file = Path(positions.trade_book_dir) / f"{config_digest(config)[:16]}.csv"
+            book_file.parent.mkdir(parents=True, exist_ok=True)
+            state.trade_book.assign(date_time=state.trade_book["date_time"].map(format_date_time)).to_csv(book_file, index=False)
+            result["trade_book"] = str(book_file)
+        return result
+
+    state = generate_signals(
         strat,
         GLOB,
         high_csv,
         low_csv,
         trade_sheet,
         signal_csv,
-        low_time,
-        margin=get_cfg().backtester.margin,
-        leverage=get_cfg().backtester.leverage,
-        trailing=get_cfg().backtester.trailing,
-        slippage=get_cfg().backtester.slippage,
-        capital=get_cfg().backtester.capital,
-        # entry_date=datetime(2018, 1, 1),
-        # exit_date=datetime(2018, 2, 20),
+        **settings.engine_kwargs(),
+        metrics=accumulator,
+        open_times=open_time_table(high_csv, low_csv, settings.low_time, settings.high_time),
+        coarse=coarse_levels(low_csv, high_csv, settings.coarse_block) if settings.coarse_block else None,
+        range_index=load_range_index(config, high_csv, low_csv) if trees.get("enabled", False) else None,
+        event_driven=config.backtester.get("event_driven", False),
+        early_stop=early_stop,
+        resume=resume,
+        checkpoint=checkpoint,
+        checkpoint_every=checkpointing.get("every", 100),
     )
+    if checkpointing.get("enabled", False):
+        checkpoint_file.unlink(missing_ok=True)
 
     signal_csv = signal_csv.drop(columns=["signal_type"])
-    if get_cfg().backtester.print_metrics:
-        metrics(signal_csv)
+    if config.backtester.print_metrics:
+        metrics(signal_csv, config)
+    result = accumulator.result()
+    result["stopped"] = state.stopped
+    return result
 
 
-def metrics(signal_csv: pd.DataFrame):
+def metrics(signal_csv: pd.DataFrame, config: EasyDict):
     pprint(
         compute_metrics(
             signal_csv,
-            get_cfg().backtester.plots.show,
-            get_cfg().backtester.leverage,
-            get_cfg().backtester.slippage,
-            get_cfg().backtester.capital,
+            config.backtester.plots.show,
+            config.backtester.leverage,
+            config.backtester.slippage,
+            config.backtester.capital,
+            config.backtester.plots.path if config.backtester.plots.save else None,
         )
     )
-    # check_signal_file(signal_csv, get_cfg())
-
+    # check_signal_file(signal_csv, config)